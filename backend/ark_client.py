@@ -0,0 +1,158 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+from volcenginesdkarkruntime import Ark
+from volcenginesdkarkruntime._exceptions import ArkAPIConnectionError, ArkAPIStatusError
+
+import metrics
+
+
+# Ark 客户端配置，可通过环境变量调整
+ARK_BASE_URL = os.environ.get("ARK_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3")
+ARK_CONNECT_TIMEOUT = float(os.environ.get("ARK_CONNECT_TIMEOUT", "10"))
+ARK_READ_TIMEOUT = float(os.environ.get("ARK_READ_TIMEOUT", "300"))  # 长文本分镜生成耗时较长
+ARK_MAX_CONNECTIONS = int(os.environ.get("ARK_MAX_CONNECTIONS", "32"))
+
+# 重试策略：指数退避 + 随机抖动，服务端返回 Retry-After 时优先遵从
+ARK_MAX_RETRIES = int(os.environ.get("ARK_MAX_RETRIES", "4"))
+ARK_RETRY_BASE_DELAY = float(os.environ.get("ARK_RETRY_BASE_DELAY", "1"))
+ARK_RETRY_MAX_DELAY = float(os.environ.get("ARK_RETRY_MAX_DELAY", "30"))
+
+# 可重试的HTTP状态码：请求超时、冲突、限流和服务端错误
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def create_ark_client():
+    """
+    创建 Ark 客户端
+
+    使用连接池化的 httpx 客户端（保持长连接，避免每次请求重复TLS握手），
+    并关闭SDK自带的重试，统一由 call_with_retry 处理。
+    """
+    timeout = httpx.Timeout(ARK_READ_TIMEOUT, connect=ARK_CONNECT_TIMEOUT)
+    http_client = httpx.Client(
+        timeout=timeout,
+        limits=httpx.Limits(max_connections=ARK_MAX_CONNECTIONS,
+                            max_keepalive_connections=ARK_MAX_CONNECTIONS),
+    )
+    return Ark(
+        base_url=ARK_BASE_URL,
+        api_key=os.environ.get("ARK_API_KEY"),
+        timeout=timeout,
+        max_retries=0,
+        http_client=http_client,
+    )
+
+
+_ark_client = None
+_ark_client_lock = threading.Lock()
+
+
+def get_ark_client():
+    """获取进程内共享的 Ark 客户端（懒加载，线程安全）"""
+    global _ark_client
+    if _ark_client is None:
+        with _ark_client_lock:
+            if _ark_client is None:
+                _ark_client = create_ark_client()
+    return _ark_client
+
+
+def _retry_after_seconds(error):
+    """从错误响应中解析 Retry-After（秒数或HTTP日期），没有时返回None"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get('retry-after')
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttle_error(error):
+    """判断是否为限流错误（HTTP 429）"""
+    return isinstance(error, ArkAPIStatusError) and error.status_code == 429
+
+
+def is_retryable_error(error):
+    """判断错误是否值得重试（限流、服务端错误、连接错误和超时）"""
+    if isinstance(error, ArkAPIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (ArkAPIConnectionError, httpx.TransportError))
+
+
+def retry_delay(attempt, error=None):
+    """
+    计算第 attempt 次重试（从0开始）前的等待时间
+
+    服务端给出 Retry-After 时按其等待（不超过 ARK_RETRY_MAX_DELAY），
+    否则使用带完全抖动的指数退避，避免大量请求同时重试。
+    """
+    retry_after = _retry_after_seconds(error) if error is not None else None
+    if retry_after is not None:
+        return min(retry_after, ARK_RETRY_MAX_DELAY)
+    return random.uniform(0, min(ARK_RETRY_MAX_DELAY, ARK_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def call_with_retry(func, description="Ark请求", max_retries=None, limiter=None):
+    """
+    调用 func()，遇到可重试的错误时按退避策略重试
+
+    参数:
+        func: 发起请求的无参函数（每次重试都会重新调用）
+        description: 日志中的请求描述
+        max_retries: 最大重试次数，默认使用 ARK_MAX_RETRIES
+        limiter: 接口限流器（见 rate_limiter.get_limiter），每次请求前获取令牌，
+                 并把成功/限流结果反馈给限流器以自适应调整速率
+
+    返回:
+        func() 的返回值，重试用尽或遇到不可重试的错误时抛出最后一次的异常
+    """
+    if max_retries is None:
+        max_retries = ARK_MAX_RETRIES
+    endpoint = limiter.name if limiter is not None else 'ark'
+
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        metrics.inc('ark_requests_total', endpoint=endpoint)
+        try:
+            result = func()
+        except Exception as e:
+            status = getattr(e, 'status_code', None) or type(e).__name__
+            metrics.inc('ark_errors_total', endpoint=endpoint, status=status)
+            if limiter is not None and is_throttle_error(e):
+                limiter.on_throttle()
+            if attempt >= max_retries or not is_retryable_error(e):
+                raise
+            delay = retry_delay(attempt, e)
+            attempt += 1
+            metrics.inc('ark_retries_total', endpoint=endpoint)
+            print(f"{description}失败（{e}），{delay:.1f} 秒后进行第 {attempt} 次重试")
+            time.sleep(delay)
+            continue
+
+        if limiter is not None:
+            limiter.on_success()
+        return result
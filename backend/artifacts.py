@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+# 旧版本保存处理结果文件的根目录（现在结果保存在数据库中，只用于读取已有文件）
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", "artifacts")
+# 处理结果的内存LRU缓存上限
+ARTIFACT_CACHE_MAX_ENTRIES = int(os.environ.get("ARTIFACT_CACHE_MAX_ENTRIES", "256"))
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get("ARTIFACT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# 每次处理保存的结果：LLM分镜结果、连环画生成结果，以及后台任务处理的小说原文
+ARTIFACT_KINDS = ('llm', 'comic', 'novel')
+
+# ULID 使用的 Crockford Base32 字母表（去掉 I、L、O、U）
+ULID_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+# 合法的 process_id：ULID，或旧版本使用的时间戳格式（20251023_220613）
+PROCESS_ID_PATTERN = re.compile(r'^(?:[0-9A-HJKMNP-TV-Z]{26}|[0-9]{8}_[0-9]{6})$')
+
+
+def _encode_base32(value, length):
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(ULID_ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
+class ULIDGenerator:
+    """
+    ULID 生成器（48位毫秒时间戳 + 80位随机数，共26个字符）
+
+    按字符串排序即按生成时间排序；同一毫秒内生成的多个ID在随机部分上递增，
+    保证同一进程内严格单调、不会重复。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._last_random = 0
+
+    def new(self):
+        with self._lock:
+            now_ms = int(time.time() * 1000)
+            if now_ms <= self._last_ms:
+                # 同一毫秒（或系统时钟回拨）：沿用上一个时间戳，随机部分加一
+                now_ms = self._last_ms
+                self._last_random += 1
+                if self._last_random >= 1 << 80:
+                    now_ms += 1
+                    self._last_random = secrets.randbits(79)
+            else:
+                # 最高位留空，同一毫秒内有足够的递增空间
+                self._last_random = secrets.randbits(79)
+            self._last_ms = now_ms
+            return _encode_base32(now_ms, 10) + _encode_base32(self._last_random, 16)
+
+
+_ulid_generator = ULIDGenerator()
+
+
+def new_process_id():
+    """生成新的 process_id（ULID），多个用户同一秒提交也不会冲突"""
+    return _ulid_generator.new()
+
+
+def is_valid_process_id(process_id):
+    """检查 process_id 格式（同时防止拼接路径时出现 ../ 等内容）"""
+    return isinstance(process_id, str) and bool(PROCESS_ID_PATTERN.fullmatch(process_id))
+
+
+def artifact_dir(process_id, create=False, root=None):
+    """
+    返回某次处理的结果目录: <root>/<process_id哈希前两位>/<process_id>/
+
+    ULID 的前几位是时间戳，直接按前缀分片会集中到同一个目录，因此按哈希分成256个子目录，
+    单个目录下的条目数在结果很多时也保持在较小规模。
+    """
+    if not is_valid_process_id(process_id):
+        raise ValueError(f"无效的process_id: {process_id!r}")
+    shard = hashlib.sha1(process_id.encode('ascii')).hexdigest()[:2]
+    path = os.path.join(root or ARTIFACT_DIR, shard, process_id)
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def artifact_path(process_id, kind, create=False, root=None):
+    """返回某次处理的结果文件路径（kind 见 ARTIFACT_KINDS），create 为True时创建所在目录"""
+    if kind not in ARTIFACT_KINDS:
+        raise ValueError(f"未知的结果类型: {kind}")
+    return os.path.join(artifact_dir(process_id, create=create, root=root), f"{kind}.json")
+
+
+def find_artifact(process_id, kind, root=None):
+    """
+    查找某次处理的结果文件，不存在时返回None
+
+    先查找分片目录，再兼容旧版本保存在工作目录中的 <kind>_<process_id>.json。
+    """
+    if not is_valid_process_id(process_id):
+        return None
+    path = artifact_path(process_id, kind, root=root)
+    if os.path.exists(path):
+        return path
+    legacy_path = f"{kind}_{process_id}.json"
+    if os.path.exists(legacy_path):
+        return legacy_path
+    return None
+
+
+class ArtifactStore:
+    """
+    处理结果存储（LLM分镜结果、连环画结果和后台任务的小说原文）
+
+    结果以压缩后的JSON保存在数据库的 process_artifacts 表中（见 DatabaseManager.save_artifact），
+    多个服务实例共享同一份数据；读取时先查内存中的LRU缓存，缓存的是JSON文本，
+    结果接口可以直接返回而不必重新解析和序列化。
+    数据库中没有时兼容读取旧版本保存的结果文件。
+
+    参数:
+        db: DatabaseManager 实例
+        max_entries: 缓存的结果数上限
+        max_bytes: 缓存的JSON文本总字节数上限
+    """
+
+    def __init__(self, db, max_entries=ARTIFACT_CACHE_MAX_ENTRIES, max_bytes=ARTIFACT_CACHE_MAX_BYTES):
+        self.db = db
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # (process_id, kind) -> JSON文本
+        self._cache_bytes = 0
+
+    def _cache_put(self, key, text):
+        size = len(text)
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cache_bytes -= len(old)
+            if size > self.max_bytes:
+                return
+            self._cache[key] = text
+            self._cache_bytes += size
+            while len(self._cache) > self.max_entries or self._cache_bytes > self.max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+
+    def _cache_get(self, key):
+        with self._lock:
+            text = self._cache.get(key)
+            if text is not None:
+                self._cache.move_to_end(key)
+            return text
+
+    def put(self, process_id, kind, value, overwrite=True):
+        """
+        保存处理结果
+
+        参数:
+            value: 可JSON序列化的结果
+            overwrite: 已存在时是否覆盖，为False时只在第一次写入
+
+        返回:
+            是否写入数据库
+        """
+        if kind not in ARTIFACT_KINDS:
+            raise ValueError(f"未知的结果类型: {kind}")
+        key = (process_id, kind)
+        if not overwrite and self._cache_get(key) is not None:
+            return False
+        text = json.dumps(value, ensure_ascii=False)
+        written = self.db.save_artifact(process_id, kind, text, overwrite=overwrite)
+        if written:
+            self._cache_put(key, text)
+        return written
+
+    def get_text(self, process_id, kind):
+        """读取处理结果的JSON文本，不存在时返回None"""
+        if not is_valid_process_id(process_id) or kind not in ARTIFACT_KINDS:
+            return None
+        key = (process_id, kind)
+        text = self._cache_get(key)
+        if text is not None:
+            metrics.inc('cache_requests_total', cache='artifact', result='hit')
+            return text
+        metrics.inc('cache_requests_total', cache='artifact', result='miss')
+
+        text = self.db.get_artifact(process_id, kind)
+        if text is None:
+            legacy_path = find_artifact(process_id, kind)
+            if legacy_path is None:
+                return None
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        self._cache_put(key, text)
+        return text
+
+    def get(self, process_id, kind):
+        """读取并解析处理结果，不存在或无法解析时返回None"""
+        text = self.get_text(process_id, kind)
+        if text is None:
+            return None
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            print(f"处理结果 {process_id}/{kind} 无法解析: {e}")
+            return None
@@ -0,0 +1,179 @@
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+
+# 批量处理配置，可通过环境变量调整
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "4"))
+BATCH_MANIFEST_NAME = "batch_manifest.json"
+BATCH_REPORT_NAME = "batch_report.json"
+
+
+class BatchRunner:
+    """
+    可断点续跑的批量处理引擎
+
+    并行处理输入目录中的文件，每个文件完成后立即把状态写入输出目录下的清单文件
+    （batch_manifest.json）。重新运行时，已成功且输入文件未变化、输出文件仍存在的文件会被跳过，
+    中途失败或被中断的文件会重新处理。运行结束后生成汇总报告（batch_report.json）。
+
+    LLM和图片生成都是网络等待为主，且需要共享进程内的限流器和缓存，因此使用线程池。
+
+    参数:
+        input_folder: 输入目录
+        output_folder: 输出目录（同时存放清单和报告）
+        process_file: 处理单个文件的函数，签名为 process_file(input_path, base_name)，
+                      成功时返回输出文件路径列表，失败时返回None或抛出异常
+        extension: 需要处理的文件扩展名
+        max_workers: 并行处理的文件数
+    """
+
+    def __init__(self, input_folder, output_folder, process_file, extension='.txt', max_workers=None):
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+        self.process_file = process_file
+        self.extension = extension
+        self.max_workers = max(1, max_workers or BATCH_WORKERS)
+        self.manifest_path = os.path.join(output_folder, BATCH_MANIFEST_NAME)
+        self.report_path = os.path.join(output_folder, BATCH_REPORT_NAME)
+        self._lock = threading.Lock()
+        self.manifest = {}
+
+    def load_manifest(self):
+        """读取上次运行的清单，不存在或损坏时从头开始"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f).get('files', {})
+        except FileNotFoundError:
+            self.manifest = {}
+        except (json.JSONDecodeError, AttributeError) as e:
+            print(f"批量清单损坏，将重新处理所有文件: {e}")
+            self.manifest = {}
+        return self.manifest
+
+    def _save_manifest(self):
+        # 先写临时文件再替换，中断时不会留下不完整的清单
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'updated_at': datetime.now().isoformat(), 'files': self.manifest},
+                      f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def _fingerprint(input_path):
+        stat = os.stat(input_path)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def is_completed(self, filename, input_path):
+        """判断文件是否已在之前的运行中成功处理"""
+        entry = self.manifest.get(filename)
+        if not entry or entry.get('status') != 'done':
+            return False
+        if entry.get('input') != self._fingerprint(input_path):
+            return False
+        return all(os.path.exists(path) for path in entry.get('outputs', []))
+
+    def _record(self, filename, entry):
+        with self._lock:
+            self.manifest[filename] = entry
+            self._save_manifest()
+
+    def _run_one(self, filename):
+        input_path = os.path.join(self.input_folder, filename)
+        base_name = os.path.splitext(filename)[0]
+        fingerprint = self._fingerprint(input_path)
+        self._record(filename, {'status': 'running', 'input': fingerprint,
+                                'started_at': datetime.now().isoformat()})
+
+        print(f"正在处理: {filename}")
+        started = time.time()
+        error = None
+        outputs = None
+        try:
+            outputs = self.process_file(input_path, base_name)
+            if not outputs:
+                error = "处理失败"
+        except Exception as e:
+            traceback.print_exc()
+            error = str(e)
+
+        entry = {
+            'status': 'failed' if error else 'done',
+            'input': fingerprint,
+            'outputs': list(outputs or []),
+            'seconds': round(time.time() - started, 3),
+            'finished_at': datetime.now().isoformat()
+        }
+        if error:
+            entry['error'] = error
+            print(f"处理失败: {filename} ({error})")
+        else:
+            print(f"处理完成: {filename}，耗时 {entry['seconds']} 秒")
+        self._record(filename, entry)
+        return filename, entry
+
+    def run(self):
+        """
+        执行批量处理
+
+        返回:
+            汇总报告字典（同时写入 batch_report.json）
+        """
+        os.makedirs(self.output_folder, exist_ok=True)
+        self.load_manifest()
+
+        filenames = sorted(name for name in os.listdir(self.input_folder) if name.endswith(self.extension))
+        pending = []
+        skipped = []
+        for filename in filenames:
+            if self.is_completed(filename, os.path.join(self.input_folder, filename)):
+                skipped.append(filename)
+            else:
+                pending.append(filename)
+
+        if skipped:
+            print(f"跳过 {len(skipped)} 个已完成的文件")
+        print(f"待处理文件: {len(pending)} 个，并行数: {self.max_workers}")
+
+        started = time.time()
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch") as executor:
+            futures = [executor.submit(self._run_one, filename) for filename in pending]
+            for future in as_completed(futures):
+                filename, entry = future.result()
+                results[filename] = entry
+
+        report = {
+            'input_folder': self.input_folder,
+            'output_folder': self.output_folder,
+            'finished_at': datetime.now().isoformat(),
+            'wall_seconds': round(time.time() - started, 3),
+            'total': len(filenames),
+            'processed': len(pending),
+            'succeeded': sum(1 for entry in results.values() if entry['status'] == 'done'),
+            'failed': sum(1 for entry in results.values() if entry['status'] == 'failed'),
+            'skipped': skipped,
+            'files': {filename: results[filename] for filename in sorted(results)}
+        }
+
+        with open(self.report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        self.print_report(report)
+        return report
+
+    @staticmethod
+    def print_report(report):
+        """在控制台打印汇总报告"""
+        print("=" * 50)
+        print(f"批量处理完成：共 {report['total']} 个文件，本次处理 {report['processed']} 个，"
+              f"成功 {report['succeeded']} 个，失败 {report['failed']} 个，跳过 {len(report['skipped'])} 个")
+        print(f"总耗时: {report['wall_seconds']} 秒")
+        for filename, entry in report['files'].items():
+            status = "成功" if entry['status'] == 'done' else f"失败: {entry.get('error')}"
+            print(f"  {filename}: {entry['seconds']} 秒，{status}")
+        print("=" * 50)
@@ -0,0 +1,320 @@
+"""
+本地 Ark 接口替身，用于离线压测和端到端调试
+
+模拟 chat/completions（含SSE流式输出）、上下文缓存（context/create 和 context/chat/completions）
+以及 images/generations 接口，延迟、错误率和流式分块大小均可配置，不消耗真实的API额度。
+LLM请求的预填充耗时按未命中缓存的输入长度计算，可以对比使用前缀缓存前后的首字延迟。
+
+独立运行:
+    python benchmarks/mock_ark_server.py --port 8799 --llm-latency 3 --image-latency 2
+然后让后端指向它:
+    ARK_BASE_URL=http://127.0.0.1:8799/api/v3 ARK_API_KEY=mock python main_api.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _tiny_png(seed):
+    """生成一张 1x1 的PNG图片，颜色由seed决定（不同场景得到不同内容）"""
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    digest = hashlib.sha256(seed.encode('utf-8')).digest()
+    raw = b'\x00' + digest[:3]
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw))
+            + chunk(b'IEND', b''))
+
+
+class MockArkConfig:
+    """
+    替身服务的行为配置
+
+    参数:
+        llm_latency: 非流式LLM请求的总耗时（秒）；流式请求在首个分块前等待其十分之一
+        image_latency: 每次图片生成的耗时（秒）
+        error_rate: 请求返回错误的概率（0~1），错误中一半为429（带Retry-After），一半为500
+        chunk_size: 流式输出每个分块的字符数
+        chunk_delay: 流式输出分块之间的间隔（秒）
+        scenes: 每次分镜返回的场景数
+        jitter: 延迟的随机浮动比例
+        prefill_per_1k: 每1000个未命中缓存的输入token（按字符数近似）增加的预填充耗时（秒）
+    """
+
+    def __init__(self, llm_latency=2.0, image_latency=1.0, error_rate=0.0, chunk_size=20,
+                 chunk_delay=0.02, scenes=6, jitter=0.1, prefill_per_1k=0.2):
+        self.llm_latency = llm_latency
+        self.image_latency = image_latency
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.scenes = scenes
+        self.jitter = jitter
+        self.prefill_per_1k = prefill_per_1k
+
+
+def build_storyboard(novel_text, scenes):
+    """根据输入文本确定性地生成分镜JSON（相同文本得到相同结果）"""
+    tag = hashlib.sha256(novel_text.encode('utf-8')).hexdigest()[:8]
+    return {
+        "character_consistency": {"主角": f"角色设定-{tag}"},
+        "environment_consistency": {"场景": f"环境设定-{tag}"},
+        "scenes_detail": [f"图片{i + 1}：{tag} 第{i + 1}个分镜画面描述" for i in range(scenes)]
+    }
+
+
+class MockArkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockArk/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def _sleep(self, seconds):
+        if seconds > 0:
+            jitter = self.config.jitter
+            time.sleep(seconds * random.uniform(1 - jitter, 1 + jitter))
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _maybe_fail(self):
+        """按错误率返回429或500，返回True表示已经响应错误"""
+        if random.random() >= self.config.error_rate:
+            return False
+        self.server.record('errors')
+        if random.random() < 0.5:
+            self._send_json(429, {"error": {"code": "RateLimitExceeded", "message": "mock throttled"}},
+                            {'Retry-After': '1'})
+        else:
+            self._send_json(500, {"error": {"code": "InternalServiceError", "message": "mock failure"}})
+        return True
+
+    def do_GET(self):
+        if self.path.startswith('/images/'):
+            body = _tiny_png(self.path)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/__stats':
+            self._send_json(200, self.server.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+
+        if self.path.endswith('/context/create'):
+            self.server.record('context_create')
+            if not self._maybe_fail():
+                self._create_context(request)
+        elif self.path.endswith('/context/chat/completions'):
+            self.server.record('context_chat')
+            if not self._maybe_fail():
+                self._context_chat(request)
+        elif self.path.endswith('/chat/completions'):
+            self.server.record('chat')
+            if not self._maybe_fail():
+                self._chat(request)
+        elif self.path.endswith('/images/generations'):
+            self.server.record('images')
+            if not self._maybe_fail():
+                self._image(request)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    @staticmethod
+    def _prompt_length(messages):
+        return sum(len(message.get('content') or '') for message in messages)
+
+    def _prefill(self, tokens):
+        return self.config.prefill_per_1k * tokens / 1000
+
+    def _create_context(self, request):
+        messages = request.get('messages') or []
+        if request.get('mode') not in ('session', 'common_prefix') or not messages:
+            self._send_json(400, {"error": {"code": "InvalidParameter", "message": "invalid context request"}})
+            return
+        ttl = int(request.get('ttl') or 86400)
+        prompt_tokens = self._prompt_length(messages)
+        self._sleep(self._prefill(prompt_tokens))
+        context_id = self.server.create_context(messages, ttl)
+        self._send_json(200, {
+            "id": context_id, "model": request.get('model', 'mock-llm'), "mode": request['mode'], "ttl": ttl,
+            "truncation_strategy": {"type": "last_history_tokens", "last_history_tokens": 4096},
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 0, "total_tokens": prompt_tokens}
+        })
+
+    def _context_chat(self, request):
+        prefix = self.server.get_context(request.get('context_id'))
+        if prefix is None:
+            self._send_json(404, {"error": {"code": "InvalidParameter.ContextNotFound",
+                                            "message": "context not found or expired"}})
+            return
+        self._chat(request, prefix)
+
+    def _chat(self, request, prefix=None):
+        messages = request.get('messages') or [{}]
+        novel_text = messages[-1].get('content', '')
+        content = json.dumps(build_storyboard(novel_text, self.config.scenes), ensure_ascii=False)
+        model = request.get('model', 'mock-llm')
+        created = int(time.time())
+
+        # 前缀缓存中的部分不需要重新预填充
+        cached_tokens = self._prompt_length(prefix or [])
+        prompt_tokens = cached_tokens + self._prompt_length(messages)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content),
+                 "total_tokens": prompt_tokens + len(content),
+                 "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        prefill = self._prefill(prompt_tokens - cached_tokens)
+
+        if not request.get('stream'):
+            self._sleep(self.config.llm_latency + prefill)
+            self._send_json(200, {
+                "id": "mock-chat", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage
+            })
+            return
+
+        # SSE 流式输出
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        self._sleep(self.config.llm_latency / 10 + prefill)
+
+        size = max(1, self.config.chunk_size)
+        for start in range(0, len(content), size):
+            data = {
+                "id": "mock-chat", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[start:start + size]}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            self._sleep(self.config.chunk_delay)
+        if (request.get('stream_options') or {}).get('include_usage'):
+            data = {"id": "mock-chat", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [], "usage": usage}
+            self.wfile.write(f"data: {json.dumps(data)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _image(self, request):
+        self._sleep(self.config.image_latency)
+        prompt = request.get('prompt', '')
+        name = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+        host, port = self.server.server_address[:2]
+        self._send_json(200, {
+            "model": request.get('model', 'mock-image'),
+            "created": int(time.time()),
+            "data": [{"url": f"http://{host}:{port}/images/{name}.png", "size": "1x1"}],
+            "usage": {"generated_images": 1, "output_tokens": 1, "total_tokens": 1}
+        })
+
+
+class MockArkServer(ThreadingHTTPServer):
+    """带请求计数的替身服务"""
+
+    daemon_threads = True
+
+    def __init__(self, address, config=None):
+        super().__init__(address, MockArkHandler)
+        self.config = config or MockArkConfig()
+        self._stats = {'chat': 0, 'context_create': 0, 'context_chat': 0, 'images': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+        self._contexts = {}  # context_id -> (消息列表, 过期时间)
+
+    def record(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def create_context(self, messages, ttl):
+        context_id = f"ctx-{uuid.uuid4().hex[:16]}"
+        with self._stats_lock:
+            now = time.monotonic()
+            self._contexts = {key: value for key, value in self._contexts.items() if value[1] > now}
+            self._contexts[context_id] = (messages, now + ttl)
+        return context_id
+
+    def get_context(self, context_id):
+        """返回上下文中缓存的消息，不存在或已过期时返回None"""
+        with self._stats_lock:
+            entry = self._contexts.get(context_id)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def snapshot(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v3"
+
+
+def start_mock_server(config=None, host='127.0.0.1', port=0):
+    """在后台线程中启动替身服务，port为0时自动选择端口，返回服务实例"""
+    server = MockArkServer((host, port), config)
+    thread = threading.Thread(target=server.serve_forever, name="mock-ark", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 Ark 接口替身")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--llm-latency', type=float, default=2.0)
+    parser.add_argument('--image-latency', type=float, default=1.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--chunk-size', type=int, default=20)
+    parser.add_argument('--chunk-delay', type=float, default=0.02)
+    parser.add_argument('--scenes', type=int, default=6)
+    parser.add_argument('--prefill-per-1k', type=float, default=0.2)
+    args = parser.parse_args()
+
+    config = MockArkConfig(args.llm_latency, args.image_latency, args.error_rate,
+                           args.chunk_size, args.chunk_delay, args.scenes,
+                           prefill_per_1k=args.prefill_per_1k)
+    server = MockArkServer((args.host, args.port), config)
+    print(f"Mock Ark 服务已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
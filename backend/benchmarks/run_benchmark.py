@@ -0,0 +1,455 @@
+"""
+离线端到端压测
+
+在本地启动 Ark 接口替身（mock_ark_server）和后端服务，按指定并发驱动三种流程，
+统计端到端延迟的 p50/p95/p99、吞吐量和各阶段耗时：
+
+    rest    POST /api/full-process 提交任务并轮询 /api/jobs/<job_id> 直到完成
+    socket  Socket.IO 完整流程（认证 -> full_process -> start_comics_generation -> full_process_complete）
+    batch   batch_process_novels_to_comics 批量处理临时目录中的小说文件
+
+所有数据库、缓存和输出文件都写在临时工作目录中，不会影响仓库里的数据。
+
+示例:
+    python benchmarks/run_benchmark.py --scenario rest --requests 20 --concurrency 4
+    python benchmarks/run_benchmark.py --scenario socket --pipelined --llm-latency 3 --image-latency 2
+    python benchmarks/run_benchmark.py --scenario all --json-output report.json
+    python benchmarks/run_benchmark.py --scenario socket --no-prompt-cache   # 对比关闭前缀缓存时的首字延迟
+"""
+import argparse
+import contextlib
+import json
+import logging
+import math
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.append(BENCHMARK_DIR)
+sys.path.append(BACKEND_DIR)
+
+from mock_ark_server import MockArkConfig, start_mock_server  # noqa: E402
+
+SCENARIOS = ('rest', 'socket', 'batch')
+POLL_INTERVAL = 0.05
+
+
+def percentile(values, pct):
+    """最近秩法计算百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values):
+    """汇总一组耗时（秒）"""
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values)
+    }
+
+
+def make_novel_text(index, paragraphs):
+    """生成互不相同的测试文本，避免命中LLM缓存"""
+    tag = uuid.uuid4().hex[:8]
+    lines = [f"第{index + 1}章 压测样例 {tag}"]
+    for i in range(paragraphs):
+        lines.append(f"这是第{index + 1}篇测试小说的第{i + 1}段，主角在雨夜里走过长街，路灯把影子拉得很长。")
+    return '\n'.join(lines)
+
+
+class StageRecorder:
+    """记录单个请求各阶段的完成时刻"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.marks = {}
+
+    def mark(self, stage):
+        self.marks.setdefault(stage, time.perf_counter() - self.started)
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+
+class ScenarioResult:
+    """一个场景的压测结果"""
+
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency
+        self.latencies = []
+        self.stages = {}
+        self.errors = []
+        self.wall_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, recorder=None, error=None):
+        with self._lock:
+            if error:
+                self.errors.append(str(error))
+                return
+            self.latencies.append(recorder.total())
+            for stage, seconds in recorder.marks.items():
+                self.stages.setdefault(stage, []).append(seconds)
+
+    def to_dict(self):
+        completed = len(self.latencies)
+        return {
+            'scenario': self.name,
+            'concurrency': self.concurrency,
+            'completed': completed,
+            'errors': len(self.errors),
+            'error_samples': self.errors[:5],
+            'wall_seconds': self.wall_seconds,
+            'throughput_per_min': completed * 60 / self.wall_seconds if self.wall_seconds else 0.0,
+            'latency': summarize(self.latencies),
+            'stages': {stage: summarize(values) for stage, values in self.stages.items()}
+        }
+
+
+def _fmt(value):
+    return '-' if value is None else f"{value:.3f}"
+
+
+def print_result(report):
+    """在控制台打印一个场景的统计结果"""
+    print("=" * 60)
+    print(f"场景: {report['scenario']}  并发: {report['concurrency']}  "
+          f"完成: {report['completed']}  失败: {report['errors']}")
+    print(f"总耗时: {report['wall_seconds']:.2f} 秒  吞吐量: {report['throughput_per_min']:.1f} 次/分钟")
+    print("各阶段为距请求开始的秒数")
+    print(f"{'阶段':<24}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}{'max':>10}")
+    rows = [('end_to_end', report['latency'])]
+    rows += sorted(report['stages'].items(), key=lambda item: item[1].get('p50') or 0)
+    for stage, stats in rows:
+        if not stats.get('count'):
+            continue
+        print(f"{stage:<24}{_fmt(stats['p50']):>10}{_fmt(stats['p95']):>10}{_fmt(stats['p99']):>10}"
+              f"{_fmt(stats['mean']):>10}{_fmt(stats['max']):>10}")
+    for error in report['error_samples']:
+        print(f"  错误: {error}")
+    print("=" * 60)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class BenchmarkBackend:
+    """
+    在当前进程中启动后端服务
+
+    必须在导入后端模块之前设置环境变量（Ark地址、限流和工作线程数等都在导入时读取），
+    并切换到临时工作目录，使数据库和缓存文件都落在临时目录中。
+    """
+
+    def __init__(self, args, ark_base_url, workdir):
+        os.environ['ARK_BASE_URL'] = ark_base_url
+        os.environ.setdefault('ARK_API_KEY', 'mock')
+        os.environ['FLASK_DEBUG'] = '0'
+        os.environ['JOB_WORKERS'] = str(args.job_workers)
+        os.environ['PROMPT_CACHE_ENABLED'] = '0' if args.no_prompt_cache else '1'
+        # 压测关注服务本身的吞吐，默认放开客户端限流，可通过环境变量覆盖
+        os.environ.setdefault('SEEDREAM_QPS', '1000')
+        os.environ.setdefault('SEEDREAM_BURST', '1000')
+        os.environ.setdefault('DOUBAO_QPS', '1000')
+        os.environ.setdefault('DOUBAO_BURST', '1000')
+        os.chdir(workdir)
+        if not args.verbose:
+            for name in ('werkzeug', 'engineio', 'socketio'):
+                logging.getLogger(name).setLevel(logging.ERROR)
+
+        import main_api
+        import main_controller
+        self.main_api = main_api
+        self.main_controller = main_controller
+        main_api.initialize_backend()
+
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        thread = threading.Thread(
+            target=main_api.socketio.run,
+            args=(main_api.app,),
+            kwargs={'host': '127.0.0.1', 'port': self.port, 'debug': False, 'use_reloader': False,
+                    'log_output': False, 'allow_unsafe_werkzeug': True},
+            name="benchmark-server",
+            daemon=True
+        )
+        thread.start()
+        self._wait_until_ready()
+
+    def _wait_until_ready(self, timeout=10):
+        import requests
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if requests.get(f"{self.base_url}/api/health", timeout=1).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError("后端服务启动超时")
+
+    def create_session(self, username, password='benchmark'):
+        """注册并登录一个压测用户，返回会话令牌"""
+        import requests
+        requests.post(f"{self.base_url}/api/register", json={'username': username, 'password': password})
+        response = requests.post(f"{self.base_url}/api/login", json={'username': username, 'password': password})
+        response.raise_for_status()
+        return response.json()['session_token']
+
+
+def run_rest_scenario(backend, args, tokens):
+    """REST流程：提交 full-process 任务并轮询任务状态"""
+    import requests
+    result = ScenarioResult('rest', args.concurrency)
+
+    def one(index):
+        session = requests.Session()
+        session.headers['Authorization'] = f"Bearer {tokens[index % len(tokens)]}"
+        recorder = StageRecorder()
+        try:
+            response = session.post(f"{backend.base_url}/api/full-process", json={
+                'novel_text': make_novel_text(index, args.paragraphs),
+                'title': f"benchmark-{index}",
+                'pipelined': args.pipelined
+            })
+            if response.status_code != 202:
+                raise RuntimeError(f"提交失败: HTTP {response.status_code} {response.text[:200]}")
+            recorder.mark('submitted')
+            job_id = response.json()['job_id']
+
+            deadline = time.time() + args.timeout
+            while time.time() < deadline:
+                job = session.get(f"{backend.base_url}/api/jobs/{job_id}").json()
+                if job['status'] == 'running':
+                    recorder.mark('job_started')
+                elif job['status'] == 'done':
+                    recorder.mark('job_started')
+                    result.add(recorder)
+                    return
+                elif job['status'] == 'failed':
+                    raise RuntimeError(f"任务失败: {job['error']}")
+                time.sleep(POLL_INTERVAL)
+            raise TimeoutError(f"任务 {job_id} 超时")
+        except Exception as e:
+            result.add(error=e)
+
+    _run_concurrently(result, one, args)
+    return result
+
+
+def run_socket_scenario(backend, args, tokens):
+    """Socket.IO流程：记录首个分镜、文本完成、首张图片和全部完成的时间"""
+    import socketio
+    result = ScenarioResult('socket', args.concurrency)
+
+    def one(index):
+        client = socketio.Client(reconnection=False)
+        recorder = StageRecorder()
+        done = threading.Event()
+        state = {}
+
+        @client.on('authentication_result')
+        def on_auth(data):
+            state['auth'] = data
+            done.set()
+
+        @client.on('scene_ready')
+        def on_scene(data):
+            recorder.mark('first_scene')
+
+        @client.on('full_process_text_complete')
+        def on_text_complete(data):
+            recorder.mark('text_complete')
+            if not args.pipelined:
+                client.emit('start_comics_generation', {'process_id': data['process_id']})
+
+        @client.on('full_process_progress')
+        def on_progress(data):
+            recorder.mark('first_image')
+
+        @client.on('full_process_complete')
+        def on_complete(data):
+            state['complete'] = data
+            done.set()
+
+        @client.on('full_process_error')
+        def on_error(data):
+            state['error'] = data.get('error')
+            done.set()
+
+        @client.on('generation_error')
+        def on_generation_error(data):
+            state['error'] = data.get('error')
+            done.set()
+
+        try:
+            client.connect(backend.base_url, transports=['polling'], wait_timeout=10)
+            client.emit('authenticate', {'session_token': tokens[index % len(tokens)]})
+            if not done.wait(10) or not state['auth'].get('success'):
+                raise RuntimeError(f"认证失败: {state.get('auth')}")
+            done.clear()
+
+            recorder = StageRecorder()
+            client.emit('full_process', {
+                'novel_text': make_novel_text(index, args.paragraphs),
+                'title': f"benchmark-{index}",
+                'pipelined': args.pipelined
+            })
+            if not done.wait(args.timeout):
+                raise TimeoutError("等待 full_process_complete 超时")
+            if 'error' in state:
+                raise RuntimeError(state['error'])
+            result.add(recorder)
+        except Exception as e:
+            result.add(error=e)
+        finally:
+            client.disconnect()
+
+    _run_concurrently(result, one, args)
+    return result
+
+
+def run_batch_scenario(backend, args, workdir):
+    """批量流程：每个文件的处理耗时取自批量报告"""
+    result = ScenarioResult('batch', args.concurrency)
+    input_folder = os.path.join(workdir, 'batch_input')
+    output_folder = os.path.join(workdir, 'batch_output')
+    os.makedirs(input_folder, exist_ok=True)
+    for index in range(args.requests):
+        with open(os.path.join(input_folder, f"novel_{index:04d}.txt"), 'w', encoding='utf-8') as f:
+            f.write(make_novel_text(index, args.paragraphs))
+
+    started = time.perf_counter()
+    report = backend.main_controller.batch_process_novels_to_comics(
+        input_folder, output_folder, backend.main_api.get_processing_rules(), max_workers=args.concurrency)
+    result.wall_seconds = time.perf_counter() - started
+
+    for filename, entry in report['files'].items():
+        if entry['status'] == 'done':
+            result.latencies.append(entry['seconds'])
+        else:
+            result.errors.append(f"{filename}: {entry.get('error')}")
+    return result
+
+
+def _run_concurrently(result, func, args):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="bench") as executor:
+        list(executor.map(func, range(args.requests)))
+    result.wall_seconds = time.perf_counter() - started
+
+
+@contextlib.contextmanager
+def quiet_output(enabled):
+    """压测期间屏蔽后端的控制台输出，只保留统计结果"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="小说转连环画后端离线压测")
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument('--requests', type=int, default=10, help="每个场景的请求（文件）数")
+    parser.add_argument('--concurrency', type=int, default=4, help="并发用户数（batch场景为并行文件数）")
+    parser.add_argument('--users', type=int, default=None, help="压测用户数，默认与并发数相同")
+    parser.add_argument('--job-workers', type=int, default=4, help="后台任务工作线程数")
+    parser.add_argument('--pipelined', action='store_true', help="使用流水线模式（流式分镜时即开始生成图片）")
+    parser.add_argument('--paragraphs', type=int, default=20, help="每篇测试小说的段落数")
+    parser.add_argument('--timeout', type=float, default=300, help="单个请求的超时秒数")
+    parser.add_argument('--ark-url', default=None, help="使用已启动的 Ark 替身服务，例如 http://127.0.0.1:8799/api/v3")
+    parser.add_argument('--llm-latency', type=float, default=2.0)
+    parser.add_argument('--image-latency', type=float, default=1.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--chunk-size', type=int, default=20)
+    parser.add_argument('--chunk-delay', type=float, default=0.02)
+    parser.add_argument('--scenes', type=int, default=6)
+    parser.add_argument('--prefill-per-1k', type=float, default=0.2,
+                        help="替身服务每1000个未缓存输入token的预填充耗时（秒）")
+    parser.add_argument('--no-prompt-cache', action='store_true', help="关闭系统提示词前缀缓存，用于对比")
+    parser.add_argument('--json-output', default=None, help="把统计结果写入JSON文件")
+    parser.add_argument('--keep-workdir', action='store_true', help="保留临时工作目录（数据库、输出文件）")
+    parser.add_argument('--verbose', action='store_true', help="显示后端日志")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    json_output = os.path.abspath(args.json_output) if args.json_output else None
+    scenarios = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+
+    mock = None
+    ark_url = args.ark_url
+    if not ark_url:
+        mock = start_mock_server(MockArkConfig(args.llm_latency, args.image_latency, args.error_rate,
+                                               args.chunk_size, args.chunk_delay, args.scenes,
+                                               prefill_per_1k=args.prefill_per_1k))
+        ark_url = mock.base_url
+    print(f"Ark 替身服务: {ark_url}")
+
+    workdir = tempfile.mkdtemp(prefix="babybus_bench_")
+    reports = []
+    try:
+        with quiet_output(not args.verbose):
+            backend = BenchmarkBackend(args, ark_url, workdir)
+            tokens = [backend.create_session(f"bench_{uuid.uuid4().hex[:8]}")
+                      for _ in range(args.users or args.concurrency)]
+
+        for name in scenarios:
+            print(f"正在运行场景: {name} ...")
+            with quiet_output(not args.verbose):
+                if name == 'rest':
+                    result = run_rest_scenario(backend, args, tokens)
+                elif name == 'socket':
+                    result = run_socket_scenario(backend, args, tokens)
+                else:
+                    result = run_batch_scenario(backend, args, workdir)
+            report = result.to_dict()
+            print_result(report)
+            reports.append(report)
+    finally:
+        os.chdir(BACKEND_DIR)
+        if args.keep_workdir:
+            print(f"工作目录: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = {
+        'config': vars(args),
+        'mock_stats': mock.snapshot() if mock else None,
+        'scenarios': reports
+    }
+    if mock:
+        print(f"替身服务请求统计: {summary['mock_stats']}")
+    if json_output:
+        with open(json_output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {json_output}")
+    return summary
+
+
+if __name__ == '__main__':
+    main()
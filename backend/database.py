@@ -1,89 +1,511 @@
 import sqlite3
 import json
-from datetime import datetime
+import base64
+import queue
+import random
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import wraps
 import os
 
+import metrics
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，未安装时使用zlib压缩
+    zstandard = None
+
+
+# 连接池和SQLite调优配置，可通过环境变量调整
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))  # 最多保留的空闲连接数
+DB_BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", "5"))  # 等待锁的秒数
+DB_BUSY_RETRIES = int(os.environ.get("DB_BUSY_RETRIES", "3"))  # 锁等待超时后的重试次数
+DB_CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", "16384"))  # 每个连接的页缓存大小
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # 内存映射读取的大小
+DB_STATEMENT_CACHE = 128  # 每个连接缓存的预编译语句数
+HISTORY_COUNT_CACHE_TTL = float(os.environ.get("HISTORY_COUNT_CACHE_TTL", "60"))  # 历史记录计数缓存秒数
+# 大字段的压缩算法（zstd 需要安装 zstandard，否则使用 zlib）和压缩级别
+DB_COMPRESSION = os.environ.get("DB_COMPRESSION", "zstd" if zstandard else "zlib")
+DB_COMPRESSION_LEVEL = int(os.environ.get("DB_COMPRESSION_LEVEL", "6"))
+DB_COMPRESSION_MIN_BYTES = 256  # 短于此长度的内容不压缩
+# 连环画各场景提示词的公共前缀（角色和环境一致性描述）短于此长度时不单独提取
+PROMPT_PREFIX_MIN_CHARS = 32
+
+
+def compress_bytes(data, encoding=None):
+    """按指定算法（zstd/zlib/none，默认 DB_COMPRESSION）压缩数据"""
+    encoding = encoding or DB_COMPRESSION
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise ValueError("使用zstd压缩需要安装 zstandard")
+        return zstandard.ZstdCompressor(level=DB_COMPRESSION_LEVEL).compress(data)
+    if encoding == 'zlib':
+        return zlib.compress(data, DB_COMPRESSION_LEVEL)
+    if encoding == 'none':
+        return data
+    raise ValueError(f"未知的压缩编码: {encoding}")
+
+
+def decompress_bytes(data, encoding):
+    """还原 compress_bytes 压缩的数据"""
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise ValueError("数据使用zstd压缩，读取需要安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if encoding == 'zlib':
+        return zlib.decompress(data)
+    if encoding == 'none':
+        return data.encode('utf-8') if isinstance(data, str) else data
+    raise ValueError(f"未知的压缩编码: {encoding}")
+
+
+def compress_text(text):
+    """压缩要存入数据库的文本，返回 (数据, 编码)；内容很短时不压缩"""
+    data = text.encode('utf-8')
+    if len(data) < DB_COMPRESSION_MIN_BYTES:
+        return data, 'none'
+    return compress_bytes(data), DB_COMPRESSION
+
+
+def decompress_text(data, encoding):
+    """还原 compress_text 压缩的文本"""
+    if encoding == 'none' and isinstance(data, str):
+        return data
+    return decompress_bytes(data, encoding).decode('utf-8')
+
+
+def pack_comic_results(comic_results):
+    """
+    把各场景提示词中相同的前缀（角色和环境一致性描述）提取出来只保存一次
+
+    返回 {'prompt_prefix': 前缀, 'results': [...]}，其中每个场景的 prompt 只保留前缀之后的部分；
+    场景少于两个或没有足够长的公共前缀时原样返回。
+    """
+    if not isinstance(comic_results, list) or len(comic_results) < 2:
+        return comic_results
+    if not all(isinstance(item, dict) and isinstance(item.get('prompt'), str) for item in comic_results):
+        return comic_results
+
+    prefix = os.path.commonprefix([item['prompt'] for item in comic_results])
+    if len(prefix) < PROMPT_PREFIX_MIN_CHARS:
+        return comic_results
+    return {
+        'prompt_prefix': prefix,
+        'results': [dict(item, prompt=item['prompt'][len(prefix):]) for item in comic_results]
+    }
+
+
+def unpack_comic_results(data):
+    """还原 pack_comic_results 的结果（旧记录中的列表原样返回）"""
+    if isinstance(data, dict) and 'prompt_prefix' in data:
+        prefix = data['prompt_prefix']
+        return [dict(item, prompt=prefix + item.get('prompt', '')) for item in data.get('results', [])]
+    return data
+
+
+def encode_history_fields(novel_text, llm_result, comic_results, encoding=None):
+    """把历史记录的小说原文、LLM结果和连环画结果编码为压缩后的数据，返回 (编码, 原文, LLM结果, 连环画结果)"""
+    encoding = encoding or DB_COMPRESSION
+    fields = (
+        novel_text or '',
+        json.dumps(llm_result, ensure_ascii=False, separators=(',', ':')),
+        json.dumps(pack_comic_results(comic_results), ensure_ascii=False, separators=(',', ':')),
+    )
+    if encoding == 'none':
+        return (encoding,) + fields
+    return (encoding,) + tuple(sqlite3.Binary(compress_bytes(field.encode('utf-8'), encoding)) for field in fields)
+
+
+def decode_history_fields(encoding, novel_text, llm_result, comic_results):
+    """还原 encode_history_fields 编码的字段，返回 (原文, LLM结果, 连环画结果)"""
+    novel_text, llm_result, comic_results = (
+        decompress_text(field, encoding) if field else '' for field in (novel_text, llm_result, comic_results)
+    )
+    return (
+        novel_text,
+        json.loads(llm_result) if llm_result else {},
+        unpack_comic_results(json.loads(comic_results)) if comic_results else [],
+    )
+
+
+def encode_history_cursor(created_at, history_id):
+    """把分页位置编码为不透明的游标字符串"""
+    raw = json.dumps([created_at, history_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_history_cursor(token):
+    """解析游标字符串，格式错误时返回None"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, history_id = json.loads(raw)
+        if not isinstance(created_at, str) or not isinstance(history_id, int):
+            return None
+        return created_at, history_id
+    except (ValueError, TypeError):
+        return None
+
+
+def _compress_existing_history(cursor):
+    """压缩已有历史记录的小说原文和JSON结果（分批处理，避免一次读入全部记录）"""
+    last_id = 0
+    while True:
+        cursor.execute('''
+            SELECT id, novel_text, llm_result, comic_results FROM comics_history
+            WHERE storage_encoding = 'none' AND id > ? ORDER BY id LIMIT 200
+        ''', (last_id,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        updates = []
+        for history_id, novel_text, llm_result, comic_results in rows:
+            last_id = history_id
+            try:
+                llm_value = json.loads(llm_result) if llm_result else {}
+                comic_value = json.loads(comic_results) if comic_results else []
+            except json.JSONDecodeError:
+                continue
+            updates.append(encode_history_fields(novel_text, llm_value, comic_value) + (history_id,))
+        cursor.executemany('''
+            UPDATE comics_history SET storage_encoding = ?, novel_text = ?, llm_result = ?, comic_results = ?
+            WHERE id = ?
+        ''', updates)
+
+
+def history_summary(comic_results):
+    """计算历史记录列表展示用的摘要字段：(场景总数, 预览图地址)"""
+    if not comic_results:
+        return 0, None
+    return len(comic_results), comic_results[0].get('url')
+
+
+def _backfill_history_summary(cursor):
+    """为已有的历史记录回填 total_scenes 和 preview_image"""
+    cursor.execute('SELECT id, comic_results FROM comics_history')
+    updates = []
+    for history_id, comic_results in cursor.fetchall():
+        try:
+            total_scenes, preview_image = history_summary(json.loads(comic_results) if comic_results else [])
+        except json.JSONDecodeError:
+            continue
+        updates.append((total_scenes, preview_image, history_id))
+    cursor.executemany('UPDATE comics_history SET total_scenes = ?, preview_image = ? WHERE id = ?', updates)
+
+
+# 数据库结构迁移列表：(版本号, 说明, 步骤)
+# 步骤可以是SQL语句，也可以是接受游标的函数（用于数据回填）。
+# 已发布的迁移不要修改，新的结构变更请追加新版本。
+SCHEMA_MIGRATIONS = [
+    (1, '为历史记录、会话和任务队列添加查询索引', [
+        # get_user_comics_history: WHERE user_id = ? ORDER BY created_at DESC
+        'CREATE INDEX IF NOT EXISTS idx_comics_history_user_created ON comics_history (user_id, created_at)',
+        # get_session / cleanup_expired_sessions 按过期时间过滤
+        'CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions (expires_at)',
+        # claim_next_job: WHERE status = 'queued' ORDER BY created_at
+        'CREATE INDEX IF NOT EXISTS idx_generation_jobs_status_created ON generation_jobs (status, created_at)',
+    ]),
+    (2, '历史记录增加 total_scenes/preview_image 摘要字段和列表覆盖索引', [
+        'ALTER TABLE comics_history ADD COLUMN total_scenes INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE comics_history ADD COLUMN preview_image TEXT',
+        _backfill_history_summary,
+        # 列表查询只需读索引，不再读取包含小说全文和JSON的数据行
+        '''CREATE INDEX IF NOT EXISTS idx_comics_history_listing ON comics_history
+           (user_id, created_at, process_id, title, description, total_scenes, preview_image)''',
+        'DROP INDEX IF EXISTS idx_comics_history_user_created',
+    ]),
+    (3, '列表覆盖索引加入 id，支持按 (created_at, id) 的游标分页', [
+        'DROP INDEX IF EXISTS idx_comics_history_listing',
+        '''CREATE INDEX IF NOT EXISTS idx_comics_history_listing ON comics_history
+           (user_id, created_at, id, process_id, title, description, total_scenes, preview_image)''',
+    ]),
+    (4, '历史记录的小说原文和JSON结果压缩存储，场景提示词的公共前缀只保存一次', [
+        "ALTER TABLE comics_history ADD COLUMN storage_encoding TEXT NOT NULL DEFAULT 'none'",
+        _compress_existing_history,
+    ]),
+    (5, '为生成会话添加按用户和文本摘要查询的索引', [
+        # get_active_generation_sessions: WHERE user_id = ? [AND text_hash = ?] ORDER BY updated_at DESC
+        'CREATE INDEX IF NOT EXISTS idx_generation_sessions_user_updated ON generation_sessions (user_id, updated_at)',
+        # cleanup_generation_sessions 按更新时间清理
+        'CREATE INDEX IF NOT EXISTS idx_generation_sessions_updated ON generation_sessions (updated_at)',
+    ]),
+    (6, '为已结束任务的定期清理添加索引', [
+        # cleanup_finished_jobs 按结束时间清理
+        'CREATE INDEX IF NOT EXISTS idx_generation_jobs_finished ON generation_jobs (finished_at)',
+    ]),
+    (7, '运行中的任务记录所属工作进程和租约到期时间，只恢复租约过期的任务', [
+        'ALTER TABLE generation_jobs ADD COLUMN worker_id TEXT',
+        'ALTER TABLE generation_jobs ADD COLUMN lease_expires_at REAL',
+    ]),
+]
+
+# 生成会话可更新的字段
+GENERATION_SESSION_FIELDS = ('stage', 'job_id', 'protocol', 'error')
+
+
+def retry_on_busy(method):
+    """数据库被锁（busy/locked）时按指数退避重试"""
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        for attempt in range(DB_BUSY_RETRIES + 1):
+            try:
+                return method(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                message = str(e).lower()
+                if attempt >= DB_BUSY_RETRIES or ('locked' not in message and 'busy' not in message):
+                    raise
+                delay = 0.05 * (2 ** attempt) + random.uniform(0, 0.05)
+                print(f"数据库繁忙，{delay:.2f} 秒后重试: {e}")
+                time.sleep(delay)
+
+    return wrapper
+
 
 class DatabaseManager:
-    def __init__(self, db_path="comics_system.db"):
+    def __init__(self, db_path="comics_system.db", pool_size=DB_POOL_SIZE):
         self.db_path = db_path
+        self.pool_size = pool_size
+        # 空闲连接池：连接在线程间复用（同一时刻只被一个线程使用）
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        # 当前线程正在使用的连接，支持方法内嵌套调用时复用同一连接
+        self._local = threading.local()
+        # 历史记录计数缓存：{(user_id, 过滤条件): (计数, 缓存时间)}，保存或删除记录时按用户失效
+        self._history_count_cache = {}
+        self._history_count_lock = threading.Lock()
         self.init_database()
 
+    def _create_connection(self):
+        """创建新连接并设置性能相关的PRAGMA"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        # WAL模式下读写互不阻塞，适合多个请求线程并发访问
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    @contextmanager
+    def _cursor(self):
+        """
+        获取游标并在结束时提交事务（出错时回滚）
+
+        连接从连接池中借出，使用完毕后归还；同一线程嵌套使用时复用同一连接。
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+            return
+
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._create_connection()
+
+        self._local.conn = conn
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            self._local.conn = None
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close_all(self):
+        """关闭连接池中的所有空闲连接"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    @retry_on_busy
     def init_database(self):
         """初始化数据库表"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._cursor() as cursor:
+            # 用户表 - 添加 avatar 字段
+            cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS users (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        username TEXT UNIQUE NOT NULL,
+                        password_hash TEXT NOT NULL,
+                        email TEXT UNIQUE,
+                        avatar TEXT,  -- 新增头像字段，存储头像文件路径
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        last_login TIMESTAMP
+                    )
+                ''')
 
-        # 用户表 - 添加 avatar 字段
-        cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    email TEXT UNIQUE,
-                    avatar TEXT,  -- 新增头像字段，存储头像文件路径
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login TIMESTAMP
-                )
-            ''')
+            # 漫画历史记录表
+            cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS comics_history (
+                       id INTEGER PRIMARY KEY AUTOINCREMENT,
+                       user_id INTEGER NOT NULL,
+                       process_id TEXT UNIQUE NOT NULL,
+                       novel_text TEXT NOT NULL,
+                       llm_result TEXT NOT NULL,
+                       comic_results TEXT NOT NULL,
+                       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                       title TEXT,
+                       description TEXT,
+                       FOREIGN KEY (user_id) REFERENCES users (id)
+                   )
+               ''')
 
-        # 漫画历史记录表
-        cursor.execute('''
-               CREATE TABLE IF NOT EXISTS comics_history (
-                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                   user_id INTEGER NOT NULL,
-                   process_id TEXT UNIQUE NOT NULL,
-                   novel_text TEXT NOT NULL,
-                   llm_result TEXT NOT NULL,
-                   comic_results TEXT NOT NULL,
-                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                   title TEXT,
-                   description TEXT,
-                   FOREIGN KEY (user_id) REFERENCES users (id)
-               )
-           ''')
-
-        # 用户会话表（用于记住登录状态）
-        cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    session_token TEXT UNIQUE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
+            # 生成任务队列表（持久化，服务重启后可恢复）
+            cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS generation_jobs (
+                       id TEXT PRIMARY KEY,
+                       user_id INTEGER NOT NULL,
+                       job_type TEXT NOT NULL,
+                       status TEXT NOT NULL DEFAULT 'queued',  -- queued/running/done/failed
+                       payload TEXT NOT NULL,
+                       result TEXT,
+                       error TEXT,
+                       attempts INTEGER NOT NULL DEFAULT 0,
+                       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                       started_at TIMESTAMP,
+                       finished_at TIMESTAMP,
+                       FOREIGN KEY (user_id) REFERENCES users (id)
+                   )
+               ''')
+
+            # 处理结果表：每次处理的LLM分镜结果和连环画结果（JSON压缩后存储，按 process_id 和类型各一份）
+            cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS process_artifacts (
+                       process_id TEXT NOT NULL,
+                       kind TEXT NOT NULL,  -- llm/comic/novel
+                       encoding TEXT NOT NULL,  -- none/zlib
+                       data BLOB NOT NULL,
+                       size INTEGER NOT NULL,  -- 未压缩的字节数
+                       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                       PRIMARY KEY (process_id, kind)
+                   )
+               ''')
+
+            # 生成会话表：按 process_id 记录一次生成的阶段和参数，WebSocket断线重连后据此恢复
+            cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS generation_sessions (
+                       process_id TEXT PRIMARY KEY,
+                       user_id INTEGER NOT NULL,
+                       flow TEXT NOT NULL,  -- process_novel/full_process
+                       stage TEXT NOT NULL,
+                       job_id TEXT,
+                       text_hash TEXT,  -- 小说文本和规则集的摘要，用于识别重复提交
+                       title TEXT,
+                       description TEXT,
+                       rules TEXT,
+                       protocol TEXT,  -- 消息格式参数（JSON）
+                       novel_encoding TEXT NOT NULL DEFAULT 'none',
+                       novel_text BLOB,
+                       error TEXT,
+                       created_at REAL NOT NULL,
+                       updated_at REAL NOT NULL,
+                       FOREIGN KEY (user_id) REFERENCES users (id)
+                   )
+               ''')
+
+            # 用户会话表（用于记住登录状态）
+            cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS user_sessions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        session_token TEXT UNIQUE NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        expires_at TIMESTAMP NOT NULL,
+                        FOREIGN KEY (user_id) REFERENCES users (id)
+                    )
+                ''')
+
+            # 数据库结构版本记录表
+            cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+
+        self.run_migrations()
+
+    @retry_on_busy
+    def run_migrations(self):
+        """按版本顺序执行尚未应用的结构迁移，返回当前结构版本"""
+        version = self.get_schema_version()
+        for migration_version, description, steps in SCHEMA_MIGRATIONS:
+            if migration_version <= version:
+                continue
+
+            with self._cursor() as cursor:
+                # 每个迁移在独立的写事务中执行，并在事务内再次确认版本，避免多进程重复执行
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (migration_version,))
+                if cursor.fetchone():
+                    continue
+
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (?, ?)",
+                    (migration_version, description)
                 )
-            ''')
+            print(f"数据库结构已迁移到版本 {migration_version}: {description}")
+            version = migration_version
+
+        return version
 
-        conn.commit()
-        conn.close()
+    @retry_on_busy
+    def get_schema_version(self):
+        """获取当前数据库结构版本"""
+        with self._cursor() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+            return cursor.fetchone()[0]
 
     # 在 create_user 方法中添加 avatar 参数
+    @retry_on_busy
     def create_user(self, username, password_hash, email=None, avatar=None):
         """创建新用户"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         try:
-            cursor.execute(
-                "INSERT INTO users (username, password_hash, email, avatar) VALUES (?, ?, ?, ?)",
-                (username, password_hash, email, avatar)
-            )
-            user_id = cursor.lastrowid
-            conn.commit()
-            return user_id
+            with self._cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO users (username, password_hash, email, avatar) VALUES (?, ?, ?, ?)",
+                    (username, password_hash, email, avatar)
+                )
+                return cursor.lastrowid
         except sqlite3.IntegrityError:
             return None  # 用户名或邮箱已存在
-        finally:
-            conn.close()
 
     # 在 get_user_by_username 和 get_user_by_id 方法中添加 avatar 字段
+    @retry_on_busy
     def get_user_by_username(self, username):
         """根据用户名获取用户"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        user = cursor.fetchone()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+            user = cursor.fetchone()
 
         if user:
             return {
@@ -97,13 +519,12 @@ class DatabaseManager:
             }
         return None
 
+    @retry_on_busy
     def get_user_by_id(self, user_id):
         """根据用户ID获取用户"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+            user = cursor.fetchone()
 
         if user:
             return {
@@ -120,170 +541,361 @@ class DatabaseManager:
     # 添加更新用户头像的方法
     def update_user_avatar(self, user_id, avatar_path):
         """更新用户头像"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         try:
-            cursor.execute(
-                "UPDATE users SET avatar = ? WHERE id = ?",
-                (avatar_path, user_id)
-            )
-            conn.commit()
+            with self._cursor() as cursor:
+                cursor.execute(
+                    "UPDATE users SET avatar = ? WHERE id = ?",
+                    (avatar_path, user_id)
+                )
             return True
         except Exception as e:
             print(f"更新头像失败: {e}")
             return False
-        finally:
-            conn.close()
 
+    @retry_on_busy
     def update_user_login_time(self, user_id):
         """更新用户最后登录时间"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE users SET last_login = ? WHERE id = ?",
-            (datetime.now(), user_id)
-        )
-        conn.commit()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute(
+                "UPDATE users SET last_login = ? WHERE id = ?",
+                (datetime.now(), user_id)
+            )
 
+    @retry_on_busy
     def save_comics_history(self, user_id, process_id, novel_text, llm_result, comic_results, title=None,
                             description=None):
-        """保存漫画生成历史记录"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """保存漫画生成历史记录（小说原文和JSON结果压缩后存储，见 encode_history_fields）"""
+        total_scenes, preview_image = history_summary(comic_results)
+        storage_encoding, novel_data, llm_data, comic_data = encode_history_fields(
+            novel_text, llm_result, comic_results)
 
         try:
-            cursor.execute('''
-                INSERT INTO comics_history 
-                (user_id, process_id, novel_text, llm_result, comic_results, title, description)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                user_id,
-                process_id,
-                novel_text,
-                json.dumps(llm_result, ensure_ascii=False),
-                json.dumps(comic_results, ensure_ascii=False),
-                title,
-                description
-            ))
-            conn.commit()
+            with metrics.span('db_write', table='comics_history'), self._cursor() as cursor:
+                cursor.execute('''
+                    INSERT INTO comics_history
+                    (user_id, process_id, novel_text, llm_result, comic_results, title, description,
+                     total_scenes, preview_image, storage_encoding)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    user_id,
+                    process_id,
+                    novel_data,
+                    llm_data,
+                    comic_data,
+                    title,
+                    description,
+                    total_scenes,
+                    preview_image,
+                    storage_encoding
+                ))
+            self._invalidate_history_count(user_id)
             return True
         except sqlite3.IntegrityError:
+            metrics.inc('db_conflicts_total', table='comics_history')
             return False  # process_id 已存在
-        finally:
-            conn.close()
 
-    def get_user_comics_history(self, user_id, limit=50, offset=0):
-        """获取用户的漫画历史记录"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    @staticmethod
+    def _history_filters(user_id, title=None, date_from=None, date_to=None):
+        """构建历史记录查询的过滤条件，返回 (WHERE子句, 参数列表)"""
+        conditions = ['user_id = ?']
+        params = [user_id]
+        if title:
+            escaped = title.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append("title LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        if date_from:
+            conditions.append('created_at >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append('created_at < ?')
+            params.append(date_to)
+        return ' AND '.join(conditions), params
 
-        cursor.execute('''
-            SELECT id, process_id, novel_text, llm_result, comic_results, created_at, title, description
-            FROM comics_history 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT ? OFFSET ?
-        ''', (user_id, limit, offset))
-
-        history = []
-        for row in cursor.fetchall():
-            try:
-                llm_result = json.loads(row[3]) if row[3] else {}
-                comic_results = json.loads(row[4]) if row[4] else []
+    @retry_on_busy
+    def get_user_comics_history(self, user_id, limit=50, offset=0, after=None, title=None,
+                                date_from=None, date_to=None):
+        """
+        获取用户的漫画历史记录列表（按创建时间倒序）
 
-                history.append({
-                    'id': row[0],
-                    'process_id': row[1],
-                    'novel_text': row[2],
-                    'llm_result': llm_result,
-                    'comic_results': comic_results,
-                    'created_at': row[5],
-                    'title': row[6],
-                    'description': row[7]
-                })
-            except json.JSONDecodeError:
-                continue  # 跳过格式错误的数据
+        只读取列表展示需要的摘要字段（由覆盖索引提供），不读取小说全文和生成结果，
+        完整内容请使用 get_comics_by_process_id。
 
-        conn.close()
-        return history
+        参数:
+            limit: 返回条数
+            offset: 偏移量（兼容旧的分页方式，提供 after 时忽略）
+            after: 游标分页位置 (created_at, id)，返回排在该记录之后的记录
+            title: 按标题模糊过滤
+            date_from: 创建时间下限（包含），格式 'YYYY-MM-DD HH:MM:SS' 或其前缀
+            date_to: 创建时间上限（不包含）
+        """
+        where, params = self._history_filters(user_id, title, date_from, date_to)
+        if after:
+            # 游标分页：直接从索引中的位置继续向后读取，耗时与翻到第几页无关
+            where += ' AND (created_at < ? OR (created_at = ? AND id < ?))'
+            params += [after[0], after[0], after[1]]
+            offset = 0
 
-    def get_comics_by_process_id(self, process_id):
-        """根据处理ID获取漫画记录"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._cursor() as cursor:
+            cursor.execute(f'''
+                SELECT id, process_id, created_at, title, description, total_scenes, preview_image
+                FROM comics_history
+                WHERE {where}
+                ORDER BY created_at DESC, id DESC
+                LIMIT ? OFFSET ?
+            ''', params + [limit, offset])
+            rows = cursor.fetchall()
 
-        cursor.execute('''
-            SELECT * FROM comics_history WHERE process_id = ?
-        ''', (process_id,))
+        return [
+            {
+                'id': row[0],
+                'process_id': row[1],
+                'created_at': row[2],
+                'title': row[3],
+                'description': row[4],
+                'total_scenes': row[5],
+                'preview_image': row[6]
+            }
+            for row in rows
+        ]
+
+    @retry_on_busy
+    def count_user_comics_history(self, user_id, title=None, date_from=None, date_to=None):
+        """获取用户历史记录总数（带短期缓存，保存或删除记录时失效）"""
+        cache_key = (user_id, title, date_from, date_to)
+        now = time.monotonic()
+        with self._history_count_lock:
+            cached = self._history_count_cache.get(cache_key)
+        if cached and now - cached[1] < HISTORY_COUNT_CACHE_TTL:
+            return cached[0]
 
-        row = cursor.fetchone()
-        conn.close()
+        where, params = self._history_filters(user_id, title, date_from, date_to)
+        with self._cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM comics_history WHERE {where}', params)
+            count = cursor.fetchone()[0]
+
+        with self._history_count_lock:
+            self._history_count_cache[cache_key] = (count, now)
+        return count
+
+    def _invalidate_history_count(self, user_id):
+        with self._history_count_lock:
+            for cache_key in [key for key in self._history_count_cache if key[0] == user_id]:
+                del self._history_count_cache[cache_key]
+
+    @retry_on_busy
+    def get_comics_by_process_id(self, process_id):
+        """根据处理ID获取漫画记录"""
+        with self._cursor() as cursor:
+            cursor.execute('''
+                SELECT id, user_id, process_id, novel_text, llm_result, comic_results, created_at,
+                       title, description, storage_encoding
+                FROM comics_history WHERE process_id = ?
+            ''', (process_id,))
+            row = cursor.fetchone()
 
         if row:
             try:
-                llm_result = json.loads(row[4]) if row[4] else {}
-                comic_results = json.loads(row[5]) if row[5] else []
+                novel_text, llm_result, comic_results = decode_history_fields(row[9], row[3], row[4], row[5])
 
                 return {
                     'id': row[0],
                     'user_id': row[1],
                     'process_id': row[2],
-                    'novel_text': row[3],
+                    'novel_text': novel_text,
                     'llm_result': llm_result,
                     'comic_results': comic_results,
                     'created_at': row[6],
                     'title': row[7],
                     'description': row[8]
                 }
-            except json.JSONDecodeError:
+            except (json.JSONDecodeError, ValueError, zlib.error) as e:
+                print(f"读取历史记录 {process_id} 失败: {e}")
                 return None
         return None
 
+    @retry_on_busy
     def delete_comics_history(self, user_id, history_id):
         """删除用户的漫画历史记录"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            DELETE FROM comics_history 
-            WHERE id = ? AND user_id = ?
-        ''', (history_id, user_id))
+        with self._cursor() as cursor:
+            cursor.execute('''
+                DELETE FROM comics_history
+                WHERE id = ? AND user_id = ?
+            ''', (history_id, user_id))
+            deleted = cursor.rowcount > 0
 
-        deleted = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+        if deleted:
+            self._invalidate_history_count(user_id)
         return deleted
 
+    @retry_on_busy
+    def save_artifact(self, process_id, kind, text, overwrite=True):
+        """
+        保存处理结果（JSON文本，压缩后存储）
+
+        参数:
+            overwrite: 已存在时是否覆盖，为False时保留已有内容
+
+        返回:
+            是否写入
+        """
+        data, encoding = compress_text(text)
+        verb = 'INSERT OR REPLACE' if overwrite else 'INSERT OR IGNORE'
+        with metrics.span('db_write', table='process_artifacts'), self._cursor() as cursor:
+            cursor.execute(f'''
+                {verb} INTO process_artifacts (process_id, kind, encoding, data, size)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (process_id, kind, encoding, sqlite3.Binary(data), len(text.encode('utf-8'))))
+            return cursor.rowcount > 0
+
+    def iter_comic_result_texts(self, batch_size=200):
+        """逐条返回处理结果和历史记录中连环画结果的JSON文本（用于查找仍被引用的本地图片）"""
+        for query in ("SELECT encoding, data FROM process_artifacts WHERE kind = 'comic'",
+                      "SELECT storage_encoding, comic_results FROM comics_history"):
+            with self._cursor() as cursor:
+                cursor.execute(query)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for encoding, data in rows:
+                        if data:
+                            yield decompress_text(data, encoding)
+
+    @retry_on_busy
+    def get_artifact(self, process_id, kind):
+        """读取处理结果的JSON文本，不存在时返回None"""
+        with self._cursor() as cursor:
+            cursor.execute('''
+                SELECT encoding, data FROM process_artifacts WHERE process_id = ? AND kind = ?
+            ''', (process_id, kind))
+            row = cursor.fetchone()
+
+        if row:
+            return decompress_text(row[1], row[0])
+        return None
+
+    @retry_on_busy
+    def create_generation_session(self, process_id, user_id, flow, stage, novel_text, text_hash=None, title=None,
+                                  description=None, rules=None, protocol=None):
+        """创建生成会话（小说原文压缩后存储）"""
+        novel_data, novel_encoding = compress_text(novel_text or '')
+        now = time.time()
+        with metrics.span('db_write', table='generation_sessions'), self._cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO generation_sessions
+                (process_id, user_id, flow, stage, text_hash, title, description, rules, protocol,
+                 novel_encoding, novel_text, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (process_id, user_id, flow, stage, text_hash, title, description, rules,
+                  json.dumps(protocol) if protocol is not None else None,
+                  novel_encoding, sqlite3.Binary(novel_data), now, now))
+
+    @retry_on_busy
+    def update_generation_session(self, process_id, **fields):
+        """更新生成会话的阶段、任务ID等字段（见 GENERATION_SESSION_FIELDS），不传字段时只刷新 updated_at"""
+        unknown = set(fields) - set(GENERATION_SESSION_FIELDS)
+        if unknown:
+            raise ValueError(f"不能更新的字段: {', '.join(sorted(unknown))}")
+        if 'protocol' in fields and fields['protocol'] is not None:
+            fields['protocol'] = json.dumps(fields['protocol'])
+        assignments = ''.join(f"{name} = ?, " for name in fields)
+        with self._cursor() as cursor:
+            cursor.execute(f'''
+                UPDATE generation_sessions SET {assignments}updated_at = ? WHERE process_id = ?
+            ''', (*fields.values(), time.time(), process_id))
+            return cursor.rowcount > 0
+
+    @staticmethod
+    def _generation_session_from_row(row, with_text=False):
+        session = {
+            'process_id': row[0],
+            'user_id': row[1],
+            'flow': row[2],
+            'stage': row[3],
+            'job_id': row[4],
+            'text_hash': row[5],
+            'title': row[6],
+            'description': row[7],
+            'rules': row[8],
+            'protocol': json.loads(row[9]) if row[9] else None,
+            'error': row[10],
+            'created_at': row[11],
+            'updated_at': row[12]
+        }
+        if with_text:
+            session['novel_text'] = decompress_text(row[14], row[13]) if row[14] is not None else ''
+        return session
+
+    @retry_on_busy
+    def get_generation_session(self, process_id, with_text=False):
+        """根据 process_id 获取生成会话，with_text 为True时同时读取小说原文"""
+        text_columns = ', novel_encoding, novel_text' if with_text else ''
+        with self._cursor() as cursor:
+            cursor.execute(f'''
+                SELECT process_id, user_id, flow, stage, job_id, text_hash, title, description, rules,
+                       protocol, error, created_at, updated_at{text_columns}
+                FROM generation_sessions WHERE process_id = ?
+            ''', (process_id,))
+            row = cursor.fetchone()
+
+        return self._generation_session_from_row(row, with_text) if row else None
+
+    @retry_on_busy
+    def get_active_generation_sessions(self, user_id, inactive_stages=(), text_hash=None, limit=20):
+        """获取用户尚未结束的生成会话（最近更新的在前），可按文本摘要过滤"""
+        conditions = ['user_id = ?']
+        params = [user_id]
+        if inactive_stages:
+            conditions.append(f"stage NOT IN ({', '.join('?' * len(inactive_stages))})")
+            params.extend(inactive_stages)
+        if text_hash is not None:
+            conditions.append('text_hash = ?')
+            params.append(text_hash)
+
+        with self._cursor() as cursor:
+            cursor.execute(f'''
+                SELECT process_id, user_id, flow, stage, job_id, text_hash, title, description, rules,
+                       protocol, error, created_at, updated_at
+                FROM generation_sessions
+                WHERE {' AND '.join(conditions)}
+                ORDER BY updated_at DESC
+                LIMIT ?
+            ''', (*params, limit))
+            rows = cursor.fetchall()
+
+        return [self._generation_session_from_row(row) for row in rows]
+
+    @retry_on_busy
+    def cleanup_generation_sessions(self, max_age_seconds):
+        """删除超过指定时间未更新的生成会话，返回删除的数量"""
+        with self._cursor() as cursor:
+            cursor.execute('''
+                DELETE FROM generation_sessions WHERE updated_at <= ?
+            ''', (time.time() - max_age_seconds,))
+            return cursor.rowcount
+
+    @retry_on_busy
     def create_session(self, user_id, session_token, expires_hours=24):
         """创建用户会话"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
         expires_at = datetime.now().timestamp() + (expires_hours * 3600)
 
-        cursor.execute('''
-            INSERT INTO user_sessions (user_id, session_token, expires_at)
-            VALUES (?, ?, ?)
-        ''', (user_id, session_token, expires_at))
-
-        conn.commit()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO user_sessions (user_id, session_token, expires_at)
+                VALUES (?, ?, ?)
+            ''', (user_id, session_token, expires_at))
 
+    @retry_on_busy
     def get_session(self, session_token):
         """获取会话信息"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT us.*, u.username 
-            FROM user_sessions us 
-            JOIN users u ON us.user_id = u.id 
-            WHERE us.session_token = ? AND us.expires_at > ?
-        ''', (session_token, datetime.now().timestamp()))
-
-        session = cursor.fetchone()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute('''
+                SELECT us.*, u.username
+                FROM user_sessions us
+                JOIN users u ON us.user_id = u.id
+                WHERE us.session_token = ? AND us.expires_at > ?
+            ''', (session_token, datetime.now().timestamp()))
+            session = cursor.fetchone()
 
         if session:
             return {
@@ -296,26 +908,168 @@ class DatabaseManager:
             }
         return None
 
+    @retry_on_busy
     def delete_session(self, session_token):
         """删除会话"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            DELETE FROM user_sessions WHERE session_token = ?
-        ''', (session_token,))
-
-        conn.commit()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute('''
+                DELETE FROM user_sessions WHERE session_token = ?
+            ''', (session_token,))
 
+    @retry_on_busy
     def cleanup_expired_sessions(self):
         """清理过期会话"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._cursor() as cursor:
+            cursor.execute('''
+                DELETE FROM user_sessions WHERE expires_at <= ?
+            ''', (datetime.now().timestamp(),))
 
-        cursor.execute('''
-            DELETE FROM user_sessions WHERE expires_at <= ?
-        ''', (datetime.now().timestamp(),))
+    @retry_on_busy
+    def create_job(self, job_id, user_id, job_type, payload):
+        """创建生成任务（初始状态为 queued），payload 只包含 process_id 和少量参数，内容保存在结果存储中"""
+        with self._cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO generation_jobs (id, user_id, job_type, status, payload)
+                VALUES (?, ?, ?, 'queued', ?)
+            ''', (job_id, user_id, job_type, json.dumps(payload, ensure_ascii=False)))
 
-        conn.commit()
-        conn.close()
\ No newline at end of file
+    @retry_on_busy
+    def claim_next_job(self, worker_id=None, lease_seconds=None):
+        """
+        取出最早的排队任务并标记为 running，没有任务时返回None
+
+        参数:
+            worker_id: 领取任务的工作进程标识
+            lease_seconds: 租约时长，工作进程需要在到期前续约（见 renew_job_leases），
+                到期未续约的任务由 requeue_expired_jobs 恢复
+        """
+        lease_expires_at = time.time() + lease_seconds if lease_seconds else None
+        with self._cursor() as cursor:
+            # BEGIN IMMEDIATE 保证多个工作线程/进程不会领取同一个任务
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute('''
+                SELECT id FROM generation_jobs
+                WHERE status = 'queued'
+                ORDER BY created_at, rowid
+                LIMIT 1
+            ''')
+            row = cursor.fetchone()
+            if not row:
+                return None
+
+            cursor.execute('''
+                UPDATE generation_jobs
+                SET status = 'running', started_at = ?, attempts = attempts + 1, worker_id = ?, lease_expires_at = ?
+                WHERE id = ?
+            ''', (datetime.now(), worker_id, lease_expires_at, row[0]))
+
+        return self.get_job(row[0])
+
+    @retry_on_busy
+    def finish_job(self, job_id, result, worker_id=None):
+        """
+        标记任务完成并保存结果，返回是否更新
+
+        指定 worker_id 时只在任务仍由该工作进程持有时更新（租约过期后任务可能已被重新领取）
+        """
+        with self._cursor() as cursor:
+            cursor.execute(f'''
+                UPDATE generation_jobs
+                SET status = 'done', result = ?, error = NULL, finished_at = ?, lease_expires_at = NULL
+                WHERE id = ? {'AND worker_id = ?' if worker_id else ''}
+            ''', (json.dumps(result, ensure_ascii=False), datetime.now(), job_id, *([worker_id] if worker_id else [])))
+            return cursor.rowcount > 0
+
+    @retry_on_busy
+    def fail_job(self, job_id, error, worker_id=None):
+        """标记任务失败并记录错误信息，返回是否更新（worker_id 的含义同 finish_job）"""
+        with self._cursor() as cursor:
+            cursor.execute(f'''
+                UPDATE generation_jobs
+                SET status = 'failed', error = ?, finished_at = ?, lease_expires_at = NULL
+                WHERE id = ? {'AND worker_id = ?' if worker_id else ''}
+            ''', (error, datetime.now(), job_id, *([worker_id] if worker_id else [])))
+            return cursor.rowcount > 0
+
+    @retry_on_busy
+    def renew_job_leases(self, worker_id, lease_seconds):
+        """为工作进程正在执行的任务续约，返回续约的任务数"""
+        with self._cursor() as cursor:
+            cursor.execute('''
+                UPDATE generation_jobs SET lease_expires_at = ?
+                WHERE status = 'running' AND worker_id = ?
+            ''', (time.time() + lease_seconds, worker_id))
+            return cursor.rowcount
+
+    @retry_on_busy
+    def requeue_expired_jobs(self, max_attempts):
+        """
+        恢复租约过期（工作进程已退出）的 running 任务
+
+        已执行 max_attempts 次的任务不再重试，标记为失败，避免导致进程崩溃的任务反复执行。
+        旧版本领取的任务没有租约，同样视为过期。
+
+        返回:
+            (重新排队的任务数, 标记为失败的任务ID列表)
+        """
+        with self._cursor() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute('''
+                SELECT id, attempts FROM generation_jobs
+                WHERE status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+            ''', (time.time(),))
+            rows = cursor.fetchall()
+            requeue = [(job_id,) for job_id, attempts in rows if attempts < max_attempts]
+            failed = [job_id for job_id, attempts in rows if attempts >= max_attempts]
+            cursor.executemany('''
+                UPDATE generation_jobs
+                SET status = 'queued', started_at = NULL, worker_id = NULL, lease_expires_at = NULL
+                WHERE id = ?
+            ''', requeue)
+            cursor.executemany('''
+                UPDATE generation_jobs
+                SET status = 'failed', error = ?, finished_at = ?, worker_id = NULL, lease_expires_at = NULL
+                WHERE id = ?
+            ''', [(f"任务执行了 {max_attempts} 次均未完成（工作进程中断）", datetime.now(), job_id)
+                  for job_id in failed])
+        return len(requeue), failed
+
+    @retry_on_busy
+    def cleanup_finished_jobs(self, max_age_seconds):
+        """删除结束超过指定时间的任务（结果内容保存在 process_artifacts 中，不受影响），返回删除的数量"""
+        with self._cursor() as cursor:
+            cursor.execute('''
+                DELETE FROM generation_jobs
+                WHERE status IN ('done', 'failed') AND finished_at <= ?
+            ''', (datetime.now() - timedelta(seconds=max_age_seconds),))
+            return cursor.rowcount
+
+    @retry_on_busy
+    def get_job(self, job_id):
+        """根据任务ID获取任务信息"""
+        with self._cursor() as cursor:
+            cursor.execute('''
+                SELECT id, user_id, job_type, status, payload, result, error, attempts,
+                       created_at, started_at, finished_at
+                FROM generation_jobs WHERE id = ?
+            ''', (job_id,))
+            row = cursor.fetchone()
+
+        if row:
+            try:
+                return {
+                    'id': row[0],
+                    'user_id': row[1],
+                    'job_type': row[2],
+                    'status': row[3],
+                    'payload': json.loads(row[4]) if row[4] else {},
+                    'result': json.loads(row[5]) if row[5] else None,
+                    'error': row[6],
+                    'attempts': row[7],
+                    'created_at': row[8],
+                    'started_at': row[9],
+                    'finished_at': row[10]
+                }
+            except json.JSONDecodeError:
+                return None
+        return None
@@ -0,0 +1,199 @@
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+
+
+# 每个会话在内存中保留的最近事件数（断线重连时据此补发）
+SESSION_EVENT_LOG_SIZE = int(os.environ.get("SESSION_EVENT_LOG_SIZE", "500"))
+# 会话结束后事件记录在内存中保留的秒数
+SESSION_EVENT_LOG_RETENTION = float(os.environ.get("SESSION_EVENT_LOG_RETENTION", "600"))
+# 数据库中的会话超过此时间（秒）未更新时清理
+SESSION_RETENTION = float(os.environ.get("SESSION_RETENTION", str(24 * 3600)))
+# 两次清理之间的最短间隔（秒）
+SESSION_CLEANUP_INTERVAL = 3600
+# 处理中的会话推送事件时刷新数据库中 updated_at 的最短间隔（秒）
+SESSION_HEARTBEAT_INTERVAL = float(os.environ.get("SESSION_HEARTBEAT_INTERVAL", "30"))
+# text_processing 阶段的会话超过此时间（秒）未更新视为已中断（需大于单次LLM调用的读取超时 ARK_READ_TIMEOUT）
+SESSION_TEXT_TIMEOUT = float(os.environ.get("SESSION_TEXT_TIMEOUT", "900"))
+
+# 会话阶段：文本处理中 -> 文本处理完成 -> 图片生成中（两步流程为 comics_queued）-> 完成/失败
+STAGE_TEXT_PROCESSING = 'text_processing'
+STAGE_TEXT_PROCESSED = 'text_processed'
+STAGE_COMICS_QUEUED = 'comics_queued'
+STAGE_COMICS_PIPELINED = 'comics_pipelined'
+STAGE_COMICS_GENERATED = 'comics_generated'
+STAGE_FAILED = 'failed'
+FINISHED_STAGES = (STAGE_COMICS_GENERATED, STAGE_FAILED)
+
+
+def session_room(process_id):
+    """某次生成的 Socket.IO 房间名，重连后的连接加入同一房间即可继续接收事件"""
+    return f"process:{process_id}"
+
+
+def novel_text_hash(novel_text, rules_name=None):
+    """小说文本和规则集的摘要，用于识别同一用户重复提交的生成"""
+    return hashlib.sha256(f"{rules_name or ''}\n{novel_text}".encode('utf-8')).hexdigest()
+
+
+class _EventLog:
+    def __init__(self, complete, max_events):
+        # complete 为False表示会话在本进程启动前创建（服务重启），之前的事件已经丢失
+        self.complete = complete
+        self.seq = 0
+        self.events = deque(maxlen=max_events)  # (序号, 事件名, 数据)
+        self.finished_at = None
+        self.last_active = time.monotonic()  # 最近一次记录事件或更新会话的时间
+        self.touched_at = self.last_active  # 最近一次刷新数据库中 updated_at 的时间
+
+
+class GenerationSessionStore:
+    """
+    生成会话存储
+
+    会话按 process_id 和用户记录（而不是按 WebSocket 连接），阶段和参数保存在数据库的
+    generation_sessions 表中，LLM结果和连环画结果在 ArtifactStore 中，连接断开不会丢失已完成的工作。
+
+    推送给客户端的事件带有递增的序号 seq，并在内存中保留最近的事件；客户端重连后
+    提供收到的最后一个序号即可补发错过的事件。内存中的记录不完整时（服务重启或事件太多被丢弃）
+    由调用方根据持久化的状态重新生成（见 main_api.replay_session）。
+
+    参数:
+        db: DatabaseManager 实例
+        max_events: 每个会话保留的事件数
+        log_retention: 会话结束后事件在内存中保留的秒数
+        text_timeout: text_processing 阶段的会话超过此秒数未更新时视为已中断
+        retention: 数据库中的会话保留的秒数；内存中的事件记录超过此时间没有活动时
+            无论处于什么阶段都会被清理（如任务被取消或进程异常中断，会话永远不会结束）
+    """
+
+    def __init__(self, db, max_events=SESSION_EVENT_LOG_SIZE, log_retention=SESSION_EVENT_LOG_RETENTION,
+                 retention=SESSION_RETENTION, text_timeout=SESSION_TEXT_TIMEOUT):
+        self.db = db
+        self.text_timeout = text_timeout
+        self.max_events = max_events
+        self.log_retention = log_retention
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._logs = {}  # process_id -> _EventLog
+        self._last_cleanup = None
+
+    def create(self, process_id, user_id, flow, stage, novel_text, text_hash=None, title=None, description=None,
+               rules=None, protocol=None):
+        """创建会话，之后该 process_id 的事件都会被记录"""
+        self.db.create_generation_session(process_id, user_id, flow, stage, novel_text, text_hash=text_hash,
+                                          title=title, description=description, rules=rules, protocol=protocol)
+        with self._lock:
+            self._logs[process_id] = _EventLog(True, self.max_events)
+        metrics.inc('generation_sessions_total', flow=flow)
+        self.cleanup()
+
+    def update(self, process_id, **fields):
+        """更新会话阶段等字段，进入结束阶段后事件记录在 log_retention 秒后从内存中清理"""
+        self.db.update_generation_session(process_id, **fields)
+        with self._lock:
+            log = self._logs.get(process_id)
+            if log is not None:
+                log.last_active = log.touched_at = time.monotonic()
+                if fields.get('stage') in FINISHED_STAGES:
+                    log.finished_at = log.last_active
+        self.cleanup()
+
+    def get(self, process_id, user_id=None, with_text=False):
+        """获取会话，指定 user_id 时只返回该用户的会话"""
+        session = self.db.get_generation_session(process_id, with_text=with_text)
+        if session is None or (user_id is not None and session['user_id'] != user_id):
+            return None
+        return session
+
+    def active_sessions(self, user_id, text_hash=None):
+        """
+        用户尚未结束的会话
+
+        文本处理在 WebSocket 处理函数中同步执行，进行中时推送事件会定期刷新 updated_at（见 record）；
+        超过 text_timeout 未更新的 text_processing 会话已随服务重启或进程退出中断，标记为失败后不再返回。
+        判断只依据数据库中的状态，多个服务实例共用数据库时同样适用。
+        """
+        sessions = []
+        deadline = time.time() - self.text_timeout
+        for session in self.db.get_active_generation_sessions(user_id, FINISHED_STAGES, text_hash=text_hash):
+            if session['stage'] == STAGE_TEXT_PROCESSING and session['updated_at'] < deadline:
+                self.update(session['process_id'], stage=STAGE_FAILED, error='文本处理已中断（服务重启或超时）')
+                continue
+            sessions.append(session)
+        return sessions
+
+    def record(self, process_id, event, data):
+        """记录一个要推送的事件，返回带序号 seq 的数据（同时作为心跳定期刷新数据库中的 updated_at）"""
+        now = time.monotonic()
+        with self._lock:
+            log = self._logs.get(process_id)
+            if log is None:
+                # 服务重启后恢复的任务：之前的事件已经丢失
+                log = self._logs[process_id] = _EventLog(False, self.max_events)
+            log.seq += 1
+            log.last_active = now
+            data = {**data, 'seq': log.seq}
+            log.events.append((log.seq, event, data))
+            heartbeat = now - log.touched_at >= SESSION_HEARTBEAT_INTERVAL
+            if heartbeat:
+                log.touched_at = now
+        if heartbeat:
+            self.db.update_generation_session(process_id)
+        return data
+
+    def current_seq(self, process_id):
+        with self._lock:
+            log = self._logs.get(process_id)
+            return log.seq if log is not None else 0
+
+    def summary(self, session):
+        """发送给客户端的会话摘要（seq 为最新的事件序号）"""
+        return {
+            'process_id': session['process_id'],
+            'flow': session['flow'],
+            'stage': session['stage'],
+            'job_id': session['job_id'],
+            'title': session['title'],
+            'seq': self.current_seq(session['process_id'])
+        }
+
+    def events_since(self, process_id, last_seq):
+        """
+        返回序号大于 last_seq 的事件 [(事件名, 数据)]
+
+        内存中的记录无法覆盖这些事件时返回None，调用方需要根据持久化的状态重新生成
+        """
+        with self._lock:
+            log = self._logs.get(process_id)
+            if log is None or not log.complete or last_seq > log.seq:
+                return None
+            if log.events and log.events[0][0] > last_seq + 1:
+                return None
+            return [(event, data) for seq, event, data in log.events if seq > last_seq]
+
+    def cleanup(self, force=False):
+        """
+        清理内存中的事件记录和数据库中过期的会话（数据库最多每小时清理一次）
+
+        已结束会话的事件记录保留 log_retention 秒；其他会话超过 retention 秒没有活动时同样清理，
+        之后重连的客户端根据持久化的状态重新生成事件
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [process_id for process_id, log in self._logs.items()
+                       if (log.finished_at is not None and now - log.finished_at > self.log_retention)
+                       or now - log.last_active > self.retention]
+            for process_id in expired:
+                del self._logs[process_id]
+            if not force and self._last_cleanup is not None and now - self._last_cleanup < SESSION_CLEANUP_INTERVAL:
+                return
+            self._last_cleanup = now
+
+        deleted = self.db.cleanup_generation_sessions(self.retention)
+        if deleted:
+            print(f"清理了 {deleted} 个过期的生成会话")
@@ -0,0 +1,269 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs
+
+import metrics
+from image_store import ImageStore, find_image_references, get_image_store
+
+
+# 缓存配置，可通过环境变量调整
+IMAGE_CACHE_DB = os.environ.get("IMAGE_CACHE_DB", "image_cache.db")
+IMAGE_CACHE_TTL = int(os.environ.get("IMAGE_CACHE_TTL", str(30 * 24 * 3600)))  # 默认保留30天
+IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", "10000"))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# 签名URL到期前预留的安全时间（秒），避免返回即将失效的链接
+URL_EXPIRY_MARGIN = 600
+
+
+def signed_url_expires_at(url):
+    """
+    解析TOS签名URL的过期时间
+
+    返回:
+        过期时间的Unix时间戳，URL不带签名信息时返回None
+    """
+    query = parse_qs(urlparse(url).query)
+    signed_date = query.get('X-Tos-Date', [None])[0]
+    expires = query.get('X-Tos-Expires', [None])[0]
+    if not signed_date or not expires:
+        return None
+
+    try:
+        signed_at = datetime.strptime(signed_date, '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+        return signed_at.timestamp() + int(expires)
+    except ValueError:
+        return None
+
+
+class ImageResultCache:
+    """
+    场景图片生成结果缓存
+
+    以 (model, size, prompt) 的哈希为键，记录生成图片在本地存储中的文件名和元数据，
+    相同提示词、尺寸和模型的场景可以直接复用，无需再次调用生成接口。
+    超过TTL的条目失效，超过条目数或图片总字节数上限时按最近访问时间淘汰（LRU）；
+    淘汰后不再被引用的图片文件由 ImageStore.collect_garbage 清理。
+
+    参数:
+        db_path: 元数据数据库文件路径
+        store: 图片文件所在的 ImageStore，默认使用进程内共享的存储
+        ttl: 条目有效期（秒）
+        max_entries: 最大条目数
+        max_bytes: 条目引用的图片文件最大总字节数
+    """
+
+    def __init__(self, db_path=IMAGE_CACHE_DB, store=None, ttl=IMAGE_CACHE_TTL,
+                 max_entries=IMAGE_CACHE_MAX_ENTRIES, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.store = store or get_image_store()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self.init_database()
+
+    def init_database(self):
+        """初始化缓存元数据表"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS image_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                size TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                url TEXT NOT NULL,
+                url_expires_at REAL,
+                image_size TEXT,
+                filename TEXT,  -- ImageStore 中的本地文件名
+                file_size INTEGER NOT NULL DEFAULT 0,  -- 本地文件的字节数
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+
+        # 兼容旧版本缓存表（旧版本把图片单独下载到缓存目录，且没有记录文件大小）
+        cursor.execute('PRAGMA table_info(image_cache)')
+        columns = [column[1] for column in cursor.fetchall()]
+        if 'filename' not in columns:
+            cursor.execute('ALTER TABLE image_cache ADD COLUMN filename TEXT')
+        if 'file_size' not in columns:
+            cursor.execute('ALTER TABLE image_cache ADD COLUMN file_size INTEGER NOT NULL DEFAULT 0')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_image_cache_last_access ON image_cache (last_access)')
+
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def make_key(model, size, prompt):
+        """根据模型、尺寸和最终提示词生成缓存键"""
+        digest = hashlib.sha256()
+        for part in (model, size, prompt):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _record(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.inc('cache_requests_total', cache='image', result='hit' if hit else 'miss')
+
+    def get(self, model, size, prompt):
+        """
+        查找可复用的图片
+
+        返回:
+            包含 url（本地已保存时为本地访问路径）、remote_url、image_size 的字典，
+            未命中返回None
+        """
+        cache_key = self.make_key(model, size, prompt)
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('''
+                SELECT url, url_expires_at, image_size, filename, created_at FROM image_cache WHERE cache_key = ?
+            ''', (cache_key,))
+            row = cursor.fetchone()
+            if not row or time.time() - row[4] > self.ttl:
+                if row:
+                    cursor.execute('DELETE FROM image_cache WHERE cache_key = ?', (cache_key,))
+                    conn.commit()
+                self._record(False)
+                return None
+
+            # 本地已保存的图片永久有效；只有远程签名链接的条目需要检查是否即将过期
+            local = bool(row[3]) and self.store.exists(row[3])
+            if not local and row[1] is not None and row[1] - URL_EXPIRY_MARGIN < time.time():
+                self._record(False)
+                return None
+
+            cursor.execute('UPDATE image_cache SET last_access = ? WHERE cache_key = ?', (time.time(), cache_key))
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._record(True)
+        return {
+            'url': ImageStore.local_url(row[3]) if local else row[0],
+            'remote_url': row[0],
+            'image_size': row[2]
+        }
+
+    def put(self, model, size, prompt, url, image_size=None, filename=None):
+        """
+        记录生成结果的元数据，并按TTL和容量上限淘汰旧条目
+
+        参数:
+            url: 生成接口返回的远程地址
+            image_size: 图片实际尺寸
+            filename: 图片在本地存储中的文件名（镜像失败时为None）
+        """
+        cache_key = self.make_key(model, size, prompt)
+        now = time.time()
+        file_size = self.store.size(filename) if filename else 0
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                INSERT OR REPLACE INTO image_cache
+                (cache_key, model, size, prompt, url, url_expires_at, image_size, filename, file_size,
+                 created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (cache_key, model, size, prompt, url, signed_url_expires_at(url), image_size, filename, file_size,
+                  now, now))
+            self._evict(cursor, now)
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"写入图片缓存失败: {e}")
+        finally:
+            conn.close()
+
+    def _evict(self, cursor, now):
+        # 先清理过期条目
+        cursor.execute('DELETE FROM image_cache WHERE created_at < ?', (now - self.ttl,))
+
+        # 条目数超限时淘汰最久未访问的条目
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(file_size), 0) FROM image_cache')
+        count, total_size = cursor.fetchone()
+        if count > self.max_entries:
+            cursor.execute('''
+                DELETE FROM image_cache WHERE cache_key IN (
+                    SELECT cache_key FROM image_cache ORDER BY last_access LIMIT ?
+                )
+            ''', (count - self.max_entries,))
+
+        # 图片总字节数超限时继续按LRU淘汰
+        if total_size > self.max_bytes:
+            cursor.execute('SELECT cache_key, file_size FROM image_cache ORDER BY last_access')
+            to_delete = []
+            for cache_key, file_size in cursor.fetchall():
+                if total_size <= self.max_bytes:
+                    break
+                to_delete.append((cache_key,))
+                total_size -= file_size
+            cursor.executemany('DELETE FROM image_cache WHERE cache_key = ?', to_delete)
+
+    def referenced_filenames(self):
+        """缓存条目引用的本地图片文件名"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute('SELECT filename FROM image_cache WHERE filename IS NOT NULL').fetchall()
+        finally:
+            conn.close()
+        return {row[0] for row in rows}
+
+    def stats(self):
+        """返回命中统计"""
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0
+        }
+
+
+def collect_unreferenced_images(result_texts, cache=None):
+    """
+    清理本地图片存储中不再被引用的文件
+
+    参数:
+        result_texts: 处理结果和历史记录中连环画结果的JSON文本（见 DatabaseManager.iter_comic_result_texts）
+        cache: ImageResultCache，默认使用进程内共享的缓存；缓存条目引用的图片同样保留
+
+    返回:
+        (删除的文件数, 释放的字节数)
+    """
+    cache = cache or get_image_cache()
+    referenced = cache.referenced_filenames()
+    for text in result_texts:
+        referenced |= find_image_references(text)
+    return cache.store.collect_garbage(referenced)
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """获取进程内共享的图片结果缓存（懒加载）"""
+    global _image_cache
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImageResultCache()
+    return _image_cache
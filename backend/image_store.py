@@ -0,0 +1,212 @@
+import contextvars
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+
+# 本地图片存储配置，可通过环境变量调整
+IMAGE_STORE_DIR = os.environ.get("IMAGE_STORE_DIR", "image_store")
+IMAGE_MIRROR_WORKERS = int(os.environ.get("IMAGE_MIRROR_WORKERS", "8"))
+IMAGE_DOWNLOAD_TIMEOUT = float(os.environ.get("IMAGE_DOWNLOAD_TIMEOUT", "30"))
+# 清理未引用的图片时，保存不到此时间（秒）的文件不删除（生成中的图片可能还没有写入结果）
+IMAGE_STORE_MIN_AGE = float(os.environ.get("IMAGE_STORE_MIN_AGE", str(24 * 3600)))
+
+# 本地图片的访问路径前缀（由 main_api 中的 /api/images/<filename> 路由提供）
+IMAGE_URL_PREFIX = "/api/images/"
+
+ALLOWED_IMAGE_EXTENSIONS = {'.jpeg', '.jpg', '.png', '.webp', '.gif'}
+IMAGE_FILENAME_PATTERN = re.compile(r'^([0-9a-f]{64})(\.[a-z]+)$')
+# 结果JSON中本地图片的访问路径
+IMAGE_REFERENCE_PATTERN = re.compile(re.escape(IMAGE_URL_PREFIX) + r'([0-9a-f]{64}\.[a-z]+)')
+
+
+def find_image_references(text):
+    """从结果JSON文本中找出引用的本地图片文件名"""
+    return set(IMAGE_REFERENCE_PATTERN.findall(text or ''))
+
+
+class ImageStore:
+    """
+    内容寻址的本地图片存储
+
+    文件按内容的SHA-256命名，保存在 <store_dir>/<哈希前两位>/<哈希><扩展名>，
+    相同内容只保存一份，文件写入后不再变化。
+    存储本身不淘汰文件，由调用方根据引用情况调用 collect_garbage 清理。
+
+    参数:
+        store_dir: 存储根目录
+    """
+
+    def __init__(self, store_dir=IMAGE_STORE_DIR):
+        self.store_dir = store_dir
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def _path(self, digest, ext):
+        return os.path.join(self.store_dir, digest[:2], f"{digest}{ext}")
+
+    def put_bytes(self, data, ext='.jpeg'):
+        """保存图片内容，返回文件名（<哈希><扩展名>）"""
+        if ext not in ALLOWED_IMAGE_EXTENSIONS:
+            ext = '.jpeg'
+        digest = hashlib.sha256(data).hexdigest()
+        file_path = self._path(digest, ext)
+
+        if not os.path.exists(file_path):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            # 先写临时文件再原子替换，避免并发读取到不完整的文件
+            tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)
+
+        return f"{digest}{ext}"
+
+    def resolve(self, filename):
+        """
+        根据文件名获取本地文件路径
+
+        返回:
+            (文件路径, 内容哈希)，文件名非法或文件不存在时返回 (None, None)
+        """
+        match = IMAGE_FILENAME_PATTERN.match(filename or '')
+        if not match:
+            return None, None
+
+        digest, ext = match.groups()
+        file_path = self._path(digest, ext)
+        if not os.path.exists(file_path):
+            return None, None
+        return file_path, digest
+
+    def exists(self, filename):
+        """判断文件名对应的图片是否已保存"""
+        return self.resolve(filename)[0] is not None
+
+    def size(self, filename):
+        """图片文件的字节数，不存在时返回0"""
+        file_path = self.resolve(filename)[0]
+        try:
+            return os.path.getsize(file_path) if file_path else 0
+        except OSError:
+            return 0
+
+    def collect_garbage(self, referenced, min_age=IMAGE_STORE_MIN_AGE):
+        """
+        删除没有被引用的图片文件（以及中断写入遗留的临时文件）
+
+        参数:
+            referenced: 仍被引用的文件名集合
+            min_age: 修改时间在此秒数以内的文件保留
+
+        返回:
+            (删除的文件数, 释放的字节数)
+        """
+        deadline = time.time() - min_age
+        deleted = freed = 0
+        for root, _, files in os.walk(self.store_dir):
+            for name in files:
+                if name in referenced:
+                    continue
+                if not name.endswith('.tmp') and not IMAGE_FILENAME_PATTERN.match(name):
+                    continue
+                file_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(file_path)
+                    if stat.st_mtime > deadline:
+                        continue
+                    os.remove(file_path)
+                except OSError:
+                    continue
+                deleted += 1
+                freed += stat.st_size
+        return deleted, freed
+
+    @staticmethod
+    def local_url(filename):
+        """获取图片的本地访问路径"""
+        return f"{IMAGE_URL_PREFIX}{filename}"
+
+    @staticmethod
+    def filename_from_url(url):
+        """从本地访问路径中提取文件名，非本地路径返回None"""
+        if url and url.startswith(IMAGE_URL_PREFIX):
+            return url[len(IMAGE_URL_PREFIX):]
+        return None
+
+
+class ImageMirror:
+    """
+    后台图片镜像下载器
+
+    使用连接池化的HTTP会话并行下载远程图片，保存到 ImageStore 中。
+
+    参数:
+        store: ImageStore 实例
+        max_workers: 并行下载线程数
+    """
+
+    def __init__(self, store, max_workers=IMAGE_MIRROR_WORKERS):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-mirror")
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def download(self, url):
+        """
+        下载远程图片并保存到本地存储
+
+        返回:
+            本地文件名，下载失败返回None
+        """
+        try:
+            with metrics.span('image_download'):
+                response = self._session.get(url, timeout=IMAGE_DOWNLOAD_TIMEOUT)
+                response.raise_for_status()
+            ext = os.path.splitext(urlparse(url).path)[1].lower() or '.jpeg'
+            with metrics.span('file_save', kind='image'):
+                return self.store.put_bytes(response.content, ext)
+        except Exception as e:
+            print(f"镜像图片失败: {e}")
+            return None
+
+    def submit(self, url):
+        """在后台线程中下载图片，返回 Future（结果为本地文件名或None）"""
+        # 在提交线程的上下文中执行，耗时记录归入对应的 process_id
+        return self._executor.submit(contextvars.copy_context().run, self.download, url)
+
+
+_image_store = None
+_image_mirror = None
+_image_store_lock = threading.Lock()
+
+
+def get_image_store():
+    """获取进程内共享的本地图片存储（懒加载）"""
+    global _image_store
+    if _image_store is None:
+        with _image_store_lock:
+            if _image_store is None:
+                _image_store = ImageStore()
+    return _image_store
+
+
+def get_image_mirror():
+    """获取进程内共享的图片镜像下载器（懒加载）"""
+    global _image_mirror
+    if _image_mirror is None:
+        store = get_image_store()
+        with _image_store_lock:
+            if _image_mirror is None:
+                _image_mirror = ImageMirror(store)
+    return _image_mirror
@@ -0,0 +1,204 @@
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+import metrics
+from rate_limiter import set_current_user
+
+
+# 工作线程数量，可通过环境变量调整
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# 队列为空时的轮询间隔（秒），新任务提交时会立即唤醒工作线程
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "2"))
+# 已结束的任务记录保留的秒数（结果内容在结果存储中，不随任务记录删除）
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", str(7 * 24 * 3600)))
+# 两次清理之间的最短间隔（秒）
+JOB_CLEANUP_INTERVAL = 3600
+# 运行中任务的租约时长（秒），工作进程每隔三分之一租约续约一次，进程退出后租约到期的任务重新排队
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+# 任务最多执行的次数（包括工作进程中断后的重试），超过后标记为失败
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+
+class JobWorkerPool:
+    """
+    基于SQLite任务表的后台工作线程池
+
+    任务先写入数据库再执行。领取的任务记录所属的工作进程和租约到期时间，执行期间定期续约；
+    租约过期（进程退出）的任务重新排队，多个进程共用同一个数据库时不会抢走其他进程正在执行的任务。
+    执行了 max_attempts 次仍未完成的任务标记为失败。结束超过 retention 秒的任务记录在空闲时清理。
+
+    参数:
+        db: DatabaseManager 实例
+        handlers: 任务类型到处理函数的映射，处理函数签名为 handler(job, progress_callback)，
+                  返回值会作为任务结果保存
+        num_workers: 工作线程数量
+        on_finished: 任务结束（成功或失败）后的回调，签名为 on_finished(job)
+        on_progress: 任务进度回调，签名为 on_progress(job, step, total)
+        retention: 已结束的任务记录保留的秒数
+        lease_seconds: 运行中任务的租约时长
+        max_attempts: 任务最多执行的次数
+    """
+
+    def __init__(self, db, handlers, num_workers=None, on_finished=None, on_progress=None, retention=JOB_RETENTION,
+                 lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.db = db
+        self.handlers = handlers
+        self.num_workers = num_workers or JOB_WORKERS
+        self.on_finished = on_finished
+        self.on_progress = on_progress
+        self.retention = retention
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # 工作进程标识：主机名、进程号和随机后缀（同一进程中的多个线程池互不影响）
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._cleanup_lock = threading.Lock()
+        self._last_cleanup = None
+
+    def start(self):
+        """启动工作线程和续约线程，并恢复租约已过期的任务"""
+        if self._threads:
+            return
+
+        self._recover_expired()
+
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._lease_loop, name="job-lease", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+        # 启动时队列中可能已有任务
+        self._wakeup.set()
+        print(f"任务工作线程池已启动，线程数: {self.num_workers}")
+
+    def stop(self, timeout=None):
+        """停止工作线程（正在执行的任务会执行完毕）"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, user_id, job_type, payload):
+        """
+        提交任务，立即返回任务ID
+
+        参数:
+            user_id: 提交任务的用户ID
+            job_type: 任务类型，必须在 handlers 中注册
+            payload: 任务参数（需可JSON序列化；大的内容保存在结果存储中，这里只放 process_id 等参数）
+        """
+        if job_type not in self.handlers:
+            raise ValueError(f"未知的任务类型: {job_type}")
+
+        job_id = uuid.uuid4().hex
+        self.db.create_job(job_id, user_id, job_type, payload)
+        self._wakeup.set()
+        return job_id
+
+    def _worker_loop(self):
+        while not self._stopping.is_set():
+            try:
+                job = self.db.claim_next_job(self.worker_id, self.lease_seconds)
+            except Exception as e:
+                print(f"领取任务失败: {e}")
+                job = None
+
+            if job is None:
+                self._cleanup()
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            self._run_job(job)
+
+    def _lease_loop(self):
+        """定期为正在执行的任务续约，并恢复其他进程遗留的租约过期任务"""
+        interval = self.lease_seconds / 3
+        while not self._stopping.wait(interval):
+            try:
+                self.db.renew_job_leases(self.worker_id, self.lease_seconds)
+            except Exception as e:
+                print(f"任务续约失败: {e}")
+            self._recover_expired()
+
+    def _recover_expired(self):
+        """租约过期的任务重新排队，超过最多执行次数的标记为失败并通知"""
+        try:
+            requeued, failed = self.db.requeue_expired_jobs(self.max_attempts)
+        except Exception as e:
+            print(f"恢复任务失败: {e}")
+            return
+        if requeued:
+            print(f"恢复了 {requeued} 个中断的生成任务")
+            self._wakeup.set()
+        for job_id in failed:
+            print(f"任务 {job_id} 多次中断，已标记为失败")
+            if self.on_finished:
+                try:
+                    self.on_finished(self.db.get_job(job_id))
+                except Exception as e:
+                    print(f"任务 {job_id} 完成回调出错: {e}")
+
+    def _cleanup(self):
+        """清理结束超过 retention 秒的任务记录（最多每小时一次）"""
+        now = time.monotonic()
+        with self._cleanup_lock:
+            if self._last_cleanup is not None and now - self._last_cleanup < JOB_CLEANUP_INTERVAL:
+                return
+            self._last_cleanup = now
+        try:
+            deleted = self.db.cleanup_finished_jobs(self.retention)
+        except Exception as e:
+            print(f"清理任务记录失败: {e}")
+            return
+        if deleted:
+            print(f"清理了 {deleted} 个已结束的任务记录")
+
+    def _run_job(self, job):
+        job_id = job['id']
+        handler = self.handlers.get(job['job_type'])
+        print(f"开始执行任务 {job_id} ({job['job_type']})")
+        # 任务中的接口调用按提交任务的用户公平排队
+        set_current_user(job.get('user_id'))
+        # 阶段耗时按任务的 process_id 归类（没有时由处理函数生成后设置）
+        metrics.set_current_process(job['payload'].get('process_id'))
+
+        def progress_callback(step, total):
+            if self.on_progress:
+                try:
+                    self.on_progress(job, step, total)
+                except Exception as e:
+                    print(f"任务 {job_id} 进度回调出错: {e}")
+
+        try:
+            if handler is None:
+                raise ValueError(f"未知的任务类型: {job['job_type']}")
+            with metrics.span('job', job_type=job['job_type']):
+                result = handler(job, progress_callback)
+            updated = self.db.finish_job(job_id, result, worker_id=self.worker_id)
+            print(f"任务 {job_id} 执行完成")
+        except Exception as e:
+            traceback.print_exc()
+            updated = self.db.fail_job(job_id, str(e), worker_id=self.worker_id)
+            print(f"任务 {job_id} 执行失败: {e}")
+
+        if not updated:
+            # 租约已过期，任务已被重新排队或由其他进程处理，结果以那边为准
+            print(f"任务 {job_id} 的租约已过期，不再更新状态")
+            return
+
+        if self.on_finished:
+            try:
+                self.on_finished(self.db.get_job(job_id))
+            except Exception as e:
+                print(f"任务 {job_id} 完成回调出错: {e}")
@@ -0,0 +1,181 @@
+import json
+
+
+# 解析失败的标记（与JSON中的null区分）
+_INVALID = object()
+
+
+class StoryboardStreamParser:
+    """
+    分镜JSON的增量解析器
+
+    逐段喂入LLM流式返回的文本，顶层对象的每个字段（如 character_consistency）
+    完整到达时产生一个字段事件，scenes_detail 数组中的每个场景完整到达时
+    产生一个场景事件，无需等待整个JSON结束。
+
+    JSON之前的多余内容（如 ```json 代码块标记）会被忽略。
+
+    用法:
+        parser = StoryboardStreamParser()
+        for chunk in stream:
+            for event, payload in parser.feed(chunk):
+                ...
+        result = parser.result()
+    """
+
+    # 需要逐个元素产生事件的数组字段
+    SCENES_KEY = 'scenes_detail'
+
+    def __init__(self):
+        self.buffer = ''
+        self._pos = 0
+        # 每层容器的解析状态
+        self._frames = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._root_start = None
+        self._root_end = None
+
+    def feed(self, text):
+        """
+        追加一段文本并解析
+
+        返回:
+            本次新完成的事件列表，每个事件为 (event, payload)：
+            ('field', {'key': 字段名, 'value': 字段值})
+            ('scene', {'scene_index': 场景序号（从1开始）, 'scene': 场景内容})
+        """
+        events = []
+        if not text or self._root_end is not None:
+            self.buffer += text or ''
+            return events
+
+        self.buffer += text
+        buf = self.buffer
+
+        for i in range(self._pos, len(buf)):
+            c = buf[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._on_string_end(i, events)
+                continue
+
+            if not self._frames:
+                # 跳过顶层对象之前的内容
+                if c == '{':
+                    self._root_start = i
+                    self._frames.append(self._new_frame('{'))
+                continue
+
+            frame = self._frames[-1]
+            if c in ' \t\r\n':
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+                if not frame['expect_key'] and frame['start'] is None:
+                    frame['start'] = i
+            elif c == ':':
+                frame['expect_key'] = False
+            elif c == ',':
+                self._end_scalar(frame, i, events)
+                frame['expect_key'] = frame['type'] == '{'
+            elif c in '{[':
+                if frame['start'] is None:
+                    frame['start'] = i
+                self._frames.append(self._new_frame(c))
+            elif c in '}]':
+                self._end_scalar(frame, i, events)
+                self._frames.pop()
+                if not self._frames:
+                    self._root_end = i + 1
+                    self._pos = len(buf)
+                    return events
+                self._complete(self._frames[-1], i + 1, events)
+            elif frame['start'] is None:
+                # 数字、true/false/null 等标量
+                frame['start'] = i
+
+        self._pos = len(buf)
+        return events
+
+    @staticmethod
+    def _new_frame(container_type):
+        return {
+            'type': container_type,
+            'expect_key': container_type == '{',
+            'key': None,
+            'start': None,  # 当前值的起始位置
+            'index': 0      # 数组中已完成的元素个数
+        }
+
+    def _on_string_end(self, i, events):
+        frame = self._frames[-1]
+        if frame['expect_key']:
+            key = self._loads(self.buffer[self._string_start:i + 1])
+            frame['key'] = None if key is _INVALID else key
+        else:
+            self._complete(frame, i + 1, events)
+
+    def _end_scalar(self, frame, end, events):
+        # 字符串和容器在结束时已经处理，这里只处理尚未结束的标量
+        if frame['start'] is not None:
+            self._complete(frame, end, events)
+
+    def _complete(self, frame, end, events):
+        """frame 中的当前值在 end 处结束"""
+        start = frame['start']
+        frame['start'] = None
+        if start is None:
+            return
+
+        depth = len(self._frames)
+        if depth == 1:
+            value = self._loads(self.buffer[start:end].strip())
+            if value is not _INVALID:
+                events.append(('field', {'key': frame['key'], 'value': value}))
+        elif depth == 2 and frame['type'] == '[' and self._frames[0]['key'] == self.SCENES_KEY:
+            frame['index'] += 1
+            value = self._loads(self.buffer[start:end].strip())
+            if value is not _INVALID:
+                events.append(('scene', {'scene_index': frame['index'], 'scene': value}))
+
+    @staticmethod
+    def _loads(text):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return _INVALID
+
+    def result(self):
+        """
+        解析完整结果
+
+        返回:
+            顶层JSON对象，尚未完整接收或格式错误时返回None
+        """
+        if self._root_end is None:
+            return None
+        value = self._loads(self.buffer[self._root_start:self._root_end])
+        return None if value is _INVALID else value
+
+
+def replay_storyboard_events(result):
+    """为已完整的分镜结果（如缓存命中）按流式解析的顺序生成同样的事件"""
+    events = []
+    if not isinstance(result, dict):
+        return events
+    for key, value in result.items():
+        if key == StoryboardStreamParser.SCENES_KEY and isinstance(value, list):
+            for index, scene in enumerate(value):
+                events.append(('scene', {'scene_index': index + 1, 'scene': scene}))
+        events.append(('field', {'key': key, 'value': value}))
+    return events
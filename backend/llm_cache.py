@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+
+# 缓存配置，可通过环境变量调整
+LLM_CACHE_DB = os.environ.get("LLM_CACHE_DB", "llm_cache.db")
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))  # 默认保留7天
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "2000"))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+class LLMResultCache:
+    """
+    LLM分镜结果的持久化缓存
+
+    以 (model, processing_rules, novel_text) 的哈希为键，超过TTL的条目失效，
+    超过条目数或总字节数上限时按最近访问时间淘汰（LRU）。
+
+    参数:
+        db_path: 缓存数据库文件路径
+        ttl: 条目有效期（秒）
+        max_entries: 最大条目数
+        max_bytes: 缓存内容最大总字节数
+    """
+
+    def __init__(self, db_path=LLM_CACHE_DB, ttl=LLM_CACHE_TTL,
+                 max_entries=LLM_CACHE_MAX_ENTRIES, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self.init_database()
+
+    def init_database(self):
+        """初始化缓存表"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)')
+
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def make_key(model, processing_rules, novel_text):
+        """根据模型、处理规则和小说文本生成缓存键"""
+        digest = hashlib.sha256()
+        for part in (model, processing_rules or '', novel_text or ''):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _record(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.inc('cache_requests_total', cache='llm', result='hit' if hit else 'miss')
+
+    def get(self, cache_key):
+        """读取缓存，未命中或已过期返回None"""
+        now = time.time()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('SELECT value, created_at FROM llm_cache WHERE cache_key = ?', (cache_key,))
+            row = cursor.fetchone()
+
+            if not row or now - row[1] > self.ttl:
+                if row:
+                    cursor.execute('DELETE FROM llm_cache WHERE cache_key = ?', (cache_key,))
+                    conn.commit()
+                self._record(False)
+                return None
+
+            cursor.execute('UPDATE llm_cache SET last_access = ? WHERE cache_key = ?', (now, cache_key))
+            conn.commit()
+        finally:
+            conn.close()
+
+        try:
+            value = json.loads(row[0])
+        except json.JSONDecodeError:
+            self._record(False)
+            return None
+
+        self._record(True)
+        return value
+
+    def set(self, cache_key, model, value):
+        """写入缓存，并按TTL和容量上限淘汰旧条目"""
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('''
+                INSERT OR REPLACE INTO llm_cache (cache_key, model, value, size, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (cache_key, model, data, len(data.encode('utf-8')), now, now))
+            self._evict(cursor, now)
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"写入LLM缓存失败: {e}")
+        finally:
+            conn.close()
+
+    def _evict(self, cursor, now):
+        # 先清理过期条目
+        cursor.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.ttl,))
+
+        # 条目数超限时淘汰最久未访问的条目
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache')
+        count, total_size = cursor.fetchone()
+        if count > self.max_entries:
+            cursor.execute('''
+                DELETE FROM llm_cache WHERE cache_key IN (
+                    SELECT cache_key FROM llm_cache ORDER BY last_access LIMIT ?
+                )
+            ''', (count - self.max_entries,))
+
+        # 总字节数超限时继续按LRU淘汰
+        if total_size > self.max_bytes:
+            cursor.execute('SELECT cache_key, size FROM llm_cache ORDER BY last_access')
+            to_delete = []
+            for cache_key, size in cursor.fetchall():
+                if total_size <= self.max_bytes:
+                    break
+                to_delete.append((cache_key,))
+                total_size -= size
+            cursor.executemany('DELETE FROM llm_cache WHERE cache_key = ?', to_delete)
+
+    def clear(self):
+        """清空缓存"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('DELETE FROM llm_cache')
+        conn.commit()
+        conn.close()
+
+    def stats(self):
+        """返回命中统计和当前缓存规模"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache')
+        entries, total_size = cursor.fetchone()
+        conn.close()
+
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+            'entries': entries,
+            'bytes': total_size
+        }
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """获取进程内共享的LLM结果缓存（懒加载）"""
+    global _llm_cache
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                _llm_cache = LLMResultCache()
+    return _llm_cache
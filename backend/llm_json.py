@@ -0,0 +1,247 @@
+import json
+import re
+
+
+# ```json ... ``` 代码块
+CODE_FENCE_PATTERN = re.compile(r'```[a-zA-Z]*\s*\n?(.*?)(?:```|$)', re.DOTALL)
+
+# 分镜JSON中的字段
+SCENE_FIELDS = ("scenes_detail", "scenes")
+CONSISTENCY_FIELDS = ("character_consistency", "environment_consistency")
+TEXT_LIST_FIELDS = ("scenes", "dialogue")
+
+# 结尾处的裸值（数字、true/false/null），可能被截断
+TRAILING_LITERAL_PATTERN = re.compile(r'(?<=[\[,:\s])[-+.0-9a-zA-Z]+$')
+
+
+class LLMJSONError(ValueError):
+    """LLM输出无法解析或修复为有效的分镜JSON"""
+
+
+def strip_code_fences(text):
+    """去掉 markdown 代码块标记，只保留第一个代码块中的内容"""
+    match = CODE_FENCE_PATTERN.search(text)
+    if match and match.group(1).strip():
+        return match.group(1)
+    return text
+
+
+def _remove_trailing_commas(text):
+    """删除对象和数组结尾多余的逗号（跳过字符串内容）"""
+    out = []
+    in_string = False
+    escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '}]':
+            # 回退到上一个非空白字符，是逗号则删除
+            i = len(out) - 1
+            while i >= 0 and out[i].isspace():
+                i -= 1
+            if i >= 0 and out[i] == ',':
+                del out[i]
+        out.append(ch)
+    return ''.join(out)
+
+
+def _scan(text):
+    """扫描文本，返回 (未闭合的括号栈, 是否停在字符串中, 最后一个字符串的起始位置)"""
+    stack = []
+    in_string = False
+    escape = False
+    string_start = None
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+            string_start = i
+        elif ch in '{[':
+            stack.append(ch)
+        elif ch in '}]' and stack:
+            stack.pop()
+    return stack, in_string, string_start
+
+
+def _is_complete_literal(token):
+    try:
+        json.loads(token)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+
+def _drop_dangling(text):
+    """删除被截断的结尾：多余的逗号、没有值的键、不完整的 true/false/null 或数字"""
+    while True:
+        text = text.rstrip()
+        stack, _, string_start = _scan(text)
+        literal = TRAILING_LITERAL_PATTERN.search(text)
+        if text.endswith(','):
+            text = text[:-1]
+        elif text.endswith(':'):
+            # "键": 后面没有值，连同键一起删除
+            text = text[:-1].rstrip()
+            if text.endswith('"'):
+                text = text[:_scan(text)[2]]
+        elif literal and not _is_complete_literal(literal.group(0)):
+            text = text[:literal.start()]
+        elif (text.endswith('"') and stack and stack[-1] == '{'
+              and text[:string_start].rstrip()[-1:] in ('{', ',')):
+            # 对象中只有键没有冒号和值
+            text = text[:string_start]
+        else:
+            return text
+
+
+def close_truncated_json(text):
+    """
+    补全被截断的JSON（例如输出达到 max_tokens 上限）
+
+    未结束的字符串元素整体丢弃（被截断的场景描述不完整），再删除悬空的逗号和键，
+    最后按嵌套顺序补上缺失的 ] 和 }。
+    """
+    stack, in_string, string_start = _scan(text)
+    if in_string:
+        text = text[:string_start]
+    text = _drop_dangling(text)
+    stack, _, _ = _scan(text)
+    closers = {'{': '}', '[': ']'}
+    return text + ''.join(closers[ch] for ch in reversed(stack))
+
+
+def _decode_object(text):
+    """从第一个 { 开始解码一个JSON值，忽略其后的多余内容"""
+    start = text.find('{')
+    if start < 0:
+        raise json.JSONDecodeError("未找到JSON对象", text, 0)
+    value, _ = json.JSONDecoder(strict=False).raw_decode(text, start)
+    return value
+
+
+def parse_llm_json(text):
+    """
+    宽松地解析LLM返回的JSON
+
+    依次尝试：直接解析；去掉代码块标记并截取第一个JSON对象；
+    删除结尾多余的逗号；补全被截断的括号和字符串。
+
+    返回:
+        (解析结果, 是否经过修复)
+
+    异常:
+        LLMJSONError: 所有修复手段都失败
+    """
+    if not isinstance(text, str) or not text.strip():
+        raise LLMJSONError("LLM返回内容为空")
+
+    try:
+        return json.loads(text, strict=False), False
+    except json.JSONDecodeError:
+        pass
+
+    candidate = strip_code_fences(text)
+    start = candidate.find('{')
+    if start < 0:
+        raise LLMJSONError("LLM返回内容中没有JSON对象")
+    candidate = candidate[start:]
+
+    attempts = (
+        lambda t: t,
+        _remove_trailing_commas,
+        lambda t: _remove_trailing_commas(close_truncated_json(t)),
+    )
+    last_error = None
+    for repair in attempts:
+        try:
+            return _decode_object(repair(candidate)), True
+        except json.JSONDecodeError as e:
+            last_error = e
+    raise LLMJSONError(f"无法修复LLM返回的JSON: {last_error}")
+
+
+def validate_storyboard(data):
+    """
+    校验并规范化分镜JSON
+
+    - 必须是对象，且 scenes_detail 或 scenes 至少有一个非空列表
+    - character_consistency / environment_consistency 必须是对象（缺失时补为空对象）
+    - scenes / dialogue 为字符串列表（单个字符串转为列表）
+    - 场景描述为空白的项会被去掉；scenes_detail、scenes、dialogue 按序号一一对应，
+      同一序号在三个列表中一起去掉（某个场景没有对白时保留空字符串，不影响对应关系）
+
+    返回:
+        (规范化后的数据, 错误列表)，错误列表为空表示校验通过
+    """
+    if not isinstance(data, dict):
+        return data, [f"顶层应为对象，实际为 {type(data).__name__}"]
+
+    errors = []
+    data = dict(data)
+
+    for field in CONSISTENCY_FIELDS:
+        value = data.get(field)
+        if value is None:
+            data[field] = {}
+        elif not isinstance(value, dict):
+            errors.append(f"{field} 应为对象，实际为 {type(value).__name__}")
+
+    lists = {}
+    for field in ("scenes_detail",) + TEXT_LIST_FIELDS:
+        value = data.get(field)
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = [value]
+        if not isinstance(value, list):
+            errors.append(f"{field} 应为列表，实际为 {type(value).__name__}")
+            continue
+        lists[field] = value
+
+    # 以场景描述（scenes_detail，没有时为 scenes）为准找出空白的序号，各列表同步去掉
+    primary = lists.get("scenes_detail") or lists.get("scenes") or []
+    blank = {i for i, scene in enumerate(primary) if not scene or (isinstance(scene, str) and not scene.strip())}
+    for field, value in lists.items():
+        data[field] = [item for i, item in enumerate(value) if i not in blank]
+
+    scenes = data.get("scenes_detail")
+    if isinstance(scenes, list):
+        bad = [i + 1 for i, scene in enumerate(scenes) if not isinstance(scene, (str, dict))]
+        if bad:
+            errors.append(f"scenes_detail 第 {bad} 项应为字符串或对象")
+
+    if not any(isinstance(data.get(field), list) and data.get(field) for field in SCENE_FIELDS):
+        errors.append("缺少非空的 scenes_detail 或 scenes")
+
+    return data, errors
+
+
+def load_storyboard(text):
+    """
+    解析并校验LLM返回的分镜JSON
+
+    返回:
+        (规范化后的分镜字典, 是否经过修复)
+
+    异常:
+        LLMJSONError: 无法解析或校验不通过（错误信息中包含具体原因）
+    """
+    data, repaired = parse_llm_json(text)
+    data, errors = validate_storyboard(data)
+    if errors:
+        raise LLMJSONError("分镜JSON校验失败: " + "；".join(errors))
+    return data, repaired
@@ -1,12 +1,14 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g, Response
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 import os
 import sys
 import json
+import threading
+import time
 import hashlib
 import secrets
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import uuid
 from werkzeug.utils import secure_filename
 
@@ -17,22 +19,50 @@ sys.path.append('./python_aigc')
 try:
     from python_LLM.doubao_1_5 import (
         process_novel_text,
-        save_to_json,
-        load_json_file,
-        read_role_docx,
+        process_novel_text_streaming,
         export_json_for_aigc
     )
     from python_aigc.seedream import (
+        PIPELINED_GENERATION,
+        PipelinedComicRenderer,
         process_llm_json_and_generate_comics,
         generate_comics_from_json_file,
-        save_comic_results
+        build_comic_results_data
     )
 except ImportError as e:
     print(f"导入模块失败: {e}")
     sys.exit(1)
 
 # 导入数据库模块
-from database import DatabaseManager
+from database import DatabaseManager, decode_history_cursor, encode_history_cursor
+from job_queue import JobWorkerPool
+from image_cache import collect_unreferenced_images
+from image_store import get_image_store
+from rate_limiter import set_current_user
+from rules_registry import DEFAULT_RULE_SET, get_rules_registry
+from artifacts import ArtifactStore, is_valid_process_id, new_process_id
+from socket_payloads import (
+    complete_payload,
+    parse_protocol_options,
+    record_streamed,
+    scene_image_payload,
+    text_complete_payload,
+    text_processing_payload
+)
+from generation_sessions import (
+    STAGE_COMICS_GENERATED,
+    STAGE_COMICS_PIPELINED,
+    STAGE_COMICS_QUEUED,
+    STAGE_FAILED,
+    STAGE_TEXT_PROCESSED,
+    STAGE_TEXT_PROCESSING,
+    GenerationSessionStore,
+    novel_text_hash,
+    session_room
+)
+from json_stream import replay_storyboard_events
+import metrics
+from metrics import set_current_process
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -57,6 +87,18 @@ def generate_avatar_filename(user_id, original_filename):
 
 # 配置CORS，允许所有来源和所有方法
 CORS(app, resources={r"/*": {"origins": "*", "methods": ["GET", "POST", "OPTIONS"]}})
+# Socket.IO 消息编码：默认JSON；设为 msgpack 时使用二进制编码
+# （需要安装 msgpack，客户端需使用 socket.io-msgpack-parser，所有客户端必须一致）
+SOCKETIO_SERIALIZER = os.environ.get('SOCKETIO_SERIALIZER', 'default')
+if SOCKETIO_SERIALIZER == 'msgpack':
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        print("未安装 msgpack，Socket.IO 使用默认的JSON编码")
+        SOCKETIO_SERIALIZER = 'default'
+# 长轮询响应超过此字节数时按客户端支持的 gzip/deflate 压缩
+SOCKETIO_COMPRESSION_THRESHOLD = int(os.environ.get('SOCKETIO_COMPRESSION_THRESHOLD', '1024'))
+
 # 配置SocketIO
 socketio = SocketIO(app,
                     cors_allowed_origins="*",
@@ -64,14 +106,25 @@ socketio = SocketIO(app,
                     transports=['websocket', 'polling'],
                     ping_timeout=30,
                     ping_interval=10,
-                    max_http_buffer_size=1024 * 1024 * 10)
+                    max_http_buffer_size=1024 * 1024 * 10,
+                    serializer=SOCKETIO_SERIALIZER,
+                    http_compression=True,
+                    compression_threshold=SOCKETIO_COMPRESSION_THRESHOLD)
+
+# 调试模式（启用 werkzeug 自动重载）
+DEBUG_MODE = os.environ.get('FLASK_DEBUG', '1') == '1'
 
 # 全局变量
-processing_rules = None
+rules_registry = get_rules_registry()
 db = DatabaseManager()
+# LLM分镜结果和连环画结果（保存在数据库中，读取时经过内存LRU缓存）
+artifact_store = ArtifactStore(db)
 
-# 存储处理状态
-processing_states = {}
+# 生成会话（按 process_id 和用户保存在数据库中，WebSocket断线重连后可以恢复）
+generation_sessions = GenerationSessionStore(db)
+
+# 已认证的WebSocket连接：{sid: {'user_id', 'username'}}，连接断开时删除
+socket_users = {}
 
 
 def hash_password(password):
@@ -89,6 +142,38 @@ def generate_session_token():
     return secrets.token_urlsafe(32)
 
 
+def get_processing_rules(name=None):
+    """
+    按名称获取处理规则集（规则文件修改后自动重新加载）
+
+    参数:
+        name: 规则集名称，为空时使用默认规则（role.docx）
+
+    异常:
+        ValueError: 规则集不存在或无法读取
+    """
+    rules = rules_registry.get(name)
+    if rules is None:
+        raise ValueError(f"未知的规则集: {name or DEFAULT_RULE_SET}")
+    return rules
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由统计HTTP请求次数、状态码和耗时"""
+    started = g.get('request_started')
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('http_requests_total', method=request.method, endpoint=endpoint, status=response.status_code)
+    if started is not None:
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint)
+    return response
+
+
 def get_user_from_request():
     """从请求中获取用户信息"""
     auth_header = request.headers.get('Authorization')
@@ -109,6 +194,22 @@ def safe_strip(value):
     return str(value).strip()
 
 
+def parse_history_date(value, end_of_day=False, tz_offset=None):
+    """
+    解析历史记录过滤日期（YYYY-MM-DD），转换为与 created_at（UTC）可比较的字符串
+
+    日期按用户所在时区的零点计算：tz_offset 为客户端的 getTimezoneOffset()（UTC减本地时间的分钟数），
+    未提供时使用服务器的本地时区。end_of_day 为True时返回次日零点，用作不包含的上限。
+    格式错误时抛出 ValueError。
+    """
+    day = datetime.strptime(value, '%Y-%m-%d')
+    if end_of_day:
+        day += timedelta(days=1)
+    if tz_offset is not None:
+        day = day.replace(tzinfo=timezone(-timedelta(minutes=tz_offset)))
+    return day.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
 # 修改注册接口，支持可选的头像
 @app.route('/api/register', methods=['POST', 'OPTIONS'])
 def register():
@@ -368,6 +469,23 @@ def delete_avatar():
         print(f"删除头像异常: {str(e)}")
         return jsonify({"error": f"删除失败: {str(e)}"}), 500
 
+@app.route('/api/images/<filename>', methods=['GET'])
+def get_image(filename):
+    """获取本地镜像的连环画图片（内容寻址，支持ETag、Range和长期缓存）"""
+    file_path, digest = get_image_store().resolve(filename)
+    if not file_path:
+        return jsonify({"error": "图片不存在"}), 404
+
+    ext = filename.rsplit('.', 1)[1].lower()
+    mimetype = f"image/{ext}" if ext != 'jpg' else 'image/jpeg'
+
+    # 文件名即内容哈希，内容永远不变，可以用哈希作为ETag并长期缓存
+    response = send_file(os.path.abspath(file_path), mimetype=mimetype, conditional=True, etag=digest,
+                         max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
 # 修改获取用户信息的接口，包含头像URL
 @app.route('/api/profile', methods=['GET', 'OPTIONS'])
 def get_profile():
@@ -404,12 +522,38 @@ def get_history():
     if not user:
         return jsonify({"error": "未认证"}), 401
 
-    limit = request.args.get('limit', 50, type=int)
+    limit = max(1, min(request.args.get('limit', 50, type=int), 100))
     offset = request.args.get('offset', 0, type=int)
+    cursor_token = request.args.get('cursor')
+    title = safe_strip(request.args.get('title')) or None
 
-    history = db.get_user_comics_history(user['id'], limit, offset)
-
-    # 简化返回数据，避免传输过大
+    # 可选的标题和日期范围过滤（日期按 tz_offset 指定的时区换算为UTC）
+    try:
+        tz_offset = request.args.get('tz_offset', type=int)
+        if tz_offset is not None and abs(tz_offset) > 14 * 60:
+            raise ValueError(tz_offset)
+        date_from = parse_history_date(request.args['date_from'], tz_offset=tz_offset) \
+            if request.args.get('date_from') else None
+        date_to = parse_history_date(request.args['date_to'], end_of_day=True, tz_offset=tz_offset) \
+            if request.args.get('date_to') else None
+    except ValueError:
+        return jsonify({"error": "日期格式应为 YYYY-MM-DD，tz_offset 应为时区偏移分钟数"}), 400
+
+    # 提供 cursor 时使用游标分页，否则兼容旧的 offset 分页
+    after = None
+    if cursor_token:
+        after = decode_history_cursor(cursor_token)
+        if not after:
+            return jsonify({"error": "无效的分页游标"}), 400
+
+    # 多取一条用于判断是否还有下一页
+    history = db.get_user_comics_history(user['id'], limit + 1, offset, after=after, title=title,
+                                         date_from=date_from, date_to=date_to)
+    has_more = len(history) > limit
+    history = history[:limit]
+    next_cursor = encode_history_cursor(history[-1]['created_at'], history[-1]['id']) if has_more else None
+
+    # 列表查询只返回摘要字段，避免传输过大
     simplified_history = []
     for item in history:
         simplified_history.append({
@@ -418,14 +562,15 @@ def get_history():
             'title': item['title'] or f"漫画 {item['process_id']}",
             'description': item['description'],
             'created_at': item['created_at'],
-            'total_scenes': len(item['comic_results']) if item['comic_results'] else 0,
-            'preview_image': item['comic_results'][0]['url'] if item['comic_results'] and len(
-                item['comic_results']) > 0 else None
+            'total_scenes': item['total_scenes'],
+            'preview_image': item['preview_image']
         })
 
     return jsonify({
         "history": simplified_history,
-        "total": len(history)
+        "total": db.count_user_comics_history(user['id'], title, date_from, date_to),
+        "next_cursor": next_cursor,
+        "has_more": has_more
     })
 
 
@@ -472,6 +617,27 @@ def health_check():
     return jsonify({"status": "healthy", "message": "服务运行正常"})
 
 
+@app.route('/api/rules', methods=['GET'])
+def list_rule_sets():
+    """可用的处理规则集（请求中通过 rules 字段选择）"""
+    return jsonify({"default": DEFAULT_RULE_SET, "rule_sets": rules_registry.names()})
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 格式的指标（各阶段耗时直方图、接口错误/重试/缓存命中计数）"""
+    return Response(metrics.get_registry().render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/metrics/<process_id>', methods=['GET'])
+def process_metrics(process_id):
+    """单次处理流程的阶段耗时明细（LLM、JSON解析、各场景图片生成、文件保存、数据库写入）"""
+    timings = metrics.get_registry().get_process_spans(process_id)
+    if timings is None:
+        return jsonify({"error": "找不到对应的耗时记录"}), 404
+    return jsonify(timings)
+
+
 # 添加根路径路由，避免404错误
 @app.route('/')
 def index():
@@ -486,7 +652,8 @@ def index():
             "/api/history - 获取历史记录",
             "/api/process-novel - 处理小说文本",
             "/api/generate-comics - 生成连环画",
-            "/api/full-process - 完整流程处理"
+            "/api/full-process - 完整流程处理",
+            "/api/jobs/<job_id> - 查询任务状态"
         ]
     })
 
@@ -515,18 +682,24 @@ def process_novel():
         if not novel_text:
             return jsonify({"error": "小说文本不能为空"}), 400
 
-        # 调用LLM处理
+        try:
+            processing_rules = get_processing_rules(data.get('rules'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # 生成唯一ID（阶段耗时按它归类）
+        process_id = new_process_id()
+        set_current_process(process_id)
+
+        # 调用LLM处理（接口调用按用户公平排队）
+        set_current_user(user['id'])
         llm_result = process_novel_text(novel_text, processing_rules)
 
         if not llm_result:
             return jsonify({"error": "LLM处理失败"}), 500
 
-        # 生成唯一ID
-        process_id = datetime.now().strftime('%Y%m%d_%H%M%S')
-
         # 保存LLM结果
-        llm_filename = f"llm_{process_id}.json"
-        save_to_json(llm_result, llm_filename)
+        artifact_store.put(process_id, 'llm', llm_result)
 
         return jsonify({
             "process_id": process_id,
@@ -562,30 +735,32 @@ def generate_comics():
         json_data = data.get('json_data')
 
         if process_id:
-            # 从文件加载
-            llm_filename = f"llm_{process_id}.json"
-            if not os.path.exists(llm_filename):
+            # 从结果存储加载
+            if not is_valid_process_id(process_id):
+                return jsonify({"error": "无效的process_id"}), 400
+            json_data = artifact_store.get(process_id, 'llm')
+            if json_data is None:
                 return jsonify({"error": "找不到对应的处理结果"}), 404
-            json_data = load_json_file(llm_filename)
 
         if not json_data:
             return jsonify({"error": "需要提供process_id或json_data"}), 400
 
-        # 调用AIGC生成连环画
-        comic_results = process_llm_json_and_generate_comics(json_data)
+        # 直接提交的LLM结果先保存，任务中只记录 process_id
+        if not process_id:
+            process_id = new_process_id()
+            artifact_store.put(process_id, 'llm', json_data)
 
-        if not comic_results:
-            return jsonify({"error": "连环画生成失败"}), 500
-
-        # 保存结果
-        comic_filename = f"comic_{process_id if process_id else datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        save_comic_results(comic_results, json_data, comic_filename)
+        # 提交到后台任务队列，立即返回任务ID
+        job_id = job_pool.submit(user['id'], 'generate_comics', {
+            'process_id': process_id,
+            'force_render': bool(data.get('force_render', False))
+        })
 
         return jsonify({
-            "comic_results": comic_results,
-            "total_scenes": len(comic_results),
-            "message": "连环画生成完成"
-        })
+            "job_id": job_id,
+            "status": "queued",
+            "message": "连环画生成任务已提交"
+        }), 202
 
     except Exception as e:
         print(f"生成漫画异常: {str(e)}")
@@ -617,50 +792,64 @@ def full_process():
         if not novel_text:
             return jsonify({"error": "小说文本不能为空"}), 400
 
-        # 第一步：LLM处理
-        llm_result = process_novel_text(novel_text, processing_rules)
-        if not llm_result:
-            return jsonify({"error": "LLM处理失败"}), 500
-
-        # 第二步：AIGC生成
-        comic_results = process_llm_json_and_generate_comics(llm_result)
-        if not comic_results:
-            return jsonify({"error": "连环画生成失败"}), 500
-
-        # 生成唯一ID
-        process_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        rules_name = data.get('rules')
+        try:
+            get_processing_rules(rules_name)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # 保存结果到文件
-        llm_filename = f"llm_{process_id}.json"
-        comic_filename = f"comic_{process_id}.json"
+        # 小说原文保存到结果存储，任务中只记录 process_id 和参数
+        process_id = new_process_id()
+        artifact_store.put(process_id, 'novel', novel_text)
 
-        save_to_json(llm_result, llm_filename)
-        save_comic_results(comic_results, llm_result, comic_filename)
-
-        # 保存到数据库历史记录
-        db.save_comics_history(
-            user_id=user['id'],
-            process_id=process_id,
-            novel_text=novel_text,
-            llm_result=llm_result,
-            comic_results=comic_results,
-            title=title,
-            description=description
-        )
+        # 提交到后台任务队列，LLM和图片生成都在工作线程中执行
+        job_id = job_pool.submit(user['id'], 'full_process', {
+            'process_id': process_id,
+            'title': title,
+            'description': description,
+            'rules': rules_name,
+            'force_render': bool(data.get('force_render', False)),
+            'pipelined': bool(data.get('pipelined', PIPELINED_GENERATION))
+        })
 
         return jsonify({
+            "job_id": job_id,
             "process_id": process_id,
-            "llm_result": llm_result,
-            "comic_results": comic_results,
-            "total_scenes": len(comic_results),
-            "message": "完整流程处理完成"
-        })
+            "status": "queued",
+            "message": "完整流程任务已提交"
+        }), 202
 
     except Exception as e:
         print(f"完整流程异常: {str(e)}")
         return jsonify({"error": f"处理失败: {str(e)}"}), 500
 
 
+@app.route('/api/jobs/<job_id>', methods=['GET', 'OPTIONS'])
+def get_job_status(job_id):
+    """查询后台任务状态"""
+    if request.method == 'OPTIONS':
+        return '', 200
+
+    user = get_user_from_request()
+    if not user:
+        return jsonify({"error": "未认证"}), 401
+
+    job = db.get_job(job_id)
+    if not job or job['user_id'] != user['id']:
+        return jsonify({"error": "任务不存在或无权访问"}), 404
+
+    return jsonify({
+        "job_id": job['id'],
+        "job_type": job['job_type'],
+        "status": job['status'],
+        "result": job['result'],
+        "error": job['error'],
+        "created_at": job['created_at'],
+        "started_at": job['started_at'],
+        "finished_at": job['finished_at']
+    })
+
+
 @app.route('/api/results/<process_id>', methods=['GET', 'OPTIONS'])
 def get_results(process_id):
     """获取处理结果"""
@@ -672,14 +861,14 @@ def get_results(process_id):
         return jsonify({"error": "未认证"}), 401
 
     try:
-        comic_filename = f"comic_{process_id}.json"
-        if not os.path.exists(comic_filename):
+        if not is_valid_process_id(process_id):
+            return jsonify({"error": "无效的process_id"}), 400
+        results_text = artifact_store.get_text(process_id, 'comic')
+        if results_text is None:
             return jsonify({"error": "找不到对应的处理结果"}), 404
 
-        with open(comic_filename, 'r', encoding='utf-8') as f:
-            results = json.load(f)
-
-        return jsonify(results)
+        # 直接返回保存的JSON文本，不重新解析和序列化
+        return Response(results_text, mimetype='application/json')
 
     except Exception as e:
         print(f"获取结果异常: {str(e)}")
@@ -697,11 +886,9 @@ def handle_connect():
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    """客户端断开连接事件"""
+    """客户端断开连接事件（生成会话不受影响，重连后可以恢复）"""
     print(f"客户端已断开: {request.sid}")
-    # 清理该客户端的处理状态
-    if request.sid in processing_states:
-        del processing_states[request.sid]
+    socket_users.pop(request.sid, None)
 
 
 @socketio.on('authenticate')
@@ -730,97 +917,266 @@ def handle_authenticate(data):
 
     print(f"认证成功: user_id={user['id']}, username={user['username']}")
 
-    # 存储处理状态
-    processing_states[request.sid] = {
+    # 记录连接对应的用户
+    socket_users[request.sid] = {
         'user_id': user['id'],
         'username': user['username']
     }
 
+    # 返回尚未结束的生成会话，断线重连的客户端可以通过 resume_session 恢复
+    sessions = [generation_sessions.summary(item) for item in generation_sessions.active_sessions(user['id'])]
     emit('authentication_result', {
         'success': True,
         'username': user['username'],
-        'message': '认证成功'
+        'message': '认证成功',
+        'sessions': sessions
     })
 
 
+@socketio.on('resume_session')
+def handle_resume_session(data):
+    """断线重连后恢复生成会话：重新加入会话房间，并补发 last_seq 之后错过的事件"""
+    user = socket_users.get(request.sid)
+    if not user:
+        emit('resume_error', {'error': '请先登录'})
+        return
+
+    process_id = data.get('process_id')
+    session = generation_sessions.get(process_id, user_id=user['user_id']) if is_valid_process_id(process_id) else None
+    if not session:
+        emit('resume_error', {'process_id': process_id, 'error': '找不到对应的生成会话'})
+        return
+
+    try:
+        last_seq = int(data.get('last_seq') or 0)
+    except (TypeError, ValueError):
+        last_seq = 0
+    replay_session(session, last_seq)
+
+
+def emit_session_event(process_id, event, data):
+    """推送生成会话的事件：记录序号后发送到会话房间（包括断线重连后重新加入的连接）"""
+    socketio.emit(event, generation_sessions.record(process_id, event, data), to=session_room(process_id))
+
+
+def storyboard_event(process_id, event, payload):
+    """把LLM流式分镜事件转换为推送给客户端的 (事件名, 数据)，不需要推送时返回None"""
+    if event == 'scene':
+        return 'scene_ready', {'process_id': process_id, **payload}
+    if event == 'field' and payload['key'] in ('character_consistency', 'environment_consistency'):
+        return 'consistency_ready', {'process_id': process_id, **payload}
+    return None
+
+
+def make_storyboard_emitter(process_id, streamed=None):
+    """
+    生成把LLM流式分镜事件推送给客户端的回调
+
+    每个场景完整到达时推送 scene_ready，角色/环境一致性描述到达时推送 consistency_ready，
+    前端无需等待整个JSON生成完毕即可展示内容。传入 streamed 字典时记录已推送的内容，
+    文本处理完成时据此判断客户端收到的分镜是否需要替换（见 text_complete_payload）。
+    """
+    def on_event(event, payload):
+        converted = storyboard_event(process_id, event, payload)
+        if converted:
+            if streamed is not None:
+                record_streamed(streamed, event, payload)
+            emit_session_event(process_id, *converted)
+
+    return on_event
+
+
+def make_scene_image_emitter(process_id, job_id, options):
+    """生成把单张图片完成事件（scene_image_ready）推送给客户端的回调，只在精简格式下推送"""
+    if not options.get('compact'):
+        return None
+
+    def on_scene(scene_index, result):
+        emit_session_event(process_id, 'scene_image_ready',
+                           scene_image_payload(process_id, job_id, scene_index, result, options))
+
+    return on_scene
+
+
+def load_complete_payload(job_id, process_id, protocol, message=None):
+    """根据结果存储中的连环画结果（和LLM结果）生成 full_process_complete 事件，结果不存在时返回None"""
+    comic_data = artifact_store.get(process_id, 'comic')
+    if comic_data is None:
+        return None
+    llm_result = None if protocol.get('compact') else artifact_store.get(process_id, 'llm')
+    return complete_payload(job_id, process_id, comic_data, protocol, llm_result=llm_result, message=message)
+
+
+def session_snapshot_events(session):
+    """
+    根据持久化的状态重新生成会话的事件（内存中的事件记录不完整时使用）
+
+    包括分镜和一致性描述、文本处理完成，以及任务的完成/失败/进行中状态；
+    序号统一为当前最新的序号，客户端据此继续接收之后的事件。
+    """
+    process_id = session['process_id']
+    seq = generation_sessions.current_seq(process_id)
+    protocol = session.get('protocol') or {}
+    full_process = session['flow'] == 'full_process'
+    events = []
+
+    def add(event, data):
+        events.append((event, {**data, 'seq': seq}))
+
+    llm_result = artifact_store.get(process_id, 'llm')
+    if llm_result is not None:
+        streamed = {}
+        for event, payload in replay_storyboard_events(llm_result):
+            converted = storyboard_event(process_id, event, payload)
+            if converted:
+                record_streamed(streamed, event, payload)
+                add(*converted)
+        if full_process:
+            add('full_process_text_complete', text_complete_payload(
+                process_id, llm_result, protocol, job_id=session['job_id'], message="小说文本处理完成",
+                streamed=streamed))
+        else:
+            add('text_processing_complete', text_processing_payload(
+                process_id, llm_result, message="小说文本处理完成，准备生成连环画"))
+
+    # 已结束的任务记录可能已被清理，此时以会话阶段为准
+    job = db.get_job(session['job_id']) if session['job_id'] else None
+    done = job['status'] == 'done' if job else session['stage'] == STAGE_COMICS_GENERATED
+    complete = load_complete_payload(session['job_id'], process_id, protocol, message="完整流程处理完成") if done else None
+    if complete:
+        add('full_process_complete', complete)
+    elif job and job['status'] == 'failed':
+        add('full_process_error', {'process_id': process_id, 'job_id': job['id'], 'error': f"生成失败: {job['error']}"})
+    elif session['stage'] == STAGE_FAILED:
+        add('full_process_error' if full_process else 'process_error',
+            {'process_id': process_id, 'error': f"处理失败: {session['error']}"})
+    elif job:
+        add('full_process_status', {
+            'status': 'processing',
+            'message': '连环画图片生成中...',
+            'step': 4,
+            'process_id': process_id,
+            'job_id': job['id']
+        })
+    return events
+
+
+def replay_session(session, last_seq=0):
+    """
+    把当前连接加入会话房间，并补发 last_seq 之后的事件
+
+    内存中有完整的事件记录时原样补发，否则（服务重启或事件过多）按持久化的状态重新生成。
+    先加入房间再读取记录，补发和实时推送可能有少量重复，客户端按 seq 去重。
+    """
+    process_id = session['process_id']
+    join_room(session_room(process_id))
+    events = generation_sessions.events_since(process_id, last_seq)
+    if events is not None:
+        metrics.inc('generation_session_resumes_total', result='replay')
+    else:
+        metrics.inc('generation_session_resumes_total', result='snapshot')
+        events = session_snapshot_events(session)
+
+    for event, data in events:
+        emit(event, data)
+    emit('session_resumed', {**generation_sessions.summary(session), 'replayed': len(events)})
+
+
+def find_duplicate_session(user_id, flow, text_hash):
+    """查找同一用户对同一小说文本尚未结束的生成会话，重复提交时复用而不是重新调用接口"""
+    for session in generation_sessions.active_sessions(user_id, text_hash=text_hash):
+        if session['flow'] == flow:
+            return session
+    return None
+
+
 # 原有的WebSocket处理函数保持不变，但需要确保有正确的用户认证检查
 @socketio.on('process_novel')
 def handle_process_novel(data):
     """WebSocket处理小说文本 - 第一阶段"""
+    process_id = None
     try:
         # 检查用户认证
-        if request.sid not in processing_states or 'user_id' not in processing_states[request.sid]:
+        user = socket_users.get(request.sid)
+        if not user:
             emit('process_error', {'error': '请先登录'})
             return
 
-        user_id = processing_states[request.sid]['user_id']
+        user_id = user['user_id']
+        set_current_user(user_id)
         novel_text = data.get('novel_text', '')
 
         if not novel_text:
             emit('process_error', {'error': '小说文本不能为空'})
             return
 
-        emit('process_status', {'status': 'processing', 'message': '开始处理小说文本...', 'step': 1})
-
-        # 调用LLM处理
-        emit('process_status', {'status': 'processing', 'message': '正在调用LLM处理文本...', 'step': 2})
-        llm_result = process_novel_text(novel_text, processing_rules)
+        rules_name = data.get('rules')
+        try:
+            processing_rules = get_processing_rules(rules_name)
+        except ValueError as e:
+            emit('process_error', {'error': str(e)})
+            return
 
-        if not llm_result:
-            emit('process_error', {'error': 'LLM处理失败'})
+        # 同一小说正在处理时（例如断线重连后重新提交）继续之前的会话
+        text_hash = novel_text_hash(novel_text, rules_name)
+        duplicate = find_duplicate_session(user_id, 'process_novel', text_hash)
+        if duplicate:
+            print(f"复用进行中的生成会话: {duplicate['process_id']}")
+            metrics.inc('generation_session_resumes_total', result='duplicate')
+            replay_session(duplicate)
             return
 
-        emit('process_status', {'status': 'processing', 'message': 'LLM处理完成，正在准备结果...', 'step': 3})
+        emit('process_status', {'status': 'processing', 'message': '开始处理小说文本...', 'step': 1})
 
-        # 生成唯一ID
-        process_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        # 生成唯一ID（流式事件需要携带），之后的事件都推送到该会话的房间
+        process_id = new_process_id()
+        set_current_process(process_id)
+        generation_sessions.create(process_id, user_id, 'process_novel', STAGE_TEXT_PROCESSING, novel_text,
+                                   text_hash=text_hash, rules=rules_name)
+        join_room(session_room(process_id))
+
+        # 调用LLM流式处理，每个场景完整到达时立即推送 scene_ready
+        emit('process_status', {'status': 'processing', 'message': '正在调用LLM处理文本...', 'step': 2, 'process_id': process_id})
+        llm_result = process_novel_text_streaming(
+            novel_text, processing_rules,
+            event_callback=make_storyboard_emitter(process_id)
+        )
 
-        # 保存LLM结果
-        llm_filename = f"llm_{process_id}.json"
-        save_to_json(llm_result, llm_filename)
+        if not isinstance(llm_result, dict):
+            generation_sessions.update(process_id, stage=STAGE_FAILED, error='LLM处理失败')
+            emit_session_event(process_id, 'process_error', {'process_id': process_id, 'error': 'LLM处理失败'})
+            return
 
-        # 存储处理状态
-        processing_states[request.sid].update({
-            'process_id': process_id,
-            'llm_result': llm_result,
-            'llm_filename': llm_filename,
-            'current_stage': 'text_processed',
-            'novel_text': novel_text
-        })
+        emit('process_status', {'status': 'processing', 'message': 'LLM处理完成，正在准备结果...', 'step': 3})
 
-        # 发送文本处理结果给前端
-        text_result = {
-            "process_id": process_id,
-            "scenes_count": len(llm_result.get('scenes_detail', [])),
-            "character_consistency": llm_result.get('character_consistency', {}),
-            "environment_consistency": llm_result.get('environment_consistency', {}),
-            "scenes_preview": [
-                {
-                    "scene_index": i + 1,
-                    "description": scene[:100] + "..." if len(scene) > 100 else scene
-                }
-                for i, scene in enumerate(llm_result.get('scenes_detail', [])[:5])  # 只发送前5个场景预览
-            ],
-            "message": "小说文本处理完成，准备生成连环画"
-        }
+        # 保存LLM结果，更新会话状态
+        artifact_store.put(process_id, 'llm', llm_result)
+        generation_sessions.update(process_id, stage=STAGE_TEXT_PROCESSED)
 
-        emit('text_processing_complete', text_result)
+        # 发送文本处理结果给前端（只发送前5个场景预览）
+        emit_session_event(process_id, 'text_processing_complete', text_processing_payload(
+            process_id, llm_result, message="小说文本处理完成，准备生成连环画"))
 
     except Exception as e:
         print(f"处理小说异常: {str(e)}")
+        if process_id:
+            generation_sessions.update(process_id, stage=STAGE_FAILED, error=str(e))
         emit('process_error', {'error': f'处理失败: {str(e)}'})
 
 
 @socketio.on('full_process')
 def handle_full_process(data):
     """WebSocket完整流程：从小说到连环画 - 分阶段处理"""
+    process_id = None
     try:
         # 检查用户认证
-        if request.sid not in processing_states or 'user_id' not in processing_states[request.sid]:
+        user = socket_users.get(request.sid)
+        if not user:
             emit('full_process_error', {'error': '请先登录'})
             return
 
-        user_id = processing_states[request.sid]['user_id']
+        user_id = user['user_id']
+        set_current_user(user_id)
         novel_text = data.get('novel_text', '')
         title = safe_strip(data.get('title'))
         description = safe_strip(data.get('description'))
@@ -829,48 +1185,94 @@ def handle_full_process(data):
             emit('full_process_error', {'error': '小说文本不能为空'})
             return
 
-        emit('full_process_status', {'status': 'processing', 'message': '开始完整流程处理...', 'step': 1})
-
-        # 第一步：LLM处理
-        emit('full_process_status', {'status': 'processing', 'message': '正在处理小说文本...', 'step': 2})
-        llm_result = process_novel_text(novel_text, processing_rules)
+        rules_name = data.get('rules')
+        try:
+            processing_rules = get_processing_rules(rules_name)
+            # 消息格式：compact 精简格式和 fields 字段选择（见 socket_payloads）
+            protocol = parse_protocol_options(data)
+        except ValueError as e:
+            emit('full_process_error', {'error': str(e)})
+            return
 
-        if not llm_result:
-            emit('full_process_error', {'error': 'LLM处理失败'})
+        # 同一小说正在处理时（例如断线重连后重新提交）继续之前的会话，不再重复调用接口
+        force_render = bool(data.get('force_render', False))
+        text_hash = novel_text_hash(novel_text, rules_name)
+        duplicate = None if force_render else find_duplicate_session(user_id, 'full_process', text_hash)
+        if duplicate:
+            print(f"复用进行中的生成会话: {duplicate['process_id']}")
+            metrics.inc('generation_session_resumes_total', result='duplicate')
+            emit('full_process_status', {
+                'status': 'resumed',
+                'message': '该小说正在处理中，继续之前的进度',
+                'step': 2,
+                'process_id': duplicate['process_id'],
+                'job_id': duplicate['job_id']
+            })
+            replay_session(duplicate)
             return
 
-        # 生成唯一ID
-        process_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        emit('full_process_status', {'status': 'processing', 'message': '开始完整流程处理...', 'step': 1})
 
-        # 保存LLM结果
-        llm_filename = f"llm_{process_id}.json"
-        save_to_json(llm_result, llm_filename)
+        # 生成唯一ID（流式事件需要携带），之后的事件都推送到该会话的房间
+        process_id = new_process_id()
+        set_current_process(process_id)
+        pipelined = data.get('pipelined', PIPELINED_GENERATION)
+        generation_sessions.create(
+            process_id, user_id, 'full_process',
+            STAGE_COMICS_PIPELINED if pipelined else STAGE_TEXT_PROCESSING,
+            novel_text, text_hash=text_hash, title=title, description=description, rules=rules_name,
+            protocol=protocol
+        )
+        join_room(session_room(process_id))
+
+        # 流水线模式：LLM和图片生成都交给后台任务，分镜一到达就开始生成图片
+        if pipelined:
+            artifact_store.put(process_id, 'novel', novel_text)
+            job_id = job_pool.submit(user_id, 'full_process', {
+                'process_id': process_id,
+                'title': title,
+                'description': description,
+                'rules': rules_name,
+                'force_render': force_render,
+                'pipelined': True,
+                'protocol': protocol,
+                'session': True
+            })
+            generation_sessions.update(process_id, job_id=job_id)
+            emit('full_process_status', {
+                'status': 'processing',
+                'message': '正在处理小说文本，分镜生成后立即开始生成图片...',
+                'step': 2,
+                'process_id': process_id,
+                'job_id': job_id
+            })
+            return
 
-        # 存储处理状态
-        processing_states[request.sid].update({
-            'process_id': process_id,
-            'llm_result': llm_result,
-            'llm_filename': llm_filename,
-            'current_stage': 'text_processed',
-            'novel_text': novel_text,
-            'title': title,
-            'description': description
-        })
+        # 第一步：LLM流式处理，每个场景完整到达时立即推送 scene_ready
+        emit('full_process_status', {'status': 'processing', 'message': '正在处理小说文本...', 'step': 2, 'process_id': process_id})
+        streamed = {}
+        llm_result = process_novel_text_streaming(
+            novel_text, processing_rules,
+            event_callback=make_storyboard_emitter(process_id, streamed)
+        )
 
-        # 发送文本处理结果给前端
-        text_result = {
-            "process_id": process_id,
-            "scenes_count": len(llm_result.get('scenes_detail', [])),
-            "character_consistency": llm_result.get('character_consistency', {}),
-            "environment_consistency": llm_result.get('environment_consistency', {}),
-            "scenes_detail": llm_result.get('scenes_detail', []),
-            "message": "小说文本处理完成，开始生成连环画"
-        }
+        if not isinstance(llm_result, dict):
+            generation_sessions.update(process_id, stage=STAGE_FAILED, error='LLM处理失败')
+            emit_session_event(process_id, 'full_process_error', {'process_id': process_id, 'error': 'LLM处理失败'})
+            return
+
+        # 保存LLM结果，更新会话状态
+        artifact_store.put(process_id, 'llm', llm_result)
+        generation_sessions.update(process_id, stage=STAGE_TEXT_PROCESSED)
 
-        emit('full_process_text_complete', text_result)
+        # 发送文本处理结果给前端（精简格式下场景已通过 scene_ready 发送，最终结果有变化时重新发送）
+        emit_session_event(process_id, 'full_process_text_complete', text_complete_payload(
+            process_id, llm_result, protocol, message="小说文本处理完成，开始生成连环画", streamed=streamed))
 
     except Exception as e:
         print(f"完整流程异常: {str(e)}")
+        if process_id:
+            generation_sessions.update(process_id, stage=STAGE_FAILED, error=str(e))
         emit('full_process_error', {'error': f'处理失败: {str(e)}'})
 
 
@@ -878,72 +1280,80 @@ def handle_full_process(data):
 def handle_start_comics_generation(data):
     """开始生成连环画（在文本处理完成后由前端触发）"""
     try:
-        process_id = data.get('process_id')
+        user = socket_users.get(request.sid)
+        if not user:
+            emit('generation_error', {'error': '请先登录'})
+            return
 
-        # 从处理状态中获取数据
-        client_state = processing_states.get(request.sid, {})
-        if not client_state or client_state.get('process_id') != process_id:
+        # 按 process_id 查找生成会话（可以是断线重连之前的连接创建的）
+        process_id = data.get('process_id')
+        session = None
+        if is_valid_process_id(process_id):
+            session = generation_sessions.get(process_id, user_id=user['user_id'], with_text=True)
+        if not session:
             emit('generation_error', {'error': '找不到对应的处理状态'})
             return
+        join_room(session_room(process_id))
+        force_render = bool(data.get('force_render', False))
 
-        json_data = client_state.get('llm_result')
-        if not json_data:
-            emit('generation_error', {'error': '没有可用的文本处理结果'})
+        if session['stage'] == STAGE_TEXT_PROCESSING:
+            emit('generation_error', {'error': '文本处理尚未完成'})
             return
 
-        emit('full_process_status', {'status': 'processing', 'message': '开始生成连环画图片...', 'step': 4})
-
-        # 调用AIGC生成连环画
-        comic_results = process_llm_json_and_generate_comics_with_progress(
-            json_data,
-            progress_callback=lambda step, total: emit('full_process_progress', {
-                'step': step,
-                'total': total,
-                'message': f'正在生成第 {step}/{total} 张图片...'
+        # 流水线模式下图片已经在生成，或者已提交过生成任务，不再重复提交
+        if session['stage'] in (STAGE_COMICS_PIPELINED, STAGE_COMICS_QUEUED):
+            emit('full_process_status', {
+                'status': 'processing',
+                'message': '连环画图片已在生成中...',
+                'step': 4,
+                'job_id': session['job_id']
             })
-        )
-
-        if not comic_results:
-            emit('full_process_error', {'error': '连环画生成失败'})
             return
 
-        emit('full_process_status', {'status': 'processing', 'message': '正在保存最终结果...', 'step': 5})
-
-        # 保存结果到文件
-        llm_filename = f"llm_{process_id}.json"
-        comic_filename = f"comic_{process_id}.json"
-
-        save_to_json(json_data, llm_filename)
-        save_comic_results(comic_results, json_data, comic_filename)
-
-        # 保存到数据库历史记录
-        user_id = client_state.get('user_id')
-        novel_text = client_state.get('novel_text', '')
-        title = client_state.get('title', '')
-        description = client_state.get('description', '')
-
-        if user_id:
-            db.save_comics_history(
-                user_id=user_id,
-                process_id=process_id,
-                novel_text=novel_text,
-                llm_result=json_data,
-                comic_results=comic_results,
-                title=title,
-                description=description
-            )
+        protocol = session['protocol'] or parse_protocol_options({})
 
-        # 更新处理状态
-        processing_states[request.sid]['comic_results'] = comic_results
-        processing_states[request.sid]['comic_filename'] = comic_filename
-        processing_states[request.sid]['current_stage'] = 'comics_generated'
+        # 已经生成完成：直接发送结果
+        if session['stage'] == STAGE_COMICS_GENERATED and not force_render:
+            complete = load_complete_payload(session['job_id'], process_id, protocol, message="完整流程处理完成")
+            if complete:
+                emit('full_process_complete', complete)
+                return
 
-        emit('full_process_complete', {
-            "process_id": process_id,
-            "llm_result": json_data,
-            "comic_results": comic_results,
-            "total_scenes": len(comic_results),
-            "message": "完整流程处理完成"
+        json_data = artifact_store.get(process_id, 'llm')
+        if not json_data:
+            emit('generation_error', {'error': '没有可用的文本处理结果'})
+            return
+
+        # 消息格式沿用文本处理时的设置，请求中指定时以请求为准
+        if 'compact' in data or 'fields' in data:
+            try:
+                protocol = parse_protocol_options(data)
+            except ValueError as e:
+                emit('generation_error', {'error': str(e)})
+                return
+
+        # 先更新会话阶段再提交任务，任务很快结束时完成状态不会被覆盖
+        generation_sessions.update(process_id, stage=STAGE_COMICS_QUEUED, protocol=protocol, error=None)
+        # 保存历史记录需要小说原文，任务中只记录 process_id
+        artifact_store.put(process_id, 'novel', session['novel_text'], overwrite=False)
+
+        # 提交到后台任务队列，进度和结果由工作线程推送到会话房间
+        job_id = job_pool.submit(user['user_id'], 'generate_comics', {
+            'process_id': process_id,
+            'title': session['title'] or '',
+            'description': session['description'] or '',
+            'save_history': True,
+            'force_render': force_render,
+            'protocol': protocol,
+            'session': True
+        })
+        generation_sessions.update(process_id, job_id=job_id)
+
+        emit('full_process_status', {
+            'status': 'processing',
+            'message': '开始生成连环画图片...',
+            'step': 4,
+            'job_id': job_id
         })
 
     except Exception as e:
@@ -951,23 +1361,217 @@ def handle_start_comics_generation(data):
         emit('full_process_error', {'error': f'生成失败: {str(e)}'})
 
 
-def process_llm_json_and_generate_comics_with_progress(json_data, progress_callback=None):
-    """支持进度回调的AIGC生成函数"""
-    try:
-        from python_aigc.seedream import process_llm_json_and_generate_comics
+def generate_and_save_comics(process_id, json_data, progress_callback=None, force_render=False, renderer=None,
+                             scene_callback=None):
+    """
+    生成连环画并保存结果，失败时抛出异常
+
+    传入 renderer（流水线模式）时，只补齐并等待流式阶段已开始的生成；
+    scene_callback 在每个场景完成时调用（流水线模式下由 renderer 自己的回调负责）
+    """
+    with metrics.span('comics_generation', mode='pipelined' if renderer is not None else 'batch'):
+        if renderer is not None:
+            comic_results = renderer.finish(json_data)
+        else:
+            comic_results = process_llm_json_and_generate_comics(
+                json_data,
+                progress_callback=progress_callback,
+                force_render=force_render,
+                scene_callback=scene_callback
+            )
+    if not comic_results:
+        raise Exception("连环画生成失败")
+
+    # 保存结果（LLM结果在文本处理阶段已经保存过时不再重复写入）
+    artifact_store.put(process_id, 'llm', json_data, overwrite=False)
+    artifact_store.put(process_id, 'comic', build_comic_results_data(comic_results, json_data))
+    collect_images_if_due()
+    return comic_results
+
 
-        # 这里可以添加更详细的进度跟踪
-        # 暂时使用原函数，在实际应用中可以根据需要修改seedream.py以支持进度回调
-        return process_llm_json_and_generate_comics(json_data)
+# 两次清理本地图片存储之间的最短间隔（秒）
+IMAGE_GC_INTERVAL = float(os.environ.get('IMAGE_GC_INTERVAL', str(24 * 3600)))
+_image_gc_lock = threading.Lock()
+_last_image_gc = None
+
+
+def collect_images_if_due():
+    """清理不再被图片缓存、处理结果或历史记录引用的本地图片（在生成任务中执行，最多每 IMAGE_GC_INTERVAL 秒一次）"""
+    global _last_image_gc
+    now = time.monotonic()
+    with _image_gc_lock:
+        if _last_image_gc is not None and now - _last_image_gc < IMAGE_GC_INTERVAL:
+            return
+        _last_image_gc = now
+    try:
+        deleted, freed = collect_unreferenced_images(db.iter_comic_result_texts())
     except Exception as e:
-        print(f"AIGC生成失败: {e}")
-        return None
+        print(f"清理本地图片失败: {e}")
+        return
+    if deleted:
+        print(f"清理了 {deleted} 个未引用的本地图片，释放 {freed / 1024 / 1024:.1f} MB")
+
+
+def run_full_process_job(job, progress_callback):
+    """后台任务：从小说到连环画的完整流程，返回 process_id 和场景数（内容在结果存储中）"""
+    payload = job['payload']
+    process_id = payload['process_id']
+    novel_text = artifact_store.get(process_id, 'novel')
+    if novel_text is None:
+        raise Exception("找不到任务对应的小说原文")
+    set_current_process(process_id)
+    force_render = payload.get('force_render', False)
+    # 由WebSocket提交的任务有对应的生成会话，事件推送到会话房间
+    has_session = bool(payload.get('session'))
+    processing_rules = get_processing_rules(payload.get('rules'))
+    protocol = payload.get('protocol') or {}
+    scene_callback = make_scene_image_emitter(process_id, job['id'], protocol) if has_session else None
+
+    # 第一步：LLM处理
+    renderer = None
+    streamed = {}  # 已推送给客户端的分镜内容
+    if payload.get('pipelined'):
+        # 流水线模式：流式解析分镜，场景一到达就开始生成图片，同时推送给客户端
+        renderer = PipelinedComicRenderer(progress_callback, force_render=force_render, scene_callback=scene_callback)
+        emitter = make_storyboard_emitter(process_id, streamed) if has_session else None
+
+        def on_event(event, event_payload):
+            renderer.on_event(event, event_payload)
+            if emitter:
+                emitter(event, event_payload)
+
+        llm_result = process_novel_text_streaming(novel_text, processing_rules, event_callback=on_event)
+    else:
+        llm_result = process_novel_text(novel_text, processing_rules)
+
+    if not isinstance(llm_result, dict):
+        if renderer:
+            renderer.cancel()
+        raise Exception("LLM处理失败")
+
+    # 先保存LLM结果，图片生成中断（如服务重启）后重连的客户端仍能拿到分镜
+    artifact_store.put(process_id, 'llm', llm_result, overwrite=False)
+
+    if renderer and has_session:
+        emit_session_event(process_id, 'full_process_text_complete', text_complete_payload(
+            process_id, llm_result, protocol, job_id=job['id'], message="小说文本处理完成，连环画图片生成中",
+            streamed=streamed))
+
+    # 第二步：AIGC生成（流水线模式下等待已开始的生成完成）
+    comic_results = generate_and_save_comics(process_id, llm_result, progress_callback,
+                                             force_render=force_render, renderer=renderer,
+                                             scene_callback=scene_callback)
+
+    # 保存到数据库历史记录
+    db.save_comics_history(
+        user_id=job['user_id'],
+        process_id=process_id,
+        novel_text=novel_text,
+        llm_result=llm_result,
+        comic_results=comic_results,
+        title=payload.get('title'),
+        description=payload.get('description')
+    )
+
+    return {
+        "process_id": process_id,
+        "total_scenes": len(comic_results)
+    }
+
+
+def run_generate_comics_job(job, progress_callback):
+    """后台任务：根据保存的LLM结果生成连环画，返回 process_id 和场景数"""
+    payload = job['payload']
+    process_id = payload['process_id']
+    json_data = artifact_store.get(process_id, 'llm')
+    if not json_data:
+        raise Exception("找不到任务对应的文本处理结果")
+    set_current_process(process_id)
+
+    scene_callback = None
+    if payload.get('session'):
+        scene_callback = make_scene_image_emitter(process_id, job['id'], payload.get('protocol') or {})
+    comic_results = generate_and_save_comics(process_id, json_data, progress_callback,
+                                             force_render=payload.get('force_render', False),
+                                             scene_callback=scene_callback)
+
+    if payload.get('save_history'):
+        db.save_comics_history(
+            user_id=job['user_id'],
+            process_id=process_id,
+            novel_text=artifact_store.get(process_id, 'novel') or '',
+            llm_result=json_data,
+            comic_results=comic_results,
+            title=payload.get('title', ''),
+            description=payload.get('description', '')
+        )
+
+    return {
+        "process_id": process_id,
+        "total_scenes": len(comic_results)
+    }
+
+
+def on_job_progress(job, step, total):
+    """任务进度推送到对应的生成会话"""
+    payload = job['payload']
+    if payload.get('session'):
+        emit_session_event(payload['process_id'], 'full_process_progress', {
+            'process_id': payload['process_id'],
+            'job_id': job['id'],
+            'step': step,
+            'total': total,
+            'message': f'正在生成第 {step}/{total} 张图片...'
+        })
+
+
+def on_job_finished(job):
+    """任务结束后更新生成会话并通知客户端"""
+    if not job:
+        return
+    payload = job['payload']
+    if not payload.get('session'):
+        return
+    process_id = payload['process_id']
+
+    if job['status'] != 'done':
+        generation_sessions.update(process_id, stage=STAGE_FAILED, error=job['error'])
+        emit_session_event(process_id, 'full_process_error', {
+            'process_id': process_id,
+            'job_id': job['id'],
+            'error': f"生成失败: {job['error']}"
+        })
+        return
+
+    generation_sessions.update(process_id, stage=STAGE_COMICS_GENERATED)
+
+    # 精简格式下不再发送客户端已有的 llm_result，连环画结果按 fields 过滤
+    complete = load_complete_payload(job['id'], process_id, payload.get('protocol') or {},
+                                     message="完整流程处理完成")
+    if complete is None:
+        emit_session_event(process_id, 'full_process_error', {
+            'process_id': process_id,
+            'job_id': job['id'],
+            'error': '找不到连环画生成结果'
+        })
+        return
+    emit_session_event(process_id, 'full_process_complete', complete)
+
+
+# 后台任务工作线程池（在 initialize_backend 中启动）
+job_pool = JobWorkerPool(
+    db,
+    handlers={
+        'full_process': run_full_process_job,
+        'generate_comics': run_generate_comics_job
+    },
+    on_finished=on_job_finished,
+    on_progress=on_job_progress
+)
 
 
 def initialize_backend():
     """初始化后端服务"""
-    global processing_rules
-
     # 获取role.docx路径
     def get_role_docx_path():
         possible_paths = [
@@ -983,14 +1587,22 @@ def initialize_backend():
                 return path
         return None
 
-    role_docx_path = get_role_docx_path()
-    if not role_docx_path:
-        raise Exception("无法找到role.docx文件")
+    # 未通过 ROLE_DOCX_PATH 指定时，按工作目录查找 role.docx 作为默认规则
+    if not os.environ.get('ROLE_DOCX_PATH'):
+        role_docx_path = get_role_docx_path()
+        if not role_docx_path:
+            raise Exception("无法找到role.docx文件")
+        rules_registry.register(DEFAULT_RULE_SET, role_docx_path)
 
-    # 读取处理规则
-    processing_rules = read_role_docx(role_docx_path)
-    if not processing_rules:
+    # 预先加载所有规则集（之后规则文件修改时自动重新加载，无需重启服务）
+    if not rules_registry.get():
         raise Exception("无法读取处理规则")
+    print(f"可用的规则集: {', '.join(rules_registry.names())}")
+
+    # 启动后台任务工作线程（会恢复上次未完成的任务）
+    # 调试模式下重载器的监控进程不对外服务，只在实际服务进程中启动
+    if not DEBUG_MODE or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_pool.start()
 
     print("后端服务初始化完成")
 
@@ -1008,6 +1620,10 @@ if __name__ == '__main__':
     print("  GET  /api/history - 获取历史记录")
     print("  POST /api/process-novel - 处理小说文本")
     print("  POST /api/generate-comics - 生成连环画")
-    print("  POST /api/full-process - 完整流程处理")
+    print("  POST /api/full-process - 完整流程处理（返回任务ID）")
+    print("  GET  /api/jobs/<job_id> - 查询任务状态")
+    print("  GET  /api/rules - 可用的处理规则集")
+    print("  GET  /api/metrics - Prometheus格式的指标")
+    print("  GET  /api/metrics/<process_id> - 单次处理的阶段耗时")
 
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
\ No newline at end of file
+    socketio.run(app, host='0.0.0.0', port=5000, debug=DEBUG_MODE, allow_unsafe_werkzeug=True)
\ No newline at end of file
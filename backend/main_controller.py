@@ -10,17 +10,21 @@ sys.path.append('./python_aigc')
 try:
     from python_LLM.doubao_1_5 import (
         process_novel_text,
+        process_novel_text_streaming,
         save_to_json,
         load_json_file,
-        read_role_docx,
         get_novel_input,
         export_json_for_aigc
     )
     from python_aigc.seedream import (
+        PIPELINED_GENERATION,
+        PipelinedComicRenderer,
         process_llm_json_and_generate_comics,
         generate_comics_from_json_file,
         save_comic_results
     )
+    from batch_runner import BatchRunner
+    from rules_registry import DEFAULT_RULE_SET, get_rules_registry
 except ImportError as e:
     print(f"导入模块失败: {e}")
     print("请确保目录结构正确：")
@@ -61,7 +65,7 @@ def get_role_docx_path():
         return None
 
 
-def process_novel_to_comics(novel_text, processing_rules, output_filename=None):
+def process_novel_to_comics(novel_text, processing_rules, output_filename=None, pipelined=None, output_dir=None):
     """
     完整流程：从小说文本处理到生成连环画
 
@@ -69,14 +73,29 @@ def process_novel_to_comics(novel_text, processing_rules, output_filename=None):
         novel_text: 小说文本
         processing_rules: 处理规则
         output_filename: 输出文件名（可选）
+        pipelined: 是否使用流水线模式（LLM流式输出分镜的同时生成图片），
+                   默认由环境变量 PIPELINED_GENERATION 决定
+        output_dir: 结果文件的保存目录（可选，默认当前目录）
     """
+    if pipelined is None:
+        pipelined = PIPELINED_GENERATION
+
     print("=== 开始处理小说文本 ===")
 
     # 第一步：使用LLM处理小说文本
-    llm_result = process_novel_text(novel_text, processing_rules)
+    # 流水线模式下场景一到达就开始生成图片，总耗时接近 max(LLM, 图片生成)
+    renderer = None
+    if pipelined:
+        print("使用流水线模式：分镜到达后立即开始生成图片")
+        renderer = PipelinedComicRenderer()
+        llm_result = process_novel_text_streaming(novel_text, processing_rules, event_callback=renderer.on_event)
+    else:
+        llm_result = process_novel_text(novel_text, processing_rules)
 
-    if not llm_result:
+    if not isinstance(llm_result, dict):
         print("LLM处理失败")
+        if renderer:
+            renderer.cancel()
         return None
 
     print("LLM处理完成")
@@ -84,13 +103,16 @@ def process_novel_to_comics(novel_text, processing_rules, output_filename=None):
     # 保存LLM结果
     llm_output_file = None
     if output_filename:
-        llm_output_file = f"llm_{output_filename}.json"
+        llm_output_file = os.path.join(output_dir or '', f"llm_{output_filename}.json")
         save_to_json(llm_result, llm_output_file)
         print(f"LLM结果已保存到: {llm_output_file}")
 
-    # 第二步：使用AIGC生成连环画
+    # 第二步：使用AIGC生成连环画（流水线模式下等待已开始的生成完成）
     print("=== 开始生成连环画 ===")
-    comic_results = process_llm_json_and_generate_comics(llm_result)
+    if renderer:
+        comic_results = renderer.finish(llm_result)
+    else:
+        comic_results = process_llm_json_and_generate_comics(llm_result)
 
     if not comic_results:
         print("连环画生成失败")
@@ -101,7 +123,7 @@ def process_novel_to_comics(novel_text, processing_rules, output_filename=None):
     # 保存连环画结果
     comic_output_file = None
     if output_filename:
-        comic_output_file = f"comic_{output_filename}.json"
+        comic_output_file = os.path.join(output_dir or '', f"comic_{output_filename}.json")
         save_comic_results(comic_results, llm_result, comic_output_file)
     else:
         comic_output_file = save_comic_results(comic_results, llm_result)
@@ -114,32 +136,26 @@ def process_novel_to_comics(novel_text, processing_rules, output_filename=None):
     }
 
 
-def batch_process_novels_to_comics(input_folder, output_folder, processing_rules):
+def batch_process_novels_to_comics(input_folder, output_folder, processing_rules, max_workers=None):
     """
     批量处理小说文件并生成连环画
-    """
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
 
-    for filename in os.listdir(input_folder):
-        if filename.endswith('.txt'):
-            input_path = os.path.join(input_folder, filename)
-            base_name = os.path.splitext(filename)[0]
-
-            try:
-                with open(input_path, 'r', encoding='utf-8') as f:
-                    novel_text = f.read()
-
-                print(f"正在处理: {filename}")
-                result = process_novel_to_comics(novel_text, processing_rules, base_name)
+    并行处理，LLM和连环画结果都保存到输出目录；已成功的文件在重新运行时跳过，
+    结束后在输出目录生成汇总报告（见 batch_runner.BatchRunner）
+    """
+    def process_file(input_path, base_name):
+        with open(input_path, 'r', encoding='utf-8') as f:
+            novel_text = f.read()
 
-                if result:
-                    print(f"处理完成: {filename}")
-                else:
-                    print(f"处理失败: {filename}")
+        result = process_novel_to_comics(novel_text, processing_rules, base_name, output_dir=output_folder)
+        if not result:
+            return None
+        outputs = [result['llm_output_file'], result['comic_output_file']]
+        if not all(outputs):
+            raise Exception("保存结果文件失败")
+        return outputs
 
-            except Exception as e:
-                print(f"处理文件 {filename} 时出错: {e}")
+    return BatchRunner(input_folder, output_folder, process_file, max_workers=max_workers).run()
 
 
 def main():
@@ -152,8 +168,10 @@ def main():
         print("无法找到role.docx文件，程序退出")
         return
 
-    # 读取处理规则
-    processing_rules = read_role_docx(role_docx_path)
+    # 读取处理规则（规则文件修改后自动重新加载，无需重启程序）
+    rules_registry = get_rules_registry()
+    rules_registry.register(DEFAULT_RULE_SET, role_docx_path)
+    processing_rules = rules_registry.get()
 
     if not processing_rules:
         print("无法读取处理规则，请确保role.docx文件格式正确")
@@ -170,6 +188,7 @@ def main():
         print("5. 退出")
 
         choice = input("请输入选择 (1/2/3/4/5): ").strip()
+        processing_rules = rules_registry.get() or processing_rules
 
         if choice == '1':
             # 交互式处理
@@ -0,0 +1,229 @@
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# 保留最近多少个 process_id 的阶段耗时明细
+METRICS_MAX_PROCESSES = int(os.environ.get("METRICS_MAX_PROCESSES", "500"))
+# 单个 process_id 最多记录的阶段数（图片场景较多时避免无限增长）
+METRICS_MAX_SPANS = int(os.environ.get("METRICS_MAX_SPANS", "500"))
+
+# 耗时直方图的分桶上界（秒），覆盖从本地I/O到长文本LLM调用的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(label_key, extra=None):
+    items = list(label_key) + list(extra or [])
+    if not items:
+        return ''
+    escaped = []
+    for key, value in items:
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    """累积分桶的直方图（Prometheus 语义）"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """
+    进程内的指标注册表（线程安全）
+
+    - 计数器: inc(name, amount, **labels)
+    - 直方图: observe(name, value, **labels)
+    - 按 process_id 记录的阶段耗时明细: record_span / get_process_spans
+
+    参数:
+        max_processes: 保留阶段明细的 process_id 数量上限，超出时淘汰最早的
+        max_spans: 单个 process_id 保留的阶段数上限
+    """
+
+    def __init__(self, max_processes=METRICS_MAX_PROCESSES, max_spans=METRICS_MAX_SPANS):
+        self.max_processes = max_processes
+        self.max_spans = max_spans
+        self._lock = threading.Lock()
+        self._counters = {}    # 名称 -> {标签: 值}
+        self._histograms = {}  # 名称 -> {标签: Histogram}
+        self._help = {}
+        self._processes = OrderedDict()  # process_id -> 阶段列表
+
+    def describe(self, name, help_text):
+        """设置指标的说明文字（输出到 # HELP 行）"""
+        self._help[name] = help_text
+
+    def inc(self, name, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def record_span(self, process_id, stage, started_at, seconds, error=None, detail=None, **labels):
+        """记录某个 process_id 的一个阶段，detail 只写入明细（如场景序号），不作为直方图标签"""
+        span = {'stage': stage, 'started_at': started_at, 'seconds': round(seconds, 6)}
+        if labels:
+            span['labels'] = {key: str(value) for key, value in labels.items()}
+        if detail:
+            span['detail'] = detail
+        if error:
+            span['error'] = error
+        with self._lock:
+            spans = self._processes.get(process_id)
+            if spans is None:
+                spans = self._processes[process_id] = []
+                while len(self._processes) > self.max_processes:
+                    self._processes.popitem(last=False)
+            if len(spans) < self.max_spans:
+                spans.append(span)
+
+    def get_process_spans(self, process_id):
+        """返回某个 process_id 的阶段明细和按阶段汇总的耗时，没有记录时返回None"""
+        with self._lock:
+            spans = list(self._processes.get(process_id) or [])
+        if not spans:
+            return None
+
+        summary = {}
+        for span in spans:
+            stage = summary.setdefault(span['stage'], {'count': 0, 'seconds': 0.0, 'max': 0.0})
+            stage['count'] += 1
+            stage['seconds'] = round(stage['seconds'] + span['seconds'], 6)
+            stage['max'] = max(stage['max'], span['seconds'])
+        return {'process_id': process_id, 'stages': summary, 'spans': spans}
+
+    def render_prometheus(self):
+        """以 Prometheus 文本格式输出所有计数器和直方图"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+
+            for name in sorted(self._histograms):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        labels = _format_labels(key, [('le', _format_value(bound))])
+                        lines.append(f"{name}_bucket{labels} {count}")
+                    labels = _format_labels(key, [('le', '+Inf')])
+                    lines.append(f"{name}_bucket{labels} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(histogram.total)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+_registry = MetricsRegistry()
+_registry.describe('stage_duration_seconds', '各处理阶段耗时（LLM调用、JSON解析、图片生成、文件保存、数据库写入）')
+_registry.describe('stage_errors_total', '各处理阶段抛出异常的次数')
+_registry.describe('llm_first_token_seconds', 'LLM流式输出的首个分块到达耗时')
+_registry.describe('ark_requests_total', 'Ark接口请求次数（含重试）')
+_registry.describe('ark_retries_total', 'Ark接口重试次数')
+_registry.describe('ark_errors_total', 'Ark接口错误次数')
+_registry.describe('llm_json_total', 'LLM输出的JSON处理结果（valid/repaired/fixup/failed）')
+_registry.describe('cache_requests_total', '缓存查询次数（按命中/未命中）')
+_registry.describe('prompt_cache_requests_total', '系统提示词前缀缓存的使用情况（hit/miss/refresh/expired/error/bypass）')
+_registry.describe('llm_tokens_total', 'LLM消耗的token数（prompt_cached 为命中前缀缓存的输入token）')
+_registry.describe('generation_sessions_total', '创建的生成会话数')
+_registry.describe('generation_session_resumes_total', '生成会话的恢复次数（replay 补发事件/snapshot 按持久化状态重建/duplicate 重复提交时复用）')
+_registry.describe('http_requests_total', 'HTTP接口请求次数')
+_registry.describe('http_request_duration_seconds', 'HTTP接口处理耗时')
+
+
+def get_registry():
+    """获取进程内共享的指标注册表"""
+    return _registry
+
+
+def inc(name, amount=1, **labels):
+    _registry.inc(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    _registry.observe(name, value, **labels)
+
+
+# 当前处理流程的 process_id，阶段耗时按它归类（由接口和任务线程设置，线程池通过 copy_context 继承）
+_current_process = contextvars.ContextVar('metrics_process_id', default=None)
+
+
+def set_current_process(process_id):
+    """设置当前上下文中正在处理的 process_id"""
+    _current_process.set(process_id)
+
+
+def current_process_id():
+    return _current_process.get()
+
+
+@contextmanager
+def span(stage, process_id=None, detail=None, **labels):
+    """
+    记录一个处理阶段的耗时
+
+    耗时写入 stage_duration_seconds 直方图（按阶段名和标签），
+    并在当前 process_id 下记录一条明细；阶段内抛出异常时同时计入 stage_errors_total。
+    标签应取值有限（如模式、接口名），场景序号等逐条不同的信息放在 detail 中。
+
+    用法:
+        with metrics.span('image_render', detail={'scene_index': 3}):
+            ...
+    """
+    process_id = process_id if process_id is not None else current_process_id()
+    started_at = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _registry.observe('stage_duration_seconds', seconds, stage=stage, **labels)
+        if error:
+            _registry.inc('stage_errors_total', stage=stage, error=error)
+        if process_id:
+            _registry.record_span(process_id, stage, started_at, seconds, error=error, detail=detail, **labels)
@@ -0,0 +1,202 @@
+import re
+
+
+# 章节标题，例如“第十二章”“第3回”“Chapter 5”
+CHAPTER_PATTERN = re.compile(r'^\s*(第[0-9零一二三四五六七八九十百千万两]+[章回节卷部集]|chapter\s+\d+)', re.IGNORECASE)
+# 句子结尾：结束标点（连同紧随其后的引号）
+SENTENCE_END_PATTERN = re.compile(r'[。！？!?…]+[”」』"]?')
+CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+CONSISTENCY_FIELDS = ("character_consistency", "environment_consistency")
+# 按场景序号一一对应的列表字段，合并时必须同步追加或跳过
+SCENE_LIST_FIELDS = ("scenes_detail", "scenes", "dialogue")
+
+
+def estimate_tokens(text):
+    """
+    粗略估算文本的token数
+
+    中文字符按每字1个token计算，其他字符按每4个字符1个token计算，
+    对中文小说偏保守，保证分块不会超出上下文窗口。
+    """
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def split_sentences(paragraph):
+    """
+    按句子结尾切分段落
+
+    只在句子结尾之后断开，各句拼接起来就是原文（引号等字符不会丢失）；
+    末尾没有结束标点的部分单独成句。
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(paragraph):
+        sentences.append(paragraph[start:match.end()])
+        start = match.end()
+    if start < len(paragraph):
+        sentences.append(paragraph[start:])
+    return sentences
+
+
+def _split_long_paragraph(paragraph, max_tokens):
+    """把超出预算的段落按句子切分，单个句子仍然超长时按字符硬切"""
+    sentences = split_sentences(paragraph)
+    pieces = []
+    for sentence in sentences:
+        if estimate_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        for start in range(0, len(sentence), max_tokens):
+            pieces.append(sentence[start:start + max_tokens])
+    return pieces
+
+
+def split_novel_text(novel_text, max_tokens):
+    """
+    按章节和段落边界把小说切分为不超过token预算的文本块
+
+    优先在章节开头断开（当前块已超过预算一半时遇到新章节就另起一块），
+    其次在段落之间断开；超长段落再按句子切分。
+
+    参数:
+        novel_text: 小说文本
+        max_tokens: 每块的token预算
+
+    返回:
+        按原文顺序排列的文本块列表
+    """
+    if estimate_tokens(novel_text) <= max_tokens:
+        return [novel_text]
+
+    # (文本, 与前一单元之间的分隔符)：同一段落切出的句子之间不加换行
+    units = []
+    for paragraph in novel_text.split('\n'):
+        if not paragraph.strip():
+            continue
+        if estimate_tokens(paragraph) > max_tokens:
+            pieces = _split_long_paragraph(paragraph, max_tokens)
+            units.append((pieces[0], '\n'))
+            units.extend((piece, '') for piece in pieces[1:])
+        else:
+            units.append((paragraph, '\n'))
+
+    chunks = []
+    current = ''
+    current_tokens = 0
+    for unit, separator in units:
+        unit_tokens = estimate_tokens(unit) + len(separator)
+        starts_chapter = bool(CHAPTER_PATTERN.match(unit))
+        if current and (current_tokens + unit_tokens > max_tokens or
+                        (starts_chapter and current_tokens >= max_tokens // 2)):
+            chunks.append(current)
+            current = ''
+            current_tokens = 0
+        current += (separator if current else '') + unit
+        current_tokens += unit_tokens
+
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _merge_description(old, new):
+    """
+    合并同一角色/环境在不同分块中的描述
+
+    文字描述互不包含时用“；”拼接（后面的块可能补充了新的外貌、服装等细节），
+    一方包含另一方时保留较完整的一个；对象按字段递归合并；其他类型保留先出现的值。
+    """
+    if not old:
+        return new
+    if not new or new == old:
+        return old
+    if isinstance(old, str) and isinstance(new, str):
+        old_key, new_key = _normalize_scene(old), _normalize_scene(new)
+        if new_key in old_key:
+            return old
+        if old_key in new_key:
+            return new
+        return f"{old}；{new}"
+    if isinstance(old, dict) and isinstance(new, dict):
+        merged = dict(old)
+        for key, value in new.items():
+            merged[key] = _merge_description(merged.get(key), value)
+        return merged
+    return old
+
+
+def _normalize_scene(scene):
+    if isinstance(scene, str):
+        return re.sub(r'\s+', '', scene)
+    return repr(scene)
+
+
+class StoryboardMerger:
+    """
+    按分块顺序合并多个分镜结果（map-reduce 中的 reduce 步骤）
+
+    - scenes_detail 按分块顺序拼接；分块之间没有重叠，只有块边界处可能重复，因此只在
+      下一块的第一个场景与已合并的最后一个场景内容相同时跳过它（正文中合理重复出现的场景保留）；
+      scenes、dialogue 与之按序号对应，同步追加和跳过（某块缺少该字段时以空字符串占位），
+      保证对白仍对应原来的场景
+    - character_consistency / environment_consistency 按名称合并为统一的设定，
+      同名条目在各块中的不同描述合并在一起（见 _merge_description）
+    - 其他顶层字段保留最先出现的值
+    """
+
+    def __init__(self):
+        self.result = {
+            "character_consistency": {},
+            "environment_consistency": {},
+            "scenes_detail": []
+        }
+        self._last_scene_key = None
+
+    def add(self, storyboard):
+        """
+        合并下一个分块的分镜结果
+
+        返回:
+            本次新加入的场景列表（已去掉块边界处的重复场景）
+        """
+        added = []
+        if not isinstance(storyboard, dict):
+            return added
+
+        for field in CONSISTENCY_FIELDS:
+            merged = self.result[field]
+            value = storyboard.get(field) or {}
+            if not isinstance(value, dict):
+                continue
+            for name, desc in value.items():
+                name = str(name).strip()
+                if name:
+                    merged[name] = _merge_description(merged.get(name), desc)
+
+        scenes = storyboard.get("scenes_detail") or storyboard.get("scenes") or []
+        for i, scene in enumerate(scenes):
+            key = _normalize_scene(scene)
+            if not key or (i == 0 and key == self._last_scene_key):
+                # 空场景和块边界处的重复场景在所有对应的列表中一起跳过
+                continue
+            self._last_scene_key = key
+            self.result["scenes_detail"].append(scene)
+            for field in SCENE_LIST_FIELDS[1:]:
+                values = storyboard.get(field)
+                if isinstance(values, list) and values:
+                    # 之前的块没有该字段时，为已合并的场景补齐占位
+                    merged = self.result.setdefault(field, [""] * (len(self.result["scenes_detail"]) - 1))
+                    merged.append(values[i] if i < len(values) else "")
+                elif field in self.result:
+                    self.result[field].append("")
+            added.append(scene)
+
+        for key, value in storyboard.items():
+            if key not in self.result and key not in SCENE_LIST_FIELDS:
+                self.result[key] = value
+
+        return added
@@ -0,0 +1,237 @@
+import hashlib
+import os
+import threading
+import time
+
+from volcenginesdkarkruntime._exceptions import ArkAPIStatusError
+
+import metrics
+from ark_client import call_with_retry, get_ark_client
+
+
+# 是否使用 Ark 上下文缓存（common_prefix 模式）缓存固定的系统提示词
+PROMPT_CACHE_ENABLED = os.environ.get("PROMPT_CACHE_ENABLED", "1") == "1"
+# 上下文缓存的有效期（秒），到期前 PROMPT_CACHE_REFRESH_MARGIN 秒开始重新创建
+PROMPT_CACHE_TTL = int(os.environ.get("PROMPT_CACHE_TTL", "3600"))
+PROMPT_CACHE_REFRESH_MARGIN = float(os.environ.get("PROMPT_CACHE_REFRESH_MARGIN", "120"))
+# 创建失败（例如模型不支持上下文缓存）后，多久内直接使用普通请求（秒）
+PROMPT_CACHE_RETRY_AFTER = float(os.environ.get("PROMPT_CACHE_RETRY_AFTER", "300"))
+# 系统提示词短于此长度（字符）时不值得缓存
+PROMPT_CACHE_MIN_CHARS = int(os.environ.get("PROMPT_CACHE_MIN_CHARS", "512"))
+
+# 使用上下文请求时，404 表示上下文已失效（过期或被服务端清理）；
+# 400 只有错误码表明上下文不存在或已过期时才算失效，参数错误、内容审核等其他 400 错误原样抛出
+CONTEXT_GONE_ERROR_CODES = ('ContextNotFound', 'ContextExpired')
+
+
+def is_context_gone(error):
+    """上下文请求的错误是否表示上下文已失效（可以丢弃上下文改用普通请求）"""
+    if error.status_code == 404:
+        return True
+    if error.status_code != 400:
+        return False
+    code = error.code
+    if code is None and isinstance(error.body, dict) and isinstance(error.body.get('error'), dict):
+        code = error.body['error'].get('code')
+    return any(part in str(code or '') for part in CONTEXT_GONE_ERROR_CODES)
+
+
+class _PrefixContext:
+    def __init__(self, context_id, expires_at):
+        self.context_id = context_id
+        self.expires_at = expires_at
+
+
+class PromptPrefixCache:
+    """
+    系统提示词前缀缓存
+
+    相同模型和系统提示词只在服务端创建一次上下文（common_prefix 模式），之后的请求只发送用户消息，
+    服务端复用已缓存的前缀，省去重复的预填充（首字延迟更低，缓存部分的输入token按更低价格计费）。
+
+    - 上下文在到期前自动重新创建，刷新期间其他请求继续使用旧的上下文
+    - 同一前缀同时只有一个线程在创建，其余请求不会重复创建
+    - 创建失败时在 retry_after 秒内直接使用普通请求
+
+    参数:
+        ttl: 上下文有效期（秒）
+        refresh_margin: 到期前多少秒开始重新创建
+        retry_after: 创建失败后多久再尝试（秒）
+        min_chars: 系统提示词的最短长度，更短的提示词不缓存
+        enabled: 是否启用
+    """
+
+    def __init__(self, ttl=PROMPT_CACHE_TTL, refresh_margin=PROMPT_CACHE_REFRESH_MARGIN,
+                 retry_after=PROMPT_CACHE_RETRY_AFTER, min_chars=PROMPT_CACHE_MIN_CHARS,
+                 enabled=PROMPT_CACHE_ENABLED):
+        self.ttl = ttl
+        self.refresh_margin = min(refresh_margin, ttl / 2)
+        self.retry_after = retry_after
+        self.min_chars = min_chars
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._contexts = {}      # (模型, 提示词摘要) -> _PrefixContext
+        self._failed_until = {}  # (模型, 提示词摘要) -> 下次允许创建的时间
+        self._creating = {}      # (模型, 提示词摘要) -> 创建锁
+
+    @staticmethod
+    def _key(model, system_prompt):
+        return model, hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+
+    def get_context_id(self, model, system_prompt, limiter=None):
+        """
+        获取缓存了系统提示词的上下文ID，必要时创建或刷新
+
+        返回:
+            上下文ID，未启用、提示词太短或创建失败时返回None（调用方改用普通请求）
+        """
+        if not self.enabled or len(system_prompt) < self.min_chars:
+            return None
+
+        key = self._key(model, system_prompt)
+        now = time.monotonic()
+        with self._lock:
+            context = self._contexts.get(key)
+            if context is not None and now < context.expires_at - self.refresh_margin:
+                metrics.inc('prompt_cache_requests_total', result='hit')
+                return context.context_id
+            if self._failed_until.get(key, 0) > now:
+                metrics.inc('prompt_cache_requests_total', result='bypass')
+                return None
+            create_lock = self._creating.setdefault(key, threading.Lock())
+
+        if context is not None and now < context.expires_at:
+            # 即将到期：由一个线程刷新，其他线程继续使用旧的上下文
+            if not create_lock.acquire(blocking=False):
+                metrics.inc('prompt_cache_requests_total', result='hit')
+                return context.context_id
+        else:
+            create_lock.acquire()
+
+        try:
+            with self._lock:
+                latest = self._contexts.get(key)
+                if latest is not None and latest is not context and time.monotonic() < latest.expires_at - self.refresh_margin:
+                    # 等待期间已由其他线程创建好
+                    metrics.inc('prompt_cache_requests_total', result='hit')
+                    return latest.context_id
+
+            try:
+                context_id, ttl = self._create(model, system_prompt, limiter)
+            except Exception as e:
+                print(f"创建提示词前缀缓存失败，{self.retry_after:.0f} 秒内改用普通请求: {e}")
+                metrics.inc('prompt_cache_requests_total', result='error')
+                with self._lock:
+                    self._failed_until[key] = time.monotonic() + self.retry_after
+                    self._contexts.pop(key, None)
+                return None
+
+            with self._lock:
+                self._contexts[key] = _PrefixContext(context_id, time.monotonic() + ttl)
+                self._failed_until.pop(key, None)
+            metrics.inc('prompt_cache_requests_total', result='refresh' if context is not None else 'miss')
+            return context_id
+        finally:
+            create_lock.release()
+
+    def _create(self, model, system_prompt, limiter):
+        with metrics.span('prompt_cache_create'):
+            response = call_with_retry(lambda: get_ark_client().context.create(
+                model=model,
+                mode="common_prefix",
+                messages=[{"role": "system", "content": system_prompt}],
+                ttl=self.ttl,
+            ), description="创建提示词前缀缓存", limiter=limiter)
+        record_usage(getattr(response, 'usage', None), kind='context_create')
+        ttl = getattr(response, 'ttl', None) or self.ttl
+        print(f"已创建提示词前缀缓存: {response.id}（有效期 {ttl} 秒）")
+        return response.id, ttl
+
+    def invalidate(self, model, system_prompt):
+        """丢弃某个提示词的上下文（例如服务端已清理），下次请求时重新创建"""
+        with self._lock:
+            self._contexts.pop(self._key(model, system_prompt), None)
+
+    def clear(self):
+        with self._lock:
+            self._contexts.clear()
+            self._failed_until.clear()
+
+
+def _usage_field(usage, name):
+    # SDK 未能解析成对象时 usage 可能是字典
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
+
+
+def record_usage(usage, kind='chat'):
+    """按缓存命中/未命中记录输入token数和输出token数"""
+    if usage is None:
+        return
+    prompt_tokens = _usage_field(usage, 'prompt_tokens') or 0
+    details = _usage_field(usage, 'prompt_tokens_details')
+    cached_tokens = (_usage_field(details, 'cached_tokens') if details else None) or 0
+    completion_tokens = _usage_field(usage, 'completion_tokens') or 0
+    if cached_tokens:
+        metrics.inc('llm_tokens_total', cached_tokens, kind=kind, type='prompt_cached')
+    if prompt_tokens > cached_tokens:
+        metrics.inc('llm_tokens_total', prompt_tokens - cached_tokens, kind=kind, type='prompt')
+    if completion_tokens:
+        metrics.inc('llm_tokens_total', completion_tokens, kind=kind, type='completion')
+
+
+def chat_completion(model, system_prompt, user_content, description="LLM请求", limiter=None, **kwargs):
+    """
+    发送"系统提示词 + 用户消息"的对话请求，系统提示词通过前缀缓存复用
+
+    有可用的上下文时只发送用户消息；上下文失效时丢弃并退回普通请求（下次请求重新创建）。
+    其余参数（如 stream、stream_options）原样传给SDK，返回值与 chat.completions.create 相同。
+    非流式请求会记录token用量，流式请求由调用方从最后一个分块的 usage 记录。
+    """
+    cache = get_prompt_cache()
+    context_id = cache.get_context_id(model, system_prompt, limiter=limiter)
+    if context_id:
+        try:
+            result = call_with_retry(lambda: get_ark_client().context.completions.create(
+                context_id=context_id,
+                model=model,
+                messages=[{"role": "user", "content": user_content}],
+                **kwargs,
+            ), description=description, limiter=limiter)
+        except ArkAPIStatusError as e:
+            if not is_context_gone(e):
+                raise
+            print(f"提示词前缀缓存已失效，改用普通请求: {e}")
+            metrics.inc('prompt_cache_requests_total', result='expired')
+            cache.invalidate(model, system_prompt)
+        else:
+            if not kwargs.get('stream'):
+                record_usage(getattr(result, 'usage', None))
+            return result
+
+    result = call_with_retry(lambda: get_ark_client().chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content},
+        ],
+        **kwargs,
+    ), description=description, limiter=limiter)
+    if not kwargs.get('stream'):
+        record_usage(getattr(result, 'usage', None))
+    return result
+
+
+_prompt_cache = None
+_prompt_cache_lock = threading.Lock()
+
+
+def get_prompt_cache():
+    """获取进程内共享的提示词前缀缓存（懒加载）"""
+    global _prompt_cache
+    if _prompt_cache is None:
+        with _prompt_cache_lock:
+            if _prompt_cache is None:
+                _prompt_cache = PromptPrefixCache()
+    return _prompt_cache
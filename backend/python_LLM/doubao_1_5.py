@@ -2,19 +2,34 @@ import os
 import json
 import sys
 from datetime import datetime
-from volcenginesdkarkruntime import Ark
-from docx import Document
 import re
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 # 添加父目录到路径，以便导入其他模块
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# 初始化Ark客户端
-client = Ark(
-    base_url="https://ark.cn-beijing.volces.com/api/v3",
-    api_key=os.environ.get("ARK_API_KEY"),
-)
+import metrics
+from ark_client import call_with_retry, get_ark_client
+from prompt_cache import chat_completion, record_usage
+from llm_cache import get_llm_cache
+from rate_limiter import get_limiter
+from json_stream import StoryboardStreamParser, replay_storyboard_events
+from llm_json import LLMJSONError, load_storyboard, validate_storyboard
+from novel_chunker import CONSISTENCY_FIELDS, StoryboardMerger, estimate_tokens, split_novel_text
+from batch_runner import BatchRunner
+from rules_registry import RuleSet, build_system_prompt, get_rules_registry, read_rules_file
 
+# 分镜生成使用的模型
+LLM_MODEL = "doubao-1-5-pro-32k-250115"
+
+# 长文本分块配置：每块输入的token预算（需为系统提示词和输出留出上下文空间）和并行处理的块数
+LLM_CHUNK_TOKENS = int(os.environ.get("LLM_CHUNK_TOKENS", "8000"))
+LLM_CHUNK_WORKERS = int(os.environ.get("LLM_CHUNK_WORKERS", "4"))
+
+# 本地修复失败时是否请求模型修正JSON格式（只发送有问题的输出，不重新发送规则和小说原文）
+LLM_JSON_FIXUP = os.environ.get("LLM_JSON_FIXUP", "1") == "1"
 
 def read_sample_novel():
     """从example.txt文件读取示例小说"""
@@ -50,90 +65,308 @@ def get_sample_novel():
 
 
 def read_role_docx(file_path):
-    """读取role.docx文件内容"""
-    try:
-        doc = Document(file_path)
-        full_text = []
-        for paragraph in doc.paragraphs:
-            full_text.append(paragraph.text)
-        return '\n'.join(full_text)
-    except Exception as e:
-        print(f"读取role.docx文件时出错: {e}")
-        return None
+    """读取role.docx文件内容（服务中请使用 rules_registry 获取已缓存的规则集）"""
+    return read_rules_file(file_path)
 
 
-def process_novel_text(novel_text, processing_rules):
-    """处理小说文本"""
+def resolve_rules(processing_rules):
+    """
+    处理规则可以是 RuleSet（使用加载时构建好的系统提示词）或规则文本
+
+    返回:
+        (规则文本, 系统提示词)
+    """
+    if isinstance(processing_rules, RuleSet):
+        return processing_rules.text, processing_rules.system_prompt
+    return processing_rules, build_system_prompt(processing_rules)
 
-    # 构建系统提示词，包含处理规则
-    system_prompt = f"""
-{processing_rules}
-请确保返回的内容是有效的JSON格式，不要添加任何额外的解释或说明。"""
+
+def process_novel_text(novel_text, processing_rules, use_cache=True):
+    """
+    处理小说文本
+
+    参数:
+        novel_text: 小说文本
+        processing_rules: 处理规则（RuleSet 或规则文本）
+        use_cache: 是否使用LLM结果缓存（相同模型、规则和文本直接返回缓存结果）
+
+    超出 LLM_CHUNK_TOKENS 的长文本会自动分块并行处理后合并（见 process_novel_text_chunked）
+
+    返回:
+        校验通过的分镜字典（格式有误时会先修复，见 finalize_storyboard），失败时返回None
+    """
+    if estimate_tokens(novel_text) > LLM_CHUNK_TOKENS:
+        return process_novel_text_chunked(novel_text, processing_rules, use_cache=use_cache)
+
+    rules_text, system_prompt = resolve_rules(processing_rules)
+    cache = get_llm_cache()
+    cache_key = cache.make_key(LLM_MODEL, rules_text, novel_text)
+    if use_cache:
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            print("命中LLM结果缓存")
+            return cached_result
 
     try:
-        completion = client.chat.completions.create(
-            model="doubao-1-5-pro-32k-250115",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": novel_text},
-            ],
-        )
+        # 使用共享的Ark客户端，限流和服务端错误时自动退避重试
+        with metrics.span('llm_call', mode='sync'):
+            # 系统提示词（处理规则）通过前缀缓存复用，只发送小说文本
+            completion = chat_completion(LLM_MODEL, system_prompt, novel_text,
+                                         description="LLM请求", limiter=get_limiter('doubao'))
         result = completion.choices[0].message.content
 
-        # 尝试解析JSON，确保格式正确
-        try:
-            parsed_result = json.loads(result)
-            return parsed_result  # 返回解析后的字典对象
-        except json.JSONDecodeError:
-            # 如果返回的不是有效JSON，尝试修复或返回错误
-            print("API返回的内容不是有效的JSON格式")
-            return result
+        # 解析并校验JSON，格式有问题时先在本地修复
+        parsed_result = finalize_storyboard(result)
+        if parsed_result is None:
+            return None
+        cache.set(cache_key, LLM_MODEL, parsed_result)
+        return parsed_result  # 返回解析后的字典对象
     except Exception as e:
         print(f"API调用出错: {e}")
         return None
 
 
-def process_novel_text_streaming(novel_text, processing_rules):
-    """流式处理小说文本"""
+def request_json_fixup(raw_text, error):
+    """
+    请求模型只修正JSON格式
+
+    只发送有问题的输出和错误原因，不重新发送处理规则和小说原文，
+    输入远小于完整的分镜请求。
 
-    system_prompt = f"""
-{processing_rules}
-请确保返回的内容是有效的JSON格式，不要添加任何额外的解释或说明。"""
+    返回:
+        模型返回的文本，请求失败返回None
+    """
+    system_prompt = f"""你是JSON格式修复工具。下面的文本应当是一个分镜JSON对象，但存在问题：{error}
+请只修正格式问题并保留原有内容，输出一个有效的JSON对象，字段包括：
+character_consistency（对象，角色名 -> 外形描述）、environment_consistency（对象，场景名 -> 环境描述）、
+scenes（字符串列表）、scenes_detail（字符串列表，每项一个分镜画面描述）、dialogue（字符串列表）。
+不要添加任何额外的解释或说明。"""
 
     try:
-        print("----- 开始流式处理 -----")
-        stream = client.chat.completions.create(
-            model="doubao-1-5-pro-32k-250115",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": novel_text},
-            ],
-            stream=True,
-        )
-
-        full_response = ""
-        for chunk in stream:
-            if not chunk.choices:
-                continue
-            content = chunk.choices[0].delta.content
-            if content:
-                print(content, end="")
-                full_response += content
-        print()
+        with metrics.span('llm_call', mode='fixup'):
+            completion = call_with_retry(lambda: get_ark_client().chat.completions.create(
+                model=LLM_MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": raw_text},
+                ],
+            ), description="JSON修正请求", limiter=get_limiter('doubao'))
+        record_usage(getattr(completion, 'usage', None), kind='fixup')
+        return completion.choices[0].message.content
+    except Exception as e:
+        print(f"JSON修正请求出错: {e}")
+        return None
 
-        # 尝试解析JSON，确保格式正确
-        try:
-            parsed_result = json.loads(full_response)
-            return parsed_result  # 返回解析后的字典对象
-        except json.JSONDecodeError:
-            # 如果返回的不是有效JSON，尝试修复或返回错误
-            print("API返回的内容不是有效的JSON格式")
-            return full_response
+
+def finalize_storyboard(raw_text, parsed=None):
+    """
+    把LLM的输出转换为校验通过的分镜字典
+
+    依次尝试：校验已解析的结果；在本地修复（去掉代码块、多余逗号、补全截断的JSON）；
+    本地修复失败时请求模型修正格式（LLM_JSON_FIXUP 开启时）。
+
+    参数:
+        raw_text: LLM返回的完整文本
+        parsed: 已经解析出的结果（例如流式解析器的结果），没有时传None
+
+    返回:
+        分镜字典，无法修复时返回None
+    """
+    if parsed is not None:
+        with metrics.span('json_parse', mode='validate'):
+            data, errors = validate_storyboard(parsed)
+        if not errors:
+            metrics.inc('llm_json_total', result='valid')
+            return data
+
+    try:
+        with metrics.span('json_parse'):
+            data, repaired = load_storyboard(raw_text)
+        if repaired:
+            print("LLM返回的JSON格式有误，已在本地修复")
+        metrics.inc('llm_json_total', result='repaired' if repaired else 'valid')
+        return data
+    except LLMJSONError as e:
+        error = e
+
+    print(f"API返回的内容不是有效的分镜JSON: {error}")
+    if not LLM_JSON_FIXUP or not raw_text or not raw_text.strip():
+        metrics.inc('llm_json_total', result='failed')
+        return None
+
+    fixed_text = request_json_fixup(raw_text, error)
+    try:
+        data, _ = load_storyboard(fixed_text)
+    except LLMJSONError as e:
+        print(f"模型修正后的JSON仍然无效: {e}")
+        metrics.inc('llm_json_total', result='failed')
+        return None
+
+    print("已通过模型修正JSON格式")
+    metrics.inc('llm_json_total', result='fixup')
+    return data
+
+
+def process_novel_text_streaming(novel_text, processing_rules, use_cache=True, event_callback=None):
+    """
+    流式处理小说文本
+
+    参数:
+        novel_text: 小说文本
+        processing_rules: 处理规则
+        use_cache: 是否使用LLM结果缓存
+        event_callback: 增量事件回调，签名为 event_callback(event, payload)，
+                        每个顶层字段完整到达时触发 'field' 事件，
+                        scenes_detail 中每个场景完整到达时触发 'scene' 事件；
+                        命中缓存时按同样顺序补发全部事件。未提供时把流式内容打印到控制台
+
+    超出 LLM_CHUNK_TOKENS 的长文本改为分块并行处理，场景事件按原文顺序在各块完成后补发
+    """
+    if estimate_tokens(novel_text) > LLM_CHUNK_TOKENS:
+        return process_novel_text_chunked(novel_text, processing_rules, use_cache=use_cache,
+                                          event_callback=event_callback)
+
+    def dispatch(events):
+        if not event_callback:
+            return
+        for event, payload in events:
+            try:
+                event_callback(event, payload)
+            except Exception as e:
+                print(f"流式事件回调出错: {e}")
+
+    rules_text, system_prompt = resolve_rules(processing_rules)
+    cache = get_llm_cache()
+    cache_key = cache.make_key(LLM_MODEL, rules_text, novel_text)
+    if use_cache:
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            print("命中LLM结果缓存")
+            if event_callback:
+                dispatch(replay_storyboard_events(cached_result))
+            else:
+                print(json.dumps(cached_result, ensure_ascii=False))
+            return cached_result
+
+    try:
+        print("----- 开始流式处理 -----")
+        parser = StoryboardStreamParser()
+        started = time.perf_counter()
+        first_token = True
+        with metrics.span('llm_call', mode='stream'):
+            # 只在建立流之前重试，已开始输出的流中断时不再重放
+            stream = chat_completion(LLM_MODEL, system_prompt, novel_text,
+                                     description="LLM流式请求", limiter=get_limiter('doubao'),
+                                     stream=True, stream_options={"include_usage": True})
+
+            for chunk in stream:
+                if not chunk.choices:
+                    # 最后一个分块只携带token用量
+                    record_usage(getattr(chunk, 'usage', None))
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    if first_token:
+                        first_token = False
+                        metrics.observe('llm_first_token_seconds', time.perf_counter() - started)
+                    if not event_callback:
+                        print(content, end="")
+                    dispatch(parser.feed(content))
+        if not event_callback:
+            print()
+        full_response = parser.buffer
+
+        # 解析并校验JSON（增量解析器会跳过JSON前后的多余内容），格式有问题时先在本地修复
+        parsed_result = finalize_storyboard(full_response, parser.result())
+        if parsed_result is None:
+            return None
+
+        cache.set(cache_key, LLM_MODEL, parsed_result)
+        return parsed_result  # 返回解析后的字典对象
     except Exception as e:
         print(f"API调用出错: {e}")
         return None
 
 
+def process_novel_text_chunked(novel_text, processing_rules, use_cache=True, event_callback=None,
+                               max_tokens=None, max_workers=None):
+    """
+    分块处理长篇小说文本
+
+    按章节/段落边界把文本切成不超过token预算的块，各块并行调用LLM（每块单独缓存），
+    再按原文顺序合并各块的分镜：拼接 scenes_detail（去掉块边界处的重复场景），统一角色和环境设定。
+    总耗时取决于最慢的一块，而不是各块之和。合并结果按整篇文本缓存，重复处理时直接返回。
+
+    参数:
+        novel_text: 小说文本
+        processing_rules: 处理规则
+        use_cache: 是否使用LLM结果缓存
+        event_callback: 增量事件回调（签名同 process_novel_text_streaming），
+                        前面的块都完成后立即按顺序推送该块合并后有变化的一致性设定和该块的场景，
+                        流水线生成不必等待所有块完成即可开始
+        max_tokens: 每块的token预算，默认使用 LLM_CHUNK_TOKENS
+        max_workers: 并行处理的块数，默认使用 LLM_CHUNK_WORKERS
+
+    返回:
+        合并后的分镜字典，任一块处理失败时返回None
+    """
+    def emit(event, payload):
+        if event_callback:
+            try:
+                event_callback(event, payload)
+            except Exception as e:
+                print(f"流式事件回调出错: {e}")
+
+    rules_text, _ = resolve_rules(processing_rules)
+    cache = get_llm_cache()
+    cache_key = cache.make_key(LLM_MODEL, rules_text, novel_text)
+    if use_cache:
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            print("命中LLM结果缓存（整篇合并结果）")
+            for event, payload in replay_storyboard_events(cached_result):
+                emit(event, payload)
+            return cached_result
+
+    chunks = split_novel_text(novel_text, max_tokens or LLM_CHUNK_TOKENS)
+    print(f"文本较长，分为 {len(chunks)} 块并行处理")
+
+    merger = StoryboardMerger()
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers or LLM_CHUNK_WORKERS),
+                            thread_name_prefix="llm-chunk") as executor:
+        # 各块在提交线程的上下文中执行，限流器据此识别请求所属用户
+        futures = [executor.submit(contextvars.copy_context().run, process_novel_text, chunk, processing_rules, use_cache)
+                   for chunk in chunks]
+
+        # 按块的顺序等待：前面的块都完成后才能确定后续场景的序号
+        for index, future in enumerate(futures):
+            chunk_result = future.result()
+            if not isinstance(chunk_result, dict):
+                print(f"第 {index + 1} 块处理失败")
+                for pending in futures:
+                    pending.cancel()
+                return None
+
+            scene_offset = len(merger.result['scenes_detail'])
+            previous = {field: dict(merger.result[field]) for field in CONSISTENCY_FIELDS}
+            added = merger.add(chunk_result)
+            # 先推送合并后的一致性设定（流水线生成据此确定提示词前缀），再推送本块的场景；
+            # 推送副本，之后的块合并时不会改动已推送的内容
+            for field in CONSISTENCY_FIELDS:
+                if index == 0 or merger.result[field] != previous[field]:
+                    emit('field', {'key': field, 'value': dict(merger.result[field])})
+            for i, scene in enumerate(added):
+                emit('scene', {'scene_index': scene_offset + i + 1, 'scene': scene})
+
+    result = merger.result
+    cache.set(cache_key, LLM_MODEL, result)
+    for key, value in result.items():
+        if key not in CONSISTENCY_FIELDS:
+            emit('field', {'key': key, 'value': value})
+    return result
+
+
 def get_novel_input():
     """获取小说文本输入"""
     print("\n请选择输入方式：")
@@ -184,7 +417,7 @@ def save_to_json(result, filename):
         filename += '.json'
 
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
+        with metrics.span('file_save', kind='json'), open(filename, 'w', encoding='utf-8') as f:
             json.dump(result, f, ensure_ascii=False, indent=2)
         return True
     except Exception as e:
@@ -222,9 +455,11 @@ def export_json_for_aigc(json_data, output_path=None):
 
 
 def main():
-    # 读取处理规则 - 优先使用环境变量中的路径
-    role_file_path = os.environ.get('ROLE_DOCX_PATH', "./role.docx")
-    processing_rules = read_role_docx(role_file_path)
+    # 读取处理规则 - 优先使用环境变量中的路径（规则文件修改后自动重新加载）
+    registry = get_rules_registry()
+    if os.environ.get('ROLE_DOCX_PATH'):
+        registry.register('default', os.environ['ROLE_DOCX_PATH'])
+    processing_rules = registry.get()
 
     if not processing_rules:
         print("无法读取处理规则，程序退出。")
@@ -242,6 +477,7 @@ def main():
         print("5. 退出")
 
         choice = input("请输入选择 (1/2/3/4/5): ").strip()
+        processing_rules = registry.get() or processing_rules
 
         if choice == '5':
             print("程序退出。")
@@ -250,7 +486,7 @@ def main():
         elif choice == '2':
             print("\n当前处理规则：")
             print("=" * 50)
-            print(processing_rules)
+            print(processing_rules.text)
             print("=" * 50)
             continue
 
@@ -328,34 +564,26 @@ def main():
             print("无效选择，请重新输入。")
 
 
-def batch_process_novels(input_folder, output_folder, processing_rules):
-    """批量处理小说文件"""
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-    for filename in os.listdir(input_folder):
-        if filename.endswith('.txt'):
-            input_path = os.path.join(input_folder, filename)
-            base_name = os.path.splitext(filename)[0]
-            output_path = os.path.join(output_folder, f"processed_{base_name}.json")
+def batch_process_novels(input_folder, output_folder, processing_rules, max_workers=None):
+    """
+    批量处理小说文件
 
-            try:
-                with open(input_path, 'r', encoding='utf-8') as f:
-                    novel_text = f.read()
+    并行处理，已成功的文件在重新运行时跳过，结束后在输出目录生成汇总报告（见 batch_runner.BatchRunner）
+    """
+    def process_file(input_path, base_name):
+        with open(input_path, 'r', encoding='utf-8') as f:
+            novel_text = f.read()
 
-                print(f"正在处理: {filename}")
-                result = process_novel_text(novel_text, processing_rules)
+        result = process_novel_text(novel_text, processing_rules)
+        if not isinstance(result, dict):
+            return None
 
-                if result:
-                    if save_to_json(result, output_path):
-                        print(f"处理完成: {output_path}")
-                    else:
-                        print(f"保存失败: {filename}")
-                else:
-                    print(f"处理失败: {filename}")
+        output_path = os.path.join(output_folder, f"processed_{base_name}.json")
+        if not save_to_json(result, output_path):
+            raise Exception(f"保存失败: {output_path}")
+        return [output_path]
 
-            except Exception as e:
-                print(f"处理文件 {filename} 时出错: {e}")
+    return BatchRunner(input_folder, output_folder, process_file, max_workers=max_workers).run()
 
 
 if __name__ == "__main__":
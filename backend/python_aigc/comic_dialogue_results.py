@@ -1,10 +1,15 @@
 import os
 import json
 import re
-import time
-from volcenginesdkarkruntime import Ark
+import sys
 from volcenginesdkarkruntime.types.images.images import SequentialImageGenerationOptions
 
+# 添加父目录到路径，以便导入其他模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ark_client import call_with_retry, get_ark_client
+from rate_limiter import get_limiter
+
 
 #    目前AI还不行，就算已经足够细致的prompt也无法让AI每次都生成足够满意的气泡旁白
 
@@ -12,11 +17,8 @@ def add_dialogue_to_images():
     """
     为已生成的漫画图片添加对白气泡
     """
-    # 初始化Ark客户端
-    client = Ark(
-        base_url="https://ark.cn-beijing.volces.com/api/v3",
-        api_key=os.environ.get("ARK_API_KEY"),
-    )
+    # 使用共享的Ark客户端
+    client = get_ark_client()
 
     # 1. 加载已生成的图片结果
     try:
@@ -80,7 +82,7 @@ def add_dialogue_to_images():
         # 调用Seedream API编辑图片
         try:
             # 根据:cite[1]，API支持传入images参数进行图像编辑
-            imagesResponse = client.images.generate(
+            imagesResponse = call_with_retry(lambda: client.images.generate(
                 model="doubao-seedream-4-0-250828",
                 prompt=edit_prompt,
                 image=[image_url],  # 传入原图片URL进行编辑
@@ -89,7 +91,7 @@ def add_dialogue_to_images():
                 sequential_image_generation_options=SequentialImageGenerationOptions(max_images=1),
                 response_format="url",
                 watermark=False
-            )
+            ), description=f"场景 {scene_idx} 图片编辑", limiter=get_limiter('seedream'))
 
             # 处理响应
             if imagesResponse.data and len(imagesResponse.data) > 0:
@@ -112,9 +114,6 @@ def add_dialogue_to_images():
                     "error": "无返回图片"
                 })
 
-            # 添加延迟避免API限制
-            time.sleep(1)
-
         except Exception as e:
             print(f"场景 {scene_idx} API调用出错: {e}")
             edited_results.append({
@@ -1,49 +1,44 @@
 import os
 import json
 import sys
-import time
-from volcenginesdkarkruntime import Ark
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from volcenginesdkarkruntime.types.images.images import SequentialImageGenerationOptions
 
 # 添加父目录到路径，以便导入其他模块
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import metrics
+from ark_client import call_with_retry, get_ark_client
+from rate_limiter import get_limiter
+from image_cache import get_image_cache
+from image_store import ImageStore, get_image_mirror
 
-def process_llm_json_and_generate_comics(json_data, progress_callback=None):
-    """
-    处理从LLM模型接收的JSON数据并生成连环画
+# 图片生成模型和尺寸
+IMAGE_MODEL = "doubao-seedream-4-0-250828"
+IMAGE_SIZE = "1K"
 
-    参数:
-        json_data: 从LLM模型接收的JSON数据，格式应包含scenes_detail字段
-        progress_callback: 进度回调函数，接受当前步骤和总步骤数
-    """
-    # 初始化Ark客户端
-    client = Ark(
-        base_url="https://ark.cn-beijing.volces.com/api/v3",
-        api_key=os.environ.get("ARK_API_KEY"),
-    )
-
-    # 验证JSON数据格式
-    if not isinstance(json_data, dict):
-        print("错误: JSON数据格式不正确，应为字典类型")
-        return None
+# 并发生成配置：同时在途的图片请求上限
+SEEDREAM_MAX_WORKERS = int(os.environ.get("SEEDREAM_MAX_WORKERS", "4"))
 
-    # 检查是否有 scenes_detail 或 scenes 字段
-    scenes_detail = json_data.get("scenes_detail", [])
-    if not scenes_detail:
-        scenes_detail = json_data.get("scenes", [])
-        if scenes_detail:
-            print("使用 scenes 字段作为场景描述")
+# 流水线模式：LLM流式输出分镜的同时开始生成图片（默认关闭，可由调用方单独开启）
+PIPELINED_GENERATION = os.environ.get("PIPELINED_GENERATION", "0") == "1"
+
+# 开始生成图片前必须已经拿到的一致性字段（决定提示词前缀）
+CONSISTENCY_KEYS = ("character_consistency", "environment_consistency")
 
-    if not scenes_detail:
-        print("警告: 未找到有效的场景描述字段 (scenes_detail 或 scenes)")
-        return None
 
-    # 提取角色和环境一致性信息
+def build_consistency_prefix(json_data):
+    """
+    根据角色和环境一致性信息构建提示词前缀
+
+    参数:
+        json_data: LLM返回的JSON数据
+    """
     character_consistency = json_data.get("character_consistency", {})
     environment_consistency = json_data.get("environment_consistency", {})
 
-    # 构建一致性提示词前缀
     consistency_prefix = ""
 
     if character_consistency:
@@ -54,55 +49,300 @@ def process_llm_json_and_generate_comics(json_data, progress_callback=None):
         env_desc = " ".join([f"{env}: {desc}" for env, desc in environment_consistency.items()])
         consistency_prefix += f"环境设定: {env_desc}. "
 
-    # 对每个场景分别调用API
-    results = []
-    total_scenes = len(scenes_detail)
-
-    for i, scene_detail in enumerate(scenes_detail):
-        # 调用进度回调
-        if progress_callback:
-            progress_callback(i + 1, total_scenes)
-
-        # 为每个场景单独构建提示词，加入一致性信息
-        comic_prompt = f"{consistency_prefix}漫画风格连环画,注意每幅画面间的连贯性。{scene_detail}"
-
-        print(f"场景 {i + 1} 的提示词: {comic_prompt}")
-
-        # 调用Seedream API生成单个场景的图片
-        try:
-            imagesResponse = client.images.generate(
-                model="doubao-seedream-4-0-250828",
-                prompt=comic_prompt,
-                size="1K",
-                sequential_image_generation="auto",
-                sequential_image_generation_options=SequentialImageGenerationOptions(
-                    max_images=1  # 每次只生成一张图片
-                ),
-                response_format="url",
-                watermark=False
-            )
-
-            # 处理响应
-            if imagesResponse.data and len(imagesResponse.data) > 0:
-                image = imagesResponse.data[0]
-                results.append({
-                    "scene_index": i + 1,
-                    "url": image.url,
-                    "size": image.size,
-                    "prompt": comic_prompt
-                })
-                print(f"分镜 {i + 1} - URL: {image.url}, Size: {image.size}")
-            else:
-                print(f"警告: 场景 {i + 1} 没有生成图片")
+    return consistency_prefix
+
+
+def generate_scene_image(client, scene_index, comic_prompt, force_render=False):
+    """
+    调用Seedream API生成单个场景的图片
+
+    参数:
+        client: Ark客户端
+        scene_index: 场景序号（从1开始）
+        comic_prompt: 完整的场景提示词
+        force_render: 为True时忽略图片缓存，强制重新生成
+
+    返回:
+        成功返回结果字典，失败返回None（失败只影响当前场景）
+    """
+    # 相同提示词、尺寸和模型的场景直接复用已生成的图片
+    if not force_render:
+        cached = get_image_cache().get(IMAGE_MODEL, IMAGE_SIZE, comic_prompt)
+        if cached:
+            print(f"分镜 {scene_index} 命中图片缓存 - URL: {cached['url']}")
+            return {
+                "scene_index": scene_index,
+                "url": cached['url'],
+                "remote_url": cached['remote_url'],
+                "size": cached['image_size'],
+                "prompt": comic_prompt,
+                "cached": True
+            }
+
+    def request_image():
+        return client.images.generate(
+            model=IMAGE_MODEL,
+            prompt=comic_prompt,
+            size=IMAGE_SIZE,
+            sequential_image_generation="auto",
+            sequential_image_generation_options=SequentialImageGenerationOptions(
+                max_images=1  # 每次只生成一张图片
+            ),
+            response_format="url",
+            watermark=False
+        )
+
+    try:
+        # 通过全局自适应限流器按用户公平排队（每次重试也需要获取令牌），
+        # 限流（429）和服务端错误时按退避策略重试，避免因瞬时限流丢失分镜
+        with metrics.span('image_render', detail={'scene_index': scene_index}):
+            imagesResponse = call_with_retry(request_image, description=f"场景 {scene_index} 图片生成",
+                                             limiter=get_limiter('seedream'))
+
+        # 处理响应
+        if imagesResponse.data and len(imagesResponse.data) > 0:
+            image = imagesResponse.data[0]
+            print(f"分镜 {scene_index} - URL: {image.url}, Size: {image.size}")
+            return {
+                "scene_index": scene_index,
+                "url": image.url,
+                "size": image.size,
+                "prompt": comic_prompt
+            }
+
+        print(f"警告: 场景 {scene_index} 没有生成图片")
+        return None
+
+    except Exception as e:
+        print(f"场景 {scene_index} 的API调用出错（已重试）: {e}")
+        return None
+
 
-            # 添加短暂延迟，避免API限制
-            time.sleep(1)
+def build_scene_prompt(consistency_prefix, scene_detail):
+    """为单个场景构建提示词，加入一致性信息"""
+    return f"{consistency_prefix}漫画风格连环画,注意每幅画面间的连贯性。{scene_detail}"
 
-        except Exception as e:
-            print(f"场景 {i + 1} 的API调用出错: {e}")
-            # 即使某个场景失败，继续处理其他场景
 
-    return results
+class PipelinedComicRenderer:
+    """
+    流水线式连环画生成器
+
+    接收 LLM 流式解析产生的事件（见 json_stream.StoryboardStreamParser），
+    角色和环境一致性信息到达后，每个完整到达的场景立即提交生成，
+    不必等待整个分镜JSON结束；LLM结束后调用 finish() 补齐遗漏的场景并等待全部完成。
+    一致性信息再次到达时（长文本分块处理，每块合并后更新）之后的场景使用新的提示词前缀，
+    之前已提交的场景在 finish() 中按最终提示词核对。
+
+    参数:
+        progress_callback: 进度回调函数，接受已完成场景数和当前已知的总场景数（在生成线程中执行）
+        max_workers: 同时在途的图片请求上限，默认使用 SEEDREAM_MAX_WORKERS
+        force_render: 为True时忽略图片缓存，所有场景强制重新生成
+        scene_callback: 单个场景完成时的回调，接受场景序号和生成结果（失败时为None），在生成线程中执行
+
+    用法:
+        renderer = PipelinedComicRenderer(progress_callback)
+        llm_result = process_novel_text_streaming(text, rules, event_callback=renderer.on_event)
+        comic_results = renderer.finish(llm_result)
+    """
+
+    def __init__(self, progress_callback=None, max_workers=None, force_render=False, scene_callback=None):
+        self.client = get_ark_client()
+        self.progress_callback = progress_callback
+        self.scene_callback = scene_callback
+        self.force_render = force_render
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers or SEEDREAM_MAX_WORKERS),
+            thread_name_prefix="seedream"
+        )
+        self._image_mirror = get_image_mirror()
+        self._lock = threading.Lock()
+        self._consistency = {}
+        self._prefix = None
+        self._pending = {}         # 等待一致性信息的场景：序号 -> 场景描述
+        self._submitted = {}       # 已提交的场景：序号 -> (提示词, Future)
+        self._mirror_futures = {}  # 序号 -> 镜像下载 Future
+        self._completed = set()    # 当前提示词已生成完成的场景序号（用于进度）
+        self._total = 0
+
+    def on_event(self, event, payload):
+        """流式解析事件回调，可直接作为 event_callback 传给 process_novel_text_streaming"""
+        if event == 'field' and payload['key'] in CONSISTENCY_KEYS:
+            with self._lock:
+                self._consistency[payload['key']] = payload['value']
+                if not all(key in self._consistency for key in CONSISTENCY_KEYS):
+                    return
+                first = self._prefix is None
+                self._prefix = build_consistency_prefix(self._consistency)
+                if not first:
+                    return
+                pending, self._pending = self._pending, {}
+            for scene_index in sorted(pending):
+                self._submit(scene_index, build_scene_prompt(self._prefix, pending[scene_index]))
+
+        elif event == 'scene':
+            scene_index = payload['scene_index']
+            with self._lock:
+                self._total = max(self._total, scene_index)
+                if self._prefix is None:
+                    # 一致性信息还没到齐，先缓存场景，前缀确定后再提交
+                    self._pending[scene_index] = payload['scene']
+                    return
+            self._submit(scene_index, build_scene_prompt(self._prefix, payload['scene']))
+
+    def _submit(self, scene_index, comic_prompt):
+        print(f"场景 {scene_index} 的提示词: {comic_prompt}")
+        # 在提交线程的上下文中执行，限流器据此识别请求所属用户
+        future = self._executor.submit(contextvars.copy_context().run, generate_scene_image,
+                                       self.client, scene_index, comic_prompt, self.force_render)
+        with self._lock:
+            replaced = self._submitted.get(scene_index)
+            self._submitted[scene_index] = (comic_prompt, future)
+            # 旧提示词的结果作废：不再计入进度，尚未开始的请求直接取消
+            self._completed.discard(scene_index)
+            self._mirror_futures.pop(scene_index, None)
+        if replaced is not None:
+            replaced[1].cancel()
+        future.add_done_callback(lambda f: self._on_done(scene_index, f))
+
+    def _discard(self, scene_index):
+        """放弃最终结果中不存在的场景（流式阶段多出来的序号）"""
+        with self._lock:
+            submitted = self._submitted.pop(scene_index, None)
+            self._completed.discard(scene_index)
+            self._mirror_futures.pop(scene_index, None)
+        if submitted is not None:
+            submitted[1].cancel()
+
+    def _on_done(self, scene_index, future):
+        with self._lock:
+            current = self._submitted.get(scene_index)
+            if current is None or current[1] is not future:
+                # 已被新的提示词替换
+                return
+
+        result = None if future.cancelled() or future.exception() else future.result()
+        # 生成完成后立即在后台把图片镜像到本地，签名链接过期后仍可访问
+        if result and not ImageStore.filename_from_url(result['url']):
+            mirror_future = self._image_mirror.submit(result['url'])
+            with self._lock:
+                if self._submitted.get(scene_index, (None, None))[1] is future:
+                    self._mirror_futures[scene_index] = mirror_future
+
+        if self.scene_callback:
+            try:
+                self.scene_callback(scene_index, result)
+            except Exception as e:
+                print(f"场景回调出错: {e}")
+
+        with self._lock:
+            current = self._submitted.get(scene_index)
+            if current is None or current[1] is not future:
+                # 回调期间被新的提示词替换
+                return
+            self._completed.add(scene_index)
+            completed = len(self._completed)
+            total = max(self._total, completed)
+            if self.progress_callback:
+                try:
+                    self.progress_callback(completed, total)
+                except Exception as e:
+                    print(f"进度回调出错: {e}")
+
+    def cancel(self):
+        """放弃生成（例如LLM处理失败），未开始的场景不再生成"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def finish(self, json_data):
+        """
+        根据完整的LLM结果补齐并等待所有场景生成
+
+        流式阶段已提交且提示词一致的场景不会重复生成；提示词不一致的场景重新提交，
+        旧的请求尚未开始时取消，已开始的结果丢弃且不计入进度。
+
+        参数:
+            json_data: 从LLM模型接收的完整JSON数据，格式应包含scenes_detail字段
+
+        返回:
+            按场景顺序排列的生成结果列表，数据无效时返回None
+        """
+        # 验证JSON数据格式
+        if not isinstance(json_data, dict):
+            print("错误: JSON数据格式不正确，应为字典类型")
+            self.cancel()
+            return None
+
+        # 检查是否有 scenes_detail 或 scenes 字段
+        scenes_detail = json_data.get("scenes_detail", [])
+        if not scenes_detail:
+            scenes_detail = json_data.get("scenes", [])
+            if scenes_detail:
+                print("使用 scenes 字段作为场景描述")
+
+        if not scenes_detail:
+            print("警告: 未找到有效的场景描述字段 (scenes_detail 或 scenes)")
+            self.cancel()
+            return None
+
+        # 构建一致性提示词前缀
+        consistency_prefix = build_consistency_prefix(json_data)
+
+        total_scenes = len(scenes_detail)
+        with self._lock:
+            self._total = total_scenes
+            submitted = dict(self._submitted)
+
+        # 最终结果中的场景比流式阶段少（例如分镜被修复或去重）时，多出来的场景不再生成
+        for scene_index in submitted:
+            if scene_index > total_scenes:
+                self._discard(scene_index)
+
+        # 提交流式阶段尚未开始（或提示词不一致）的场景，单个场景失败不影响其他场景
+        for i, scene_detail in enumerate(scenes_detail):
+            comic_prompt = build_scene_prompt(consistency_prefix, scene_detail)
+            existing = submitted.get(i + 1)
+            if existing is None or existing[0] != comic_prompt:
+                self._submit(i + 1, comic_prompt)
+
+        results = []
+        for scene_index in range(1, total_scenes + 1):
+            future = self._submitted[scene_index][1]
+            result = None if future.cancelled() or future.exception() else future.result()
+            if result:
+                results.append(result)
+        self._executor.shutdown(wait=True)
+
+        # 等待镜像完成，把结果中的地址改写为本地访问路径
+        image_cache = get_image_cache()
+        for result in results:
+            mirror_future = self._mirror_futures.get(result["scene_index"])
+            if mirror_future is None:
+                continue
+            remote_url = result.get("remote_url") or result["url"]
+            filename = mirror_future.result()
+            if filename:
+                result["remote_url"] = remote_url
+                result["url"] = ImageStore.local_url(filename)
+            image_cache.put(IMAGE_MODEL, IMAGE_SIZE, result["prompt"], remote_url, result["size"], filename)
+
+        # 按场景顺序返回结果
+        return results
+
+
+def process_llm_json_and_generate_comics(json_data, progress_callback=None, max_workers=None, force_render=False,
+                                         scene_callback=None):
+    """
+    处理从LLM模型接收的JSON数据并生成连环画
+
+    参数:
+        json_data: 从LLM模型接收的JSON数据，格式应包含scenes_detail字段
+        progress_callback: 进度回调函数，接受已完成场景数和总场景数（在生成线程中执行）
+        max_workers: 同时在途的图片请求上限，默认使用 SEEDREAM_MAX_WORKERS，设为1即串行生成
+        force_render: 为True时忽略图片缓存，所有场景强制重新生成
+        scene_callback: 单个场景完成时的回调，接受场景序号和生成结果（失败时为None）
+    """
+    renderer = PipelinedComicRenderer(progress_callback, max_workers=max_workers, force_render=force_render,
+                                      scene_callback=scene_callback)
+    return renderer.finish(json_data)
 
 def generate_comics_from_json_file(json_file_path):
     """
@@ -122,6 +362,16 @@ def generate_comics_from_json_file(json_file_path):
         return None
 
 
+def build_comic_results_data(comic_results, json_data):
+    """构建保存的连环画结果：场景数、一致性设定和每个场景的生成结果"""
+    return {
+        "total_scenes": len(comic_results),
+        "character_consistency": json_data.get("character_consistency", {}),
+        "environment_consistency": json_data.get("environment_consistency", {}),
+        "results": comic_results
+    }
+
+
 def save_comic_results(comic_results, json_data, output_file=None):
     """
     保存连环画生成结果
@@ -136,14 +386,9 @@ def save_comic_results(comic_results, json_data, output_file=None):
         output_file = f"comic_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
 
     try:
-        result_data = {
-            "total_scenes": len(comic_results),
-            "character_consistency": json_data.get("character_consistency", {}),
-            "environment_consistency": json_data.get("environment_consistency", {}),
-            "results": comic_results
-        }
-
-        with open(output_file, 'w', encoding='utf-8') as f:
+        result_data = build_comic_results_data(comic_results, json_data)
+
+        with metrics.span('file_save', kind='json'), open(output_file, 'w', encoding='utf-8') as f:
             json.dump(result_data, f, ensure_ascii=False, indent=2)
 
         print(f"连环画生成结果已保存到: {output_file}")
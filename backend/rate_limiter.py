@@ -0,0 +1,347 @@
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+# 限流后端：memory（进程内）或 sqlite（多进程共享同一个数据库文件）
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB", "rate_limiter.db")
+
+# AIMD 参数
+RATE_LIMIT_INCREASE_STEP = float(os.environ.get("RATE_LIMIT_INCREASE_STEP", "0.1"))
+RATE_LIMIT_DECREASE_FACTOR = float(os.environ.get("RATE_LIMIT_DECREASE_FACTOR", "0.5"))
+RATE_LIMIT_ADJUST_INTERVAL = float(os.environ.get("RATE_LIMIT_ADJUST_INTERVAL", "1"))
+
+# Seedream 图片生成接口的默认限流配置，可通过环境变量调整
+SEEDREAM_QPS = float(os.environ.get("SEEDREAM_QPS", "2"))
+SEEDREAM_BURST = float(os.environ.get("SEEDREAM_BURST", "2"))
+SEEDREAM_MIN_QPS = float(os.environ.get("SEEDREAM_MIN_QPS", "0.2"))
+
+# 豆包LLM接口的默认限流配置
+DOUBAO_QPS = float(os.environ.get("DOUBAO_QPS", "5"))
+DOUBAO_BURST = float(os.environ.get("DOUBAO_BURST", "5"))
+DOUBAO_MIN_QPS = float(os.environ.get("DOUBAO_MIN_QPS", "0.5"))
+
+# 各接口的限流配置：(最高QPS, 突发容量, 最低QPS)
+ENDPOINT_LIMITS = {
+    'seedream': (SEEDREAM_QPS, SEEDREAM_BURST, SEEDREAM_MIN_QPS),
+    'doubao': (DOUBAO_QPS, DOUBAO_BURST, DOUBAO_MIN_QPS),
+}
+
+
+class TokenBucket:
+    """
+    令牌桶限流器（线程安全）
+
+    参数:
+        rate: 每秒补充的令牌数（即稳定QPS）
+        capacity: 桶容量，允许的瞬时突发请求数
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+    def try_acquire(self, tokens=1):
+        """
+        尝试立即获取令牌
+
+        返回:
+            0 表示已获取，否则返回令牌足够前还需等待的秒数
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+    def adjust_rate(self, func):
+        """用 func(当前速率) 的返回值更新速率，返回新速率"""
+        with self._lock:
+            self._refill()
+            self.rate = float(func(self.rate))
+            return self.rate
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        获取令牌，不足时阻塞等待
+
+        参数:
+            tokens: 需要的令牌数
+            timeout: 最长等待秒数，None表示一直等待
+
+        返回:
+            成功获取返回True，超时返回False
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_time = self.try_acquire(tokens)
+            if wait_time <= 0:
+                return True
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait_time = min(wait_time, remaining)
+            time.sleep(wait_time)
+
+
+class SQLiteTokenBucket:
+    """
+    基于SQLite的令牌桶，多个进程（如多个 gunicorn worker）共享同一个桶和速率
+
+    接口与 TokenBucket 的 try_acquire / adjust_rate 相同。
+
+    参数:
+        name: 桶名称（每个接口一个）
+        rate: 初始速率（桶已存在时沿用库中的速率）
+        capacity: 桶容量
+        db_path: 数据库文件路径
+    """
+
+    def __init__(self, name, rate, capacity=None, db_path=None):
+        self.name = name
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.db_path = db_path or RATE_LIMIT_DB
+        self._local = threading.local()
+
+        with self._transaction() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limiter (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    last_refill REAL NOT NULL,
+                    rate REAL NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                INSERT OR IGNORE INTO rate_limiter (name, tokens, last_refill, rate) VALUES (?, ?, ?, ?)
+            ''', (name, self.capacity, time.time(), float(rate)))
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+            except sqlite3.OperationalError:
+                # 其他进程正在切换日志模式，WAL 由先到的进程设置
+                pass
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        # 立即获取写锁，保证多进程下“读取-补充-扣减”是原子的
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn.cursor()
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _load(self, cursor):
+        cursor.execute('SELECT tokens, last_refill, rate FROM rate_limiter WHERE name = ?', (self.name,))
+        tokens, last_refill, rate = cursor.fetchone()
+        now = time.time()
+        tokens = min(self.capacity, tokens + max(0.0, now - last_refill) * rate)
+        return tokens, now, rate
+
+    @property
+    def rate(self):
+        with self._transaction() as cursor:
+            return self._load(cursor)[2]
+
+    def try_acquire(self, tokens=1):
+        with self._transaction() as cursor:
+            available, now, rate = self._load(cursor)
+            wait_time = 0
+            if available >= tokens:
+                available -= tokens
+            else:
+                wait_time = (tokens - available) / rate
+            cursor.execute('UPDATE rate_limiter SET tokens = ?, last_refill = ? WHERE name = ?',
+                           (available, now, self.name))
+            return wait_time
+
+    def adjust_rate(self, func):
+        with self._transaction() as cursor:
+            available, now, rate = self._load(cursor)
+            rate = float(func(rate))
+            cursor.execute('UPDATE rate_limiter SET tokens = ?, last_refill = ?, rate = ? WHERE name = ?',
+                           (available, now, rate, self.name))
+            return rate
+
+
+# 当前请求所属的用户，用于公平排队（由任务线程和WebSocket处理函数设置）
+_current_user = contextvars.ContextVar('rate_limit_user', default=None)
+
+
+def set_current_user(user_id):
+    """设置当前线程（上下文）中发起接口调用的用户"""
+    _current_user.set(user_id)
+
+
+def current_user_id():
+    """获取当前上下文中的用户，未设置时返回None"""
+    return _current_user.get()
+
+
+class AdaptiveRateLimiter:
+    """
+    自适应（AIMD）限流器，按用户公平排队
+
+    - 每个接口一个限流器，进程内所有用户共享（使用 SQLiteTokenBucket 时多进程共享）
+    - 收到限流错误时速率乘以 decrease_factor（乘性减），持续成功时每个调整周期
+      增加 increase_step（加性增），速率保持在 [min_rate, max_rate] 之间
+    - 等待令牌的请求按用户分队列，轮流放行，单个用户的大量请求不会饿死其他用户
+
+    参数:
+        name: 接口名称
+        bucket: TokenBucket 或 SQLiteTokenBucket
+        min_rate: 最低速率
+        max_rate: 最高速率
+        increase_step: 每个调整周期增加的速率
+        decrease_factor: 限流时的速率缩减系数
+        adjust_interval: 两次速率调整之间的最短间隔（秒），避免同一批并发请求的限流错误把速率连续减半
+    """
+
+    def __init__(self, name, bucket, min_rate, max_rate, increase_step=None, decrease_factor=None,
+                 adjust_interval=None):
+        self.name = name
+        self.bucket = bucket
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.increase_step = RATE_LIMIT_INCREASE_STEP if increase_step is None else increase_step
+        self.decrease_factor = RATE_LIMIT_DECREASE_FACTOR if decrease_factor is None else decrease_factor
+        self.adjust_interval = RATE_LIMIT_ADJUST_INTERVAL if adjust_interval is None else adjust_interval
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # 用户 -> 等待中的请求队列，按轮转顺序排列
+        self._last_increase = 0.0
+        self._last_decrease = 0.0
+        self.granted = 0
+        self.throttled = 0
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def acquire(self, tokens=1, timeout=None, user_id=None):
+        """
+        按用户公平排队获取令牌
+
+        参数:
+            tokens: 需要的令牌数
+            timeout: 最长等待秒数，None表示一直等待
+            user_id: 请求所属用户，默认使用 current_user_id()
+
+        返回:
+            成功获取返回True，超时返回False
+        """
+        user = user_id if user_id is not None else current_user_id()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        ticket = object()
+
+        with self._cond:
+            queue = self._queues.setdefault(user, deque())
+            queue.append(ticket)
+            while True:
+                wait_time = None
+                head_user = next(iter(self._queues))
+                if self._queues[head_user][0] is ticket:
+                    wait_time = self.bucket.try_acquire(tokens)
+                    if wait_time <= 0:
+                        # 放行后该用户排到队尾，轮到下一个用户
+                        queue.popleft()
+                        if queue:
+                            self._queues.move_to_end(user)
+                        else:
+                            del self._queues[user]
+                        self.granted += 1
+                        self._cond.notify_all()
+                        return True
+
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        queue.remove(ticket)
+                        if not queue:
+                            del self._queues[user]
+                        self._cond.notify_all()
+                        return False
+                    wait_time = remaining if wait_time is None else min(wait_time, remaining)
+                self._cond.wait(wait_time)
+
+    def on_success(self):
+        """请求成功，按周期加性增加速率"""
+        # 多个渲染线程同时回调，判断调整周期和修改速率在同一把锁内完成，避免重复调整或丢失调整
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_increase < self.adjust_interval or now - self._last_decrease < self.adjust_interval:
+                return
+            self._last_increase = now
+            self.bucket.adjust_rate(lambda rate: min(self.max_rate, rate + self.increase_step))
+            # 速率提高后等待中的请求可以更早获取令牌
+            self._cond.notify_all()
+
+    def on_throttle(self):
+        """收到限流错误，乘性降低速率（同一调整周期内的并发限流错误只降低一次）"""
+        with self._cond:
+            self.throttled += 1
+            now = time.monotonic()
+            if now - self._last_decrease < self.adjust_interval:
+                return
+            self._last_decrease = now
+            rate = self.bucket.adjust_rate(lambda rate: max(self.min_rate, rate * self.decrease_factor))
+        print(f"{self.name} 接口触发限流，速率降至 {rate:.2f} QPS")
+
+    def stats(self):
+        """返回当前速率和排队情况"""
+        with self._cond:
+            waiting = sum(len(queue) for queue in self._queues.values())
+            users = len(self._queues)
+        return {
+            'rate': self.rate,
+            'granted': self.granted,
+            'throttled': self.throttled,
+            'waiting': waiting,
+            'waiting_users': users
+        }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(endpoint):
+    """获取接口对应的共享限流器（懒加载）"""
+    limiter = _limiters.get(endpoint)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(endpoint)
+            if limiter is None:
+                max_rate, burst, min_rate = ENDPOINT_LIMITS[endpoint]
+                if RATE_LIMIT_BACKEND == 'sqlite':
+                    bucket = SQLiteTokenBucket(endpoint, max_rate, burst)
+                else:
+                    bucket = TokenBucket(max_rate, burst)
+                limiter = AdaptiveRateLimiter(endpoint, bucket, min_rate, max_rate)
+                _limiters[endpoint] = limiter
+    return limiter
@@ -0,0 +1,192 @@
+import hashlib
+import os
+import threading
+import time
+
+from docx import Document
+
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 默认规则文件（role.docx）和按风格划分的规则集目录，可通过环境变量调整
+ROLE_DOCX_PATH = os.environ.get("ROLE_DOCX_PATH", os.path.join(BACKEND_DIR, "python_LLM", "role.docx"))
+RULES_DIR = os.environ.get("RULES_DIR", os.path.join(BACKEND_DIR, "python_LLM", "rules"))
+DEFAULT_RULE_SET = "default"
+# 两次检查规则文件是否变化的最短间隔（秒），避免每个请求都访问文件系统
+RULES_CHECK_INTERVAL = float(os.environ.get("RULES_CHECK_INTERVAL", "2"))
+
+RULES_EXTENSIONS = ('.docx', '.txt', '.md')
+
+
+def read_rules_file(file_path):
+    """读取规则文件（.docx 按段落拼接，.txt/.md 直接读取），失败时返回None"""
+    try:
+        if file_path.lower().endswith('.docx'):
+            doc = Document(file_path)
+            return '\n'.join(paragraph.text for paragraph in doc.paragraphs)
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except Exception as e:
+        print(f"读取规则文件 {file_path} 时出错: {e}")
+        return None
+
+
+def build_system_prompt(rules_text):
+    """根据处理规则构建分镜生成的系统提示词"""
+    return f"""
+{rules_text}
+请确保返回的内容是有效的JSON格式，不要添加任何额外的解释或说明。"""
+
+
+class RuleSet:
+    """
+    已解析的一套处理规则
+
+    属性:
+        name: 规则集名称
+        path: 规则文件路径
+        text: 规则文本
+        system_prompt: 预先构建好的系统提示词
+        digest: 规则文本的SHA-256，用于判断内容是否变化
+    """
+
+    def __init__(self, name, path, text):
+        self.name = name
+        self.path = path
+        self.text = text
+        self.system_prompt = build_system_prompt(text)
+        self.digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self.loaded_at = time.time()
+
+    def __repr__(self):
+        return f"RuleSet(name={self.name!r}, path={self.path!r}, digest={self.digest[:12]})"
+
+
+class _Entry:
+    def __init__(self, path):
+        self.path = path
+        self.stat_key = None
+        self.checked_at = 0.0
+        self.rule_set = None
+
+
+class RulesRegistry:
+    """
+    可热更新的规则集注册表
+
+    - default 规则集来自 role.docx，rules_dir 中的每个 .docx/.txt/.md 文件是一个同名规则集
+      （例如 rules/manga.docx -> manga），请求时按名称选择
+    - 规则文件只在修改时间或大小变化时重新解析，内容没变（只是被 touch）时沿用原来的对象；
+      重新解析失败时继续使用上一个版本
+    - 每个规则集的系统提示词在加载时构建好，调用LLM时不再重复拼接
+
+    参数:
+        default_path: default 规则集的文件路径
+        rules_dir: 其他规则集所在目录（不存在时只有 default）
+        check_interval: 两次检查文件变化的最短间隔（秒）
+    """
+
+    def __init__(self, default_path=ROLE_DOCX_PATH, rules_dir=RULES_DIR, check_interval=RULES_CHECK_INTERVAL):
+        self.rules_dir = rules_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._explicit = set()
+        self._dir_checked_at = 0.0
+        if default_path:
+            self.register(DEFAULT_RULE_SET, default_path)
+
+    def register(self, name, path):
+        """注册（或替换）一个规则集的文件路径，路径不变时保留已加载的内容"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry.path != path:
+                self._entries[name] = _Entry(path)
+            self._explicit.add(name)
+
+    def _scan_dir(self, now):
+        # 规则目录中新增或删除的文件，按检查间隔同步到注册表
+        if now - self._dir_checked_at < self.check_interval:
+            return
+        self._dir_checked_at = now
+        found = {}
+        if self.rules_dir and os.path.isdir(self.rules_dir):
+            for filename in sorted(os.listdir(self.rules_dir)):
+                name, ext = os.path.splitext(filename)
+                if ext.lower() in RULES_EXTENSIONS and not filename.startswith(('.', '~$')):
+                    found.setdefault(name, os.path.join(self.rules_dir, filename))
+
+        for name in list(self._entries):
+            if name not in self._explicit and name not in found:
+                del self._entries[name]
+        for name, path in found.items():
+            if name not in self._explicit and (name not in self._entries or self._entries[name].path != path):
+                self._entries[name] = _Entry(path)
+
+    def _refresh(self, name, entry, now):
+        if entry.rule_set is not None and now - entry.checked_at < self.check_interval:
+            return entry.rule_set
+        entry.checked_at = now
+
+        try:
+            stat = os.stat(entry.path)
+            stat_key = (stat.st_mtime_ns, stat.st_size)
+        except OSError as e:
+            if entry.rule_set is None:
+                print(f"找不到规则文件: {entry.path} ({e})")
+            return entry.rule_set
+
+        if stat_key == entry.stat_key:
+            return entry.rule_set
+
+        text = read_rules_file(entry.path)
+        if not text:
+            # 文件正在写入或格式有误，继续使用上一个版本
+            return entry.rule_set
+        entry.stat_key = stat_key
+        if entry.rule_set is not None and entry.rule_set.text == text:
+            return entry.rule_set
+
+        action = "重新加载" if entry.rule_set is not None else "加载"
+        entry.rule_set = RuleSet(name, entry.path, text)
+        print(f"已{action}处理规则 {name}: {entry.path}")
+        return entry.rule_set
+
+    def get(self, name=None):
+        """
+        获取规则集（文件变化时自动重新加载）
+
+        参数:
+            name: 规则集名称，None 或空字符串表示 default
+
+        返回:
+            RuleSet，名称不存在或文件无法读取时返回None
+        """
+        name = name or DEFAULT_RULE_SET
+        now = time.monotonic()
+        with self._lock:
+            self._scan_dir(now)
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            return self._refresh(name, entry, now)
+
+    def names(self):
+        """当前可用的规则集名称"""
+        with self._lock:
+            self._scan_dir(time.monotonic())
+            return sorted(self._entries)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_rules_registry():
+    """获取进程内共享的规则集注册表（懒加载）"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = RulesRegistry()
+    return _registry
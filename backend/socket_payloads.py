@@ -0,0 +1,150 @@
+"""
+Socket.IO 完整流程（full_process）的消息格式
+
+默认使用原有格式：文本处理完成时发送全部 scenes_detail，全部完成时再发送完整的 llm_result
+和包含提示词的 comic_results。客户端在请求中带上以下参数时使用精简格式：
+
+    compact: true  文本完成和全部完成事件不再重复发送客户端已通过增量事件收到的内容；
+                   每张图片生成完成时推送 scene_image_ready 增量事件
+    fields: ["scene_index", "url"]  连环画结果中需要的字段（也可以是逗号分隔的字符串），
+                   未指定时原有格式发送全部字段，精简格式只发送 COMPACT_DEFAULT_FIELDS
+"""
+
+# 连环画单个场景结果中的字段（见 seedream.generate_scene_image）
+COMIC_RESULT_FIELDS = ('scene_index', 'url', 'remote_url', 'size', 'prompt', 'cached')
+COMPACT_DEFAULT_FIELDS = ('scene_index', 'url', 'size')
+
+
+def parse_protocol_options(data):
+    """
+    从客户端请求中解析消息格式参数
+
+    返回:
+        {'compact': bool, 'fields': 字段元组或None}，可以直接保存到任务参数中
+
+    异常:
+        ValueError: fields 中有未知字段
+    """
+    compact = bool(data.get('compact', False))
+    fields = data.get('fields')
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    if fields is not None:
+        if not isinstance(fields, (list, tuple)):
+            raise ValueError("fields 应为字段列表")
+        unknown = [field for field in fields if field not in COMIC_RESULT_FIELDS]
+        if unknown:
+            raise ValueError(f"未知的字段: {', '.join(map(str, unknown))}，可选: {', '.join(COMIC_RESULT_FIELDS)}")
+        # scene_index 始终保留，客户端据此定位场景
+        fields = ('scene_index',) + tuple(field for field in fields if field != 'scene_index')
+    elif compact:
+        fields = COMPACT_DEFAULT_FIELDS
+    return {'compact': compact, 'fields': list(fields) if fields is not None else None}
+
+
+def select_fields(result, fields):
+    """只保留连环画结果中选中的字段，fields 为None时原样返回"""
+    if fields is None or not isinstance(result, dict):
+        return result
+    return {key: result[key] for key in fields if key in result}
+
+
+def scene_image_payload(process_id, job_id, scene_index, result, options):
+    """单张图片完成（或失败）的增量事件 scene_image_ready"""
+    payload = {'process_id': process_id, 'job_id': job_id, 'scene_index': scene_index}
+    if result:
+        payload['result'] = select_fields(result, options.get('fields'))
+    else:
+        payload['error'] = '图片生成失败'
+    return payload
+
+
+def text_processing_payload(process_id, llm_result, message=None):
+    """process_novel 流程的文本处理完成事件 text_processing_complete（只发送前5个场景预览）"""
+    return {
+        "process_id": process_id,
+        "scenes_count": len(llm_result.get('scenes_detail', [])),
+        "character_consistency": llm_result.get('character_consistency', {}),
+        "environment_consistency": llm_result.get('environment_consistency', {}),
+        "scenes_preview": [
+            {
+                "scene_index": i + 1,
+                "description": scene[:100] + "..." if len(scene) > 100 else scene
+            }
+            for i, scene in enumerate(llm_result.get('scenes_detail', [])[:5])
+        ],
+        "message": message
+    }
+
+
+CONSISTENCY_KEYS = ('character_consistency', 'environment_consistency')
+
+
+def record_streamed(streamed, event, payload):
+    """记录已通过 scene_ready/consistency_ready 推送给客户端的分镜内容（用于文本完成时核对）"""
+    if event == 'scene':
+        streamed.setdefault('scenes', {})[payload['scene_index']] = payload['scene']
+    elif event == 'field' and payload['key'] in CONSISTENCY_KEYS:
+        streamed[payload['key']] = payload['value']
+
+
+def streamed_matches(streamed, llm_result):
+    """
+    客户端通过增量事件收到的分镜是否与最终结果一致
+
+    分镜修复（finalize_storyboard）或分块合并去重后最终结果可能与流式推送的内容不同
+    """
+    if streamed is None:
+        return False
+    scenes = streamed.get('scenes', {})
+    if [scenes[index] for index in sorted(scenes)] != llm_result.get('scenes_detail', []):
+        return False
+    return all(streamed.get(key, {}) == llm_result.get(key, {}) for key in CONSISTENCY_KEYS)
+
+
+def text_complete_payload(process_id, llm_result, options, job_id=None, message=None, streamed=None):
+    """
+    文本处理完成事件 full_process_text_complete
+
+    精简格式下场景和一致性描述已经通过 scene_ready/consistency_ready 发送，只发送场景数；
+    streamed（见 record_streamed）与最终结果不一致或未知时仍发送完整分镜，并带上 resync 标记，
+    客户端用它替换增量收到的内容
+    """
+    payload = {
+        "process_id": process_id,
+        "scenes_count": len(llm_result.get('scenes_detail', [])),
+        "message": message
+    }
+    if job_id is not None:
+        payload["job_id"] = job_id
+    compact = options.get('compact')
+    if not compact or not streamed_matches(streamed, llm_result):
+        payload.update({
+            "character_consistency": llm_result.get('character_consistency', {}),
+            "environment_consistency": llm_result.get('environment_consistency', {}),
+            "scenes_detail": llm_result.get('scenes_detail', []),
+        })
+        if compact:
+            payload["resync"] = True
+    return payload
+
+
+def complete_payload(job_id, process_id, comic_data, options, llm_result=None, message=None):
+    """
+    全部完成事件 full_process_complete
+
+    comic_data 为保存的连环画结果（见 seedream.build_comic_results_data）。
+    精简格式下不再发送 llm_result；连环画结果按 fields 过滤
+    （图片地址在镜像到本地后可能变化，因此最终结果中仍包含 url）
+    """
+    fields = options.get('fields')
+    payload = {
+        "job_id": job_id,
+        "process_id": process_id,
+        "comic_results": [select_fields(item, fields) for item in comic_data.get('results', [])],
+        "total_scenes": comic_data.get('total_scenes', 0),
+        "message": message
+    }
+    if not options.get('compact'):
+        payload["llm_result"] = llm_result
+    return payload
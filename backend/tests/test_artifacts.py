@@ -0,0 +1,81 @@
+import pytest
+
+import artifacts
+from artifacts import ULID_ALPHABET, ULIDGenerator, is_valid_process_id, new_process_id
+
+
+def decode_base32(text):
+    value = 0
+    for ch in text:
+        value = value * 32 + ULID_ALPHABET.index(ch)
+    return value
+
+
+@pytest.fixture
+def frozen_time(monkeypatch):
+    now = [1700000000.0]
+    monkeypatch.setattr(artifacts.time, 'time', lambda: now[0])
+    return now
+
+
+def test_ulid_format_and_timestamp(frozen_time):
+    ulid = ULIDGenerator().new()
+    assert len(ulid) == 26
+    assert is_valid_process_id(ulid)
+    assert decode_base32(ulid[:10]) == 1700000000000
+
+
+def test_ulids_are_strictly_increasing_within_a_millisecond(frozen_time):
+    generator = ULIDGenerator()
+    ids = [generator.new() for _ in range(1000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert {ulid[:10] for ulid in ids} == {ids[0][:10]}
+
+
+def test_ulids_stay_increasing_when_clock_goes_back(frozen_time):
+    generator = ULIDGenerator()
+    first = generator.new()
+    frozen_time[0] -= 5
+    second = generator.new()
+    assert second > first
+    assert second[:10] == first[:10]
+
+
+def test_random_part_overflow_moves_to_next_millisecond(frozen_time):
+    generator = ULIDGenerator()
+    first = generator.new()
+    generator._last_random = (1 << 80) - 1
+    second = generator.new()
+    assert second > first
+    assert decode_base32(second[:10]) == decode_base32(first[:10]) + 1
+
+
+def test_new_process_id_sorts_by_creation():
+    ids = [new_process_id() for _ in range(100)]
+    assert ids == sorted(ids)
+    assert all(is_valid_process_id(pid) for pid in ids)
+
+
+@pytest.mark.parametrize('process_id', [
+    '01JAB3CDEFGHJKMNPQRSTVWXYZ',
+    '20251023_220613',
+])
+def test_valid_process_ids(process_id):
+    assert is_valid_process_id(process_id)
+
+
+@pytest.mark.parametrize('process_id', [
+    None,
+    12345,
+    '',
+    '01jab3cdefghjkmnpqrstvwxyz',    # 小写
+    '01JAB3CDEFGHJKMNPQRSTVWXYI',    # Crockford Base32 不含 I/L/O/U
+    '01JAB3CDEFGHJKMNPQRSTVWXY',     # 长度不足
+    '20251023_220613/../x',
+    '../20251023_220613',
+    '20251023_220613\n',
+    '２０２５１０２３_２２０６１３',  # 全角数字
+])
+def test_invalid_process_ids(process_id):
+    assert not is_valid_process_id(process_id)
@@ -0,0 +1,117 @@
+import base64
+import json
+
+import pytest
+
+import database
+from database import (
+    PROMPT_PREFIX_MIN_CHARS, compress_bytes, compress_text, decode_history_cursor, decode_history_fields,
+    decompress_bytes, decompress_text, encode_history_cursor, encode_history_fields, pack_comic_results,
+    unpack_comic_results
+)
+
+
+ENCODINGS = [
+    'zlib',
+    'none',
+    pytest.param('zstd', marks=pytest.mark.skipif(database.zstandard is None, reason="未安装 zstandard")),
+]
+
+PREFIX = '角色：小明，短发，蓝色校服。环境：明亮的教室，黑板上写着期末考试。'
+COMIC_RESULTS = [
+    {'scene_index': 1, 'prompt': PREFIX + '小明走进教室', 'image_url': '/api/images/a.png'},
+    {'scene_index': 2, 'prompt': PREFIX + '老师发下试卷', 'image_url': '/api/images/b.png'},
+    {'scene_index': 3, 'prompt': PREFIX + '小明看着窗外', 'image_url': None},
+]
+
+
+def test_history_cursor_round_trip():
+    token = encode_history_cursor('2025-10-23 22:06:13', 42)
+    assert '=' not in token
+    assert decode_history_cursor(token) == ('2025-10-23 22:06:13', 42)
+
+
+def test_history_cursor_is_url_safe():
+    token = encode_history_cursor('时间？>>>', 10 ** 12)
+    assert all(c.isalnum() or c in '-_' for c in token)
+    assert decode_history_cursor(token) == ('时间？>>>', 10 ** 12)
+
+
+@pytest.mark.parametrize('token', ['', 'not a cursor', '!!!!', '全角'])
+def test_malformed_history_cursor_returns_none(token):
+    assert decode_history_cursor(token) is None
+
+
+@pytest.mark.parametrize('value', [
+    ['2025-10-23 22:06:13', '42'],
+    [20251023, 42],
+    ['2025-10-23 22:06:13'],
+    {'created_at': '2025-10-23 22:06:13', 'id': 42},
+    42,
+])
+def test_history_cursor_with_wrong_shape_returns_none(value):
+    token = base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+    assert decode_history_cursor(token) is None
+
+
+@pytest.mark.parametrize('encoding', ENCODINGS)
+def test_compress_bytes_round_trip(encoding):
+    data = '小明走进教室。'.encode('utf-8') * 200
+    compressed = compress_bytes(data, encoding)
+    if encoding != 'none':
+        assert len(compressed) < len(data)
+    assert decompress_bytes(compressed, encoding) == data
+
+
+def test_unknown_encoding_raises():
+    with pytest.raises(ValueError):
+        compress_bytes(b'data', 'lz4')
+    with pytest.raises(ValueError):
+        decompress_bytes(b'data', 'lz4')
+
+
+@pytest.mark.parametrize('text', ['', '短文本', '很长的小说内容，' * 500])
+def test_compress_text_round_trip(text):
+    data, encoding = compress_text(text)
+    if len(text.encode('utf-8')) < database.DB_COMPRESSION_MIN_BYTES:
+        assert encoding == 'none'
+    assert decompress_text(data, encoding) == text
+
+
+def test_uncompressed_text_read_back_as_str():
+    # 旧记录中未压缩的字段以文本形式保存
+    assert decompress_text('旧记录', 'none') == '旧记录'
+
+
+def test_pack_comic_results_stores_common_prefix_once():
+    packed = pack_comic_results(COMIC_RESULTS)
+    assert packed['prompt_prefix'] == PREFIX
+    assert [item['prompt'] for item in packed['results']] == ['小明走进教室', '老师发下试卷', '小明看着窗外']
+    assert unpack_comic_results(packed) == COMIC_RESULTS
+    # 原列表不受影响
+    assert COMIC_RESULTS[0]['prompt'].startswith(PREFIX)
+
+
+@pytest.mark.parametrize('comic_results', [
+    [],
+    COMIC_RESULTS[:1],
+    [{'prompt': 'a' * PROMPT_PREFIX_MIN_CHARS + 'x'}, {'prompt': 'b' * PROMPT_PREFIX_MIN_CHARS + 'x'}],
+    [{'prompt': PREFIX + 'a'}, {'image_url': '/api/images/b.png'}],
+    [{'prompt': PREFIX + 'a'}, 'not a dict'],
+    {'unexpected': 'shape'},
+])
+def test_pack_comic_results_leaves_other_shapes_unchanged(comic_results):
+    assert pack_comic_results(comic_results) == comic_results
+    assert unpack_comic_results(comic_results) == comic_results
+
+
+@pytest.mark.parametrize('encoding', ENCODINGS)
+def test_history_fields_round_trip(encoding):
+    llm_result = {'scenes_detail': ['小明走进教室'], 'character_consistency': {'小明': '短发'}}
+    encoded = encode_history_fields('小说原文。' * 100, llm_result, COMIC_RESULTS, encoding)
+    assert encoded[0] == encoding
+    assert decode_history_fields(*encoded) == ('小说原文。' * 100, llm_result, COMIC_RESULTS)
+
+
+def test_empty_history_fields_decode_to_defaults():
+    assert decode_history_fields('none', None, '', None) == ('', {}, [])
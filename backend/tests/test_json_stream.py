@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from json_stream import StoryboardStreamParser, replay_storyboard_events
+
+
+STORYBOARD = {
+    "character_consistency": {"小明": "短发，蓝色校服"},
+    "environment_consistency": {"教室": "明亮，黑板上写着\"期末考试\""},
+    "scenes_detail": [
+        "小明走进教室 {紧张}",
+        {"description": "老师发下试卷", "camera": "特写"},
+        "小明看着窗外的 [夕阳]",
+    ],
+    "dialogue": ["", "老师：\"开始答题\"", ""],
+    "total": 3,
+    "final": True,
+}
+
+
+def feed_in_pieces(text, size):
+    parser = StoryboardStreamParser()
+    events = []
+    for start in range(0, len(text), size):
+        events.extend(parser.feed(text[start:start + size]))
+    return parser, events
+
+
+@pytest.mark.parametrize('size', [1, 7, 10 ** 6])
+def test_events_do_not_depend_on_chunk_boundaries(size):
+    text = json.dumps(STORYBOARD, ensure_ascii=False, indent=2)
+    parser, events = feed_in_pieces(text, size)
+    assert events == replay_storyboard_events(STORYBOARD)
+    assert parser.result() == STORYBOARD
+
+
+def test_scene_events_arrive_before_the_array_closes():
+    text = json.dumps(STORYBOARD, ensure_ascii=False)
+    cut = text.index('"小明看着窗外的')
+    parser = StoryboardStreamParser()
+    events = parser.feed(text[:cut])
+    assert [e for e in events if e[0] == 'scene'] == [
+        ('scene', {'scene_index': 1, 'scene': STORYBOARD["scenes_detail"][0]}),
+        ('scene', {'scene_index': 2, 'scene': STORYBOARD["scenes_detail"][1]}),
+    ]
+    assert [e[1]['key'] for e in events if e[0] == 'field'] == [
+        "character_consistency", "environment_consistency"
+    ]
+    assert parser.result() is None
+
+
+def test_text_before_the_object_is_ignored():
+    text = "```json\n" + json.dumps(STORYBOARD, ensure_ascii=False) + "\n```"
+    parser, events = feed_in_pieces(text, 5)
+    assert parser.result() == STORYBOARD
+    assert events == replay_storyboard_events(STORYBOARD)
+
+
+def test_scalar_fields_end_at_comma_or_brace():
+    parser = StoryboardStreamParser()
+    events = parser.feed('{"a": 12')
+    assert events == []
+    events += parser.feed(', "b": null, "c": false}')
+    assert events == [
+        ('field', {'key': 'a', 'value': 12}),
+        ('field', {'key': 'b', 'value': None}),
+        ('field', {'key': 'c', 'value': False}),
+    ]
+
+
+def test_truncated_input_has_no_result():
+    text = json.dumps(STORYBOARD, ensure_ascii=False)
+    parser = StoryboardStreamParser()
+    parser.feed(text[:-1])
+    assert parser.result() is None
+    parser.feed(text[-1:])
+    assert parser.result() == STORYBOARD
+
+
+def test_replay_ignores_non_dict_results():
+    assert replay_storyboard_events(None) == []
+    assert replay_storyboard_events(["scene"]) == []
@@ -0,0 +1,127 @@
+import json
+
+import pytest
+
+from llm_json import (
+    LLMJSONError, close_truncated_json, load_storyboard, parse_llm_json, strip_code_fences, validate_storyboard
+)
+
+
+STORYBOARD = {
+    "character_consistency": {"小明": "短发"},
+    "environment_consistency": {"教室": "明亮"},
+    "scenes_detail": ["场景一", "场景二"],
+    "dialogue": ["你好", ""],
+}
+
+
+def test_valid_json_is_not_repaired():
+    assert parse_llm_json(json.dumps(STORYBOARD, ensure_ascii=False)) == (STORYBOARD, False)
+
+
+def test_control_characters_inside_strings_are_allowed():
+    data, repaired = parse_llm_json('{"scenes_detail": ["第一行\n第二行"]}')
+    assert data == {"scenes_detail": ["第一行\n第二行"]}
+    assert repaired is False
+
+
+@pytest.mark.parametrize('text', [
+    '```json\n{"scenes_detail": ["a"]}\n```',
+    '```\n{"scenes_detail": ["a"]}',
+    '好的，以下是分镜：\n{"scenes_detail": ["a"]}\n希望对你有帮助',
+    '{"scenes_detail": ["a",],}',
+    '{"scenes_detail": ["a"]} {"scenes_detail": ["b"]}',
+])
+def test_wrapped_or_sloppy_json_is_repaired(text):
+    assert parse_llm_json(text) == ({"scenes_detail": ["a"]}, True)
+
+
+def test_trailing_comma_inside_string_is_kept():
+    data, _ = parse_llm_json('{"scenes_detail": ["a,]", "b",]}')
+    assert data == {"scenes_detail": ["a,]", "b"]}
+
+
+@pytest.mark.parametrize('text', [None, '', '   ', '没有JSON', '{"scenes_detail": [}}}'])
+def test_unparseable_text_raises(text):
+    with pytest.raises(LLMJSONError):
+        parse_llm_json(text)
+
+
+def test_strip_code_fences_keeps_plain_text():
+    assert strip_code_fences('{"a": 1}') == '{"a": 1}'
+    assert strip_code_fences('```json\n{"a": 1}\n```').strip() == '{"a": 1}'
+
+
+@pytest.mark.parametrize('text, expected', [
+    # 截断在字符串中间：丢弃不完整的场景
+    ('{"scenes_detail": ["场景一", "场景', {"scenes_detail": ["场景一"]}),
+    # 截断在逗号之后
+    ('{"scenes_detail": ["场景一", ', {"scenes_detail": ["场景一"]}),
+    # 只有键没有值
+    ('{"scenes_detail": ["场景一"], "dialogue"', {"scenes_detail": ["场景一"]}),
+    ('{"scenes_detail": ["场景一"], "dialogue": ', {"scenes_detail": ["场景一"]}),
+    # 被截断的数字和字面量
+    ('{"a": 1, "total": 12', {"a": 1, "total": 12}),
+    ('{"a": 1, "final": tr', {"a": 1}),
+    # 嵌套的对象和数组
+    ('{"character_consistency": {"小明": {"外貌": "短发"', {"character_consistency": {"小明": {"外貌": "短发"}}}),
+    ('{"scenes_detail": [{"text": "a", "tags": ["x", "y"', {"scenes_detail": [{"text": "a", "tags": ["x", "y"]}]}),
+])
+def test_close_truncated_json(text, expected):
+    assert json.loads(close_truncated_json(text)) == expected
+
+
+def test_truncated_output_is_repaired_by_parse():
+    text = json.dumps(STORYBOARD, ensure_ascii=False)
+    cut = text.index('场景二') + 1
+    data, repaired = parse_llm_json(text[:cut])
+    assert repaired is True
+    assert data["scenes_detail"] == ["场景一"]
+
+
+def test_validate_fills_missing_consistency_and_wraps_strings():
+    data, errors = validate_storyboard({"scenes": "唯一的场景", "dialogue": "对白"})
+    assert errors == []
+    assert data == {
+        "character_consistency": {},
+        "environment_consistency": {},
+        "scenes": ["唯一的场景"],
+        "dialogue": ["对白"],
+    }
+
+
+def test_validate_drops_blank_scenes_from_all_lists_together():
+    data, errors = validate_storyboard({
+        "scenes_detail": ["a", "", "  ", "b", None],
+        "scenes": ["A", "B", "C", "D", "E"],
+        "dialogue": ["1", "2", "3", "4"],
+    })
+    assert errors == []
+    assert data["scenes_detail"] == ["a", "b"]
+    assert data["scenes"] == ["A", "D"]
+    assert data["dialogue"] == ["1", "4"]
+
+
+def test_validate_does_not_modify_input():
+    original = {"scenes_detail": ["a", ""]}
+    validate_storyboard(original)
+    assert original == {"scenes_detail": ["a", ""]}
+
+
+@pytest.mark.parametrize('data, message', [
+    (["a"], "顶层应为对象"),
+    ({}, "缺少非空的 scenes_detail 或 scenes"),
+    ({"scenes_detail": ["", " "]}, "缺少非空的 scenes_detail 或 scenes"),
+    ({"scenes_detail": "a", "character_consistency": ["小明"]}, "character_consistency 应为对象"),
+    ({"scenes_detail": {"1": "a"}}, "scenes_detail 应为列表"),
+    ({"scenes_detail": ["a", 3]}, "scenes_detail 第 [2] 项"),
+])
+def test_validate_reports_errors(data, message):
+    _, errors = validate_storyboard(data)
+    assert any(message in error for error in errors), errors
+
+
+def test_load_storyboard_raises_with_reasons():
+    assert load_storyboard(json.dumps(STORYBOARD))[0]["scenes_detail"] == ["场景一", "场景二"]
+    with pytest.raises(LLMJSONError, match="校验失败"):
+        load_storyboard('{"scenes_detail": []}')
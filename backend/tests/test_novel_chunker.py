@@ -0,0 +1,133 @@
+import pytest
+
+from novel_chunker import StoryboardMerger, estimate_tokens, split_novel_text, split_sentences
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('小明上学') == 4
+    assert estimate_tokens('abcdefgh') == 2
+    assert estimate_tokens('小明 ran') == 3
+
+
+@pytest.mark.parametrize('paragraph', [
+    '他说：“走吧！”然后转身离开。',
+    '“真的吗？？”她问。「嗯」他答……没有结尾',
+    'No punctuation at all',
+    '',
+])
+def test_split_sentences_is_lossless(paragraph):
+    sentences = split_sentences(paragraph)
+    assert ''.join(sentences) == paragraph
+    assert all(sentences)
+
+
+def test_split_sentences_keeps_closing_quote_with_sentence():
+    assert split_sentences('他说：“走吧！”然后离开。剩下') == ['他说：“走吧！”', '然后离开。', '剩下']
+
+
+def test_short_text_is_a_single_chunk():
+    assert split_novel_text('很短的小说。', 100) == ['很短的小说。']
+
+
+def test_chunks_fit_budget_and_keep_all_text():
+    paragraphs = ['第%d段。' % i + '小明在路上走着，看到了很多风景。' * (i % 5 + 1) for i in range(40)]
+    # 一个超长段落，需要按句子切分；其中一句超长，需要按字符硬切
+    paragraphs.insert(10, '短句。' * 30 + '很' * 150 + '。')
+    text = '\n'.join(paragraphs)
+
+    chunks = split_novel_text(text, 100)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 100 for chunk in chunks)
+    assert ''.join(chunks).replace('\n', '') == text.replace('\n', '')
+
+
+def test_blank_lines_are_dropped():
+    text = '第一段。' * 10 + '\n\n   \n' + '第二段。' * 10
+    chunks = split_novel_text(text, 50)
+    assert all(line.strip() for chunk in chunks for line in chunk.split('\n'))
+
+
+def test_chapters_start_new_chunks():
+    chapter = '小明在路上走着，看到了很多风景。' * 4
+    text = '\n'.join(f'第{n}章\n{chapter}' for n in '一二三')
+    chunks = split_novel_text(text, 100)
+    assert [chunk.split('\n')[0] for chunk in chunks] == ['第一章', '第二章', '第三章']
+
+
+def test_merger_concatenates_chunks_in_order():
+    merger = StoryboardMerger()
+    assert merger.add({"scenes_detail": ["a", "b"], "dialogue": ["1", "2"]}) == ["a", "b"]
+    assert merger.add({"scenes_detail": ["c"], "dialogue": ["3"]}) == ["c"]
+    assert merger.result["scenes_detail"] == ["a", "b", "c"]
+    assert merger.result["dialogue"] == ["1", "2", "3"]
+
+
+def test_merger_drops_duplicate_only_at_chunk_boundary():
+    merger = StoryboardMerger()
+    merger.add({"scenes_detail": ["开门", "走进 房间"], "dialogue": ["", "你好"]})
+    # 下一块第一个场景与上一块最后一个场景相同（忽略空白），跳过它及对应的对白
+    added = merger.add({"scenes_detail": ["走进房间", "关门", "开门"], "dialogue": ["你好", "再见", "又来了"]})
+    assert added == ["关门", "开门"]
+    assert merger.result["scenes_detail"] == ["开门", "走进 房间", "关门", "开门"]
+    assert merger.result["dialogue"] == ["", "你好", "再见", "又来了"]
+
+
+def test_merger_keeps_repeated_scenes_inside_a_chunk():
+    merger = StoryboardMerger()
+    merger.add({"scenes_detail": ["下雨", "下雨", "下雨"]})
+    assert merger.result["scenes_detail"] == ["下雨", "下雨", "下雨"]
+
+
+def test_merger_skips_blank_scenes_with_their_dialogue():
+    merger = StoryboardMerger()
+    merger.add({"scenes_detail": ["a", " ", "b"], "dialogue": ["1", "2", "3"]})
+    assert merger.result["scenes_detail"] == ["a", "b"]
+    assert merger.result["dialogue"] == ["1", "3"]
+
+
+def test_merger_pads_scene_lists_missing_from_earlier_chunks():
+    merger = StoryboardMerger()
+    merger.add({"scenes_detail": ["a", "b"]})
+    merger.add({"scenes_detail": ["c"], "dialogue": ["3"]})
+    merger.add({"scenes_detail": ["d"]})
+    assert merger.result["dialogue"] == ["", "", "3", ""]
+
+
+def test_merger_falls_back_to_scenes_field():
+    merger = StoryboardMerger()
+    merger.add({"scenes": ["a", "b"]})
+    assert merger.result["scenes_detail"] == ["a", "b"]
+    assert merger.result["scenes"] == ["a", "b"]
+
+
+def test_merger_merges_consistency_by_name():
+    merger = StoryboardMerger()
+    merger.add({
+        "character_consistency": {"小明": "短发", " 小红 ": "长发", "老师": {"外貌": "戴眼镜"}},
+        "environment_consistency": {"教室": "明亮的教室"},
+        "scenes_detail": ["a"],
+    })
+    merger.add({
+        "character_consistency": {"小明": "穿蓝色校服", "小红": "长发", "老师": {"外貌": "戴眼镜", "服装": "西装"}},
+        "environment_consistency": {"教室": "明亮的教室，黑板上写着字", "操场": "绿色草地"},
+        "scenes_detail": ["b"],
+    })
+    assert merger.result["character_consistency"] == {
+        "小明": "短发；穿蓝色校服",
+        "小红": "长发",
+        "老师": {"外貌": "戴眼镜", "服装": "西装"},
+    }
+    assert merger.result["environment_consistency"] == {
+        "教室": "明亮的教室，黑板上写着字",
+        "操场": "绿色草地",
+    }
+
+
+def test_merger_keeps_first_value_of_other_fields():
+    merger = StoryboardMerger()
+    merger.add({"scenes_detail": ["a"], "title": "第一块"})
+    merger.add({"scenes_detail": ["b"], "title": "第二块"})
+    merger.add("不是对象")
+    assert merger.result["title"] == "第一块"
+    assert merger.result["scenes_detail"] == ["a", "b"]
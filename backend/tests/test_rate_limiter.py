@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+from rate_limiter import TokenBucket
+
+
+def test_burst_up_to_capacity_then_wait():
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+    wait = bucket.try_acquire()
+    # 桶已空，补满一个令牌大约需要 1/rate 秒
+    assert 0 < wait <= 0.5
+
+
+def test_capacity_defaults_to_rate_but_at_least_one():
+    assert TokenBucket(rate=5).capacity == 5
+    assert TokenBucket(rate=0.2).capacity == 1
+
+
+def test_tokens_refill_over_time():
+    bucket = TokenBucket(rate=50, capacity=1)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() > 0
+    time.sleep(0.05)
+    assert bucket.try_acquire() == 0
+
+
+def test_acquire_times_out():
+    bucket = TokenBucket(rate=0.5, capacity=1)
+    assert bucket.acquire(timeout=0.1) is True
+    started = time.monotonic()
+    assert bucket.acquire(timeout=0.1) is False
+    assert time.monotonic() - started == pytest.approx(0.1, abs=0.1)
+
+
+def test_adjust_rate_changes_refill_speed():
+    bucket = TokenBucket(rate=1, capacity=1)
+    assert bucket.adjust_rate(lambda rate: rate * 4) == 4
+    bucket.try_acquire()
+    assert bucket.try_acquire() <= 0.25
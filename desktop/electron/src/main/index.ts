@@ -86,7 +86,18 @@ app.whenReady().then(() => {
         } else if (route === 'history/list') {
           const limit = (payload as any)?.limit ?? 10
           const offset = (payload as any)?.offset ?? 0
-          apiEndpoint = `/api/history?limit=${encodeURIComponent(limit)}&offset=${encodeURIComponent(offset)}`
+          const cursor = (payload as any)?.cursor
+          const params = new URLSearchParams({ limit: String(limit) })
+          // 优先使用游标分页（next_cursor），翻页耗时与页码无关
+          if (cursor) params.set('cursor', cursor)
+          else params.set('offset', String(offset))
+          // 可选的标题和日期过滤，日期按本机时区换算
+          for (const key of ['title', 'date_from', 'date_to']) {
+            const value = (payload as any)?.[key]
+            if (value) params.set(key, String(value))
+          }
+          params.set('tz_offset', String(new Date().getTimezoneOffset()))
+          apiEndpoint = `/api/history?${params.toString()}`
           method = 'GET'
         } else if (route === 'history/detail') {
           const processId = (payload as any)?.processId
@@ -101,8 +112,10 @@ app.whenReady().then(() => {
         } else if (route === 'image/proxy') {
           const imageUrl = String((payload as any)?.url || '')
           if (!imageUrl) return { route, ok: false, error: 'Missing image url' }
+          // 后端本地镜像的图片返回相对路径（/api/images/...），需要拼接后端地址
+          const resolvedUrl = imageUrl.startsWith('/') ? `${BACKEND_URL}${imageUrl}` : imageUrl
           try {
-            const resp = await fetch(imageUrl, { method: 'GET' })
+            const resp = await fetch(resolvedUrl, { method: 'GET' })
             if (!resp.ok) {
               return { route, ok: false, status: resp.status, statusText: resp.statusText }
             }
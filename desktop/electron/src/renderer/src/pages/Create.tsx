@@ -336,6 +336,8 @@ const CreatePage: React.FC = () => {
   })
   const [longImageDataUrl, setLongImageDataUrl] = useState<string | null>(null)
   const socketRef = useRef<Socket | null>(null)
+  // 各生成会话收到的最后一个事件序号（process_id -> seq），断线重连后据此补发错过的事件
+  const lastSeqRef = useRef<Record<string, number>>({})
 
   // 当选择章节变化时，同步本地状态
   useEffect(() => {
@@ -441,7 +443,8 @@ const CreatePage: React.FC = () => {
       transports: ['websocket', 'polling'],
       timeout: 10000,
       forceNew: true,
-      reconnection: false
+      // 断线后自动重连，重新认证后恢复进行中的生成会话
+      reconnection: true
     })
 
     socketRef.current = socket
@@ -458,11 +461,29 @@ const CreatePage: React.FC = () => {
       console.log('收到认证结果:', data)
       if (data.success) {
         console.log('认证成功！')
+        // 只恢复本页面发起或收到过事件的会话
+        ;(data.sessions || []).forEach((s: any) => {
+          if (s.process_id in lastSeqRef.current) {
+            console.log('恢复生成会话', s)
+            socket.emit('resume_session', { process_id: s.process_id, last_seq: lastSeqRef.current[s.process_id] })
+          }
+        })
       } else {
         console.error('认证失败:', data.error)
       }
     })
 
+    // 记录各会话的事件序号
+    socket.onAny((_event, data) => {
+      if (!data || !data.process_id) return
+      if (typeof data.seq === 'number') {
+        lastSeqRef.current[data.process_id] = data.seq
+      } else if (!(data.process_id in lastSeqRef.current)) {
+        // 状态事件不带序号，只记录会话
+        lastSeqRef.current[data.process_id] = 0
+      }
+    })
+
     // 连接错误
     socket.on('connect_error', (error) => {
       console.error('WebSocket连接错误:', error)
@@ -666,6 +687,42 @@ const CreatePage: React.FC = () => {
       requestedChapterIdRef.current = null
     })
 
+    // 监听流式分镜事件：每个场景生成完毕即追加到绑定章节，无需等待整个文本处理完成
+    socket.on('scene_ready', (data) => {
+      const novelId = requestedNovelIdRef.current
+      const chapterId = requestedChapterIdRef.current
+      if (!recognizeRequestedRef.current || !novelId || !chapterId) return
+      const idx = (data.scene_index ?? 1) - 1
+      const desc = data.scene
+      const section = {
+        id: `s-${idx + 1}`,
+        title: typeof desc === 'string' ? (desc.slice(0, 24) || `镜头 ${idx + 1}`) : `镜头 ${idx + 1}`,
+        detail: typeof desc === 'string' ? desc : JSON.stringify(desc),
+        description: typeof desc === 'string' ? desc : JSON.stringify(desc)
+      }
+      setNovels(prev => prev.map(n => n.id === novelId ? ({
+        ...n,
+        chapters: n.chapters.map(ch => {
+          if (ch.id !== chapterId) return ch
+          // 新一次识别的第一个场景到达时替换旧的分镜
+          const base = ch.processId === data.process_id ? ch.sections.slice(0, idx) : []
+          return { ...ch, sections: [...base, section], processId: data.process_id }
+        })
+      }) : n))
+    })
+
+    // 精简格式下一致性描述只通过该事件发送，文本完成事件中不再重复
+    socket.on('consistency_ready', (data) => {
+      const novelId = requestedNovelIdRef.current
+      const chapterId = requestedChapterIdRef.current
+      if (!recognizeRequestedRef.current || !novelId || !chapterId) return
+      const field = data.key === 'character_consistency' ? 'characterConsistency' : 'environmentConsistency'
+      setNovels(prev => prev.map(n => n.id === novelId ? ({
+        ...n,
+        chapters: n.chapters.map(ch => ch.id === chapterId ? ({ ...ch, [field]: data.value || {} }) : ch)
+      }) : n))
+    })
+
     // 新增：监听完整流程文本处理完成事件（full_process_text_complete）
     socket.on('full_process_text_complete', (data) => {
       console.log('收到full_process_text_complete事件:', data)
@@ -674,6 +731,8 @@ const CreatePage: React.FC = () => {
         console.warn('忽略后台完整流程文本结果（未点击识别/生成分镜）')
         return
       }
+      // 精简格式不发送 scenes_detail，分镜已通过 scene_ready 逐个追加；最终分镜有变化时（resync）发送完整分镜并替换
+      const compact = !Array.isArray(data.scenes_detail)
       const sections = (data.scenes_detail || []).map((desc: any, idx: number) => ({
         id: `s-${idx + 1}`,
         title: typeof desc === 'string' ? (desc.slice(0, 24) || `镜头 ${idx + 1}`) : `镜头 ${idx + 1}`,
@@ -689,17 +748,21 @@ const CreatePage: React.FC = () => {
         setRecognizing(false)
         return
       }
-      console.log('将完整流程文本结果应用到绑定章节', { novelId, chapterId, sectionsCount: (data.scenes_detail || []).length })
+      console.log('将完整流程文本结果应用到绑定章节', { novelId, chapterId, sectionsCount: data.scenes_count ?? sections.length })
       setNovels(prev => prev.map(n => n.id === novelId ? ({
         ...n,
-        chapters: n.chapters.map(ch => ch.id === chapterId ? ({
+        chapters: n.chapters.map(ch => ch.id === chapterId ? (compact ? ({
+          ...ch,
+          processId: data.process_id,
+          scenesCount: data.scenes_count ?? ch.sections.length
+        }) : ({
           ...ch,
           sections,
           processId: data.process_id,
           scenesCount: (data.scenes_detail || []).length,
           characterConsistency: data.character_consistency || {},
           environmentConsistency: data.environment_consistency || {}
-        }) : ch)
+        })) : ch)
       }) : n))
       setRecognizeRequested(false)
       // 清理本次识别绑定的目标
@@ -1027,7 +1090,10 @@ const CreatePage: React.FC = () => {
       socketRef.current.emit('full_process', {
         novel_text: text,
         title: browseNovel?.title || selectedChapter.title || '',
-        description: ''
+        description: '',
+        // 精简格式：分镜和一致性描述通过增量事件获取，结果中只需要图片地址
+        compact: true,
+        fields: ['scene_index', 'url']
       })
     } catch (e) {
       console.error('完整流程启动失败:', e)
@@ -58,6 +58,8 @@ const ProfilePage: React.FC = () => {
   const [limit] = useState(20)
   const [isMoreLoading, setIsMoreLoading] = useState(false)
   const [hasMore, setHasMore] = useState(true)
+  // 下一页的游标（后端返回的 next_cursor），翻页不受新增/删除记录影响
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
 
   // 头像相关状态与配置
   const BACKEND_URL = 'http://139.224.101.91:5000'
@@ -76,7 +78,7 @@ const ProfilePage: React.FC = () => {
     setLoading(true)
     setError(null)
     try {
-      const resp: any = await (window as any).api.invokeBackend('history/list', { limit, offset: 0 }, sessionToken)
+      const resp: any = await (window as any).api.invokeBackend('history/list', { limit }, sessionToken)
       if (!resp?.ok) throw new Error('获取历史列表失败')
       const list = Array.isArray(resp?.data?.history) ? resp.data.history : []
 
@@ -91,7 +93,8 @@ const ProfilePage: React.FC = () => {
       }
       setPreviewCache(nextCache)
       setHistory(list)
-      setHasMore(list.length >= limit)
+      setNextCursor(resp?.data?.next_cursor || null)
+      setHasMore(!!resp?.data?.has_more)
     } catch (e) {
       console.error('获取历史列表失败:', e)
       setError('获取历史列表失败')
@@ -171,11 +174,10 @@ const ProfilePage: React.FC = () => {
 
   // 加载更多
   const loadMore = async () => {
-    if (!canLoad || isMoreLoading || !hasMore) return
+    if (!canLoad || isMoreLoading || !hasMore || !nextCursor) return
     setIsMoreLoading(true)
     try {
-      const offset = history.length
-      const resp: any = await (window as any).api.invokeBackend('history/list', { limit, offset }, sessionToken)
+      const resp: any = await (window as any).api.invokeBackend('history/list', { limit, cursor: nextCursor }, sessionToken)
       if (!resp?.ok) throw new Error('获取更多历史失败')
       const list = Array.isArray(resp?.data?.history) ? resp.data.history : []
 
@@ -189,7 +191,8 @@ const ProfilePage: React.FC = () => {
       }
       setPreviewCache(nextCache)
       setHistory((prev) => [...prev, ...list])
-      setHasMore(list.length >= limit)
+      setNextCursor(resp?.data?.next_cursor || null)
+      setHasMore(!!resp?.data?.has_more)
     } catch (e) {
       console.error('获取更多历史失败:', e)
     } finally {